@@ -0,0 +1,199 @@
+"""
+Benchmark harness for tap-eloqua against the local Bulk API simulator.
+
+Runs discovery and then a sync of each requested stream as a separate tap
+process, and reports wall time, requests issued, bytes transferred,
+records per second and peak RSS as one JSON line per stream. Each stream
+runs with the replication method of its discovered catalog: contacts and
+the activity streams sync incrementally from the given bookmark. Tap
+config can be tuned with --tap-config to compare settings.
+
+    python benchmarks/harness.py --streams contacts,opens \\
+        --rows-per-hour 5000 --tap-config '{"max_concurrent_exports": 4}'
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from simulator import add_settings_arguments, settings_from_args, start_simulator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAP_COMMAND = [sys.executable, '-c', 'import tap_eloqua; tap_eloqua.main()']
+RECORD_MARKERS = (b'"type": "RECORD"', b'"type":"RECORD"')
+
+
+def write_json(directory, name, payload):
+    """
+    Returns:
+        path of the written file (str)
+    """
+    path = os.path.join(directory, name)
+    with open(path, 'w') as json_file:
+        json.dump(payload, json_file)
+    return path
+
+
+def select_stream(catalog, stream_name):
+    """
+    Marks only stream_name as selected in a discovered catalog
+    Args:
+        catalog (dict)
+        stream_name (str)
+    Returns:
+        catalog (dict)
+    """
+    for entry in catalog['streams']:
+        selected = entry.get('tap_stream_id', entry.get('stream')) == stream_name
+        entry.setdefault('schema', {})['selected'] = selected
+        for metadata in entry.get('metadata', []):
+            if not metadata.get('breadcrumb'):
+                metadata.setdefault('metadata', {})['selected'] = selected
+    return catalog
+
+
+def replication_mode(catalog, stream_name):
+    """
+    Args:
+        catalog (dict)
+        stream_name (str)
+    Returns:
+        'full' or 'incremental' (str), from the stream's catalog metadata
+    """
+    for entry in catalog['streams']:
+        if entry.get('tap_stream_id', entry.get('stream')) != stream_name:
+            continue
+        for metadata in entry.get('metadata', []):
+            if metadata.get('breadcrumb'):
+                continue
+            stream_metadata = metadata.get('metadata', {})
+            method = stream_metadata.get('replication-method') or \
+                stream_metadata.get('forced-replication-method')
+            if method and method.lower() == 'full_table':
+                return 'full'
+    return 'incremental'
+
+
+def run_tap(arguments):
+    """
+    Runs the tap, counting its output as it is produced
+    Args:
+        arguments (list)
+    Returns:
+        output summary (dict)
+    """
+    started = time.time()
+    process = subprocess.Popen(
+        TAP_COMMAND + arguments, cwd=REPO_ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    records = 0
+    output_bytes = 0
+    for line in process.stdout:
+        output_bytes += len(line)
+        if any(marker in line for marker in RECORD_MARKERS):
+            records += 1
+
+    # wait4 reports the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.WIFEXITED(status):
+        exit_code = os.WEXITSTATUS(status)
+    else:
+        exit_code = -os.WTERMSIG(status)
+
+    return {
+        'exit_code': exit_code,
+        'wall_secs': time.time() - started,
+        'records': records,
+        'output_bytes': output_bytes,
+        'peak_rss_mb': usage.ru_maxrss / 1024.0
+    }
+
+
+def benchmark_stream(site, base_url, stream_name, args, directory):
+    """
+    Discovers and syncs one stream against the simulator
+    Args:
+        site (SimulatedSite)
+        base_url (str)
+        stream_name (str)
+        args (argparse.Namespace)
+        directory (str): scratch directory for config, catalog and state
+    Returns:
+        measurements (dict)
+    """
+    config = {
+        'sitename': 'simulated',
+        'username': 'benchmark',
+        'password': 'benchmark',
+        'login_url': base_url + '/id',
+        'start_date': args.start_date,
+        'full_table_start_date': args.start_date,
+        # The tap splits exports at the simulator's limit
+        'export_limit': args.export_limit
+    }
+    config.update(json.loads(args.tap_config))
+    config_path = write_json(directory, 'config.json', config)
+
+    discovery = subprocess.run(
+        TAP_COMMAND + ['--config', config_path, '--discover'],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        check=True
+    )
+    catalog = select_stream(json.loads(discovery.stdout.decode('utf-8')), stream_name)
+    catalog_path = write_json(directory, 'catalog.json', catalog)
+    state_path = write_json(directory, 'state.json', json.loads(args.state))
+
+    requests_before = copy.deepcopy(site.stats)
+    result = run_tap([
+        '--config', config_path, '--properties', catalog_path,
+        '--state', state_path
+    ])
+
+    wall_secs = result['wall_secs']
+    result.update({
+        'stream': stream_name,
+        'mode': replication_mode(catalog, stream_name),
+        'records_per_sec': result['records'] / wall_secs if wall_secs else 0,
+        'requests': site.stats['requests'] - requests_before['requests'],
+        'bytes_in': site.stats['bytes_in'] - requests_before['bytes_in'],
+        'bytes_out': site.stats['bytes_out'] - requests_before['bytes_out'],
+        'requests_by_endpoint': {
+            endpoint: count - requests_before['by_endpoint'].get(endpoint, 0)
+            for endpoint, count in site.stats['by_endpoint'].items()
+        }
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--streams', default='contacts,sends,opens,clicks,'
+                                             'subscribes,unsubscribes,bounces')
+    parser.add_argument('--start-date', default='2020-01-01T00:00:00Z')
+    parser.add_argument('--state', default='{}', help='State JSON for the sync')
+    parser.add_argument('--tap-config', default='{}',
+                        help='Extra tap config JSON, e.g. tuning options')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server, site = start_simulator(settings_from_args(args))
+    base_url = 'http://%s:%s' % server.server_address[:2]
+    try:
+        for stream_name in args.streams.split(','):
+            with tempfile.TemporaryDirectory() as directory:
+                result = benchmark_stream(site, base_url, stream_name, args, directory)
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
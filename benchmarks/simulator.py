@@ -0,0 +1,372 @@
+"""
+Local simulator of the Eloqua Bulk API endpoints used by tap-eloqua.
+
+Serves /id, /fields, /exports, /syncs, /syncs/{id}, /syncs/{id}/logs and
+/syncs/{id}/data with configurable sync latency, failure and warning
+rates, row density, field width and export limit, and counts the requests
+and bytes it serves so benchmark runs can be compared.
+
+Run standalone with `python benchmarks/simulator.py --port 8080`.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+BULK_PATH = '/api/bulk/2.0/'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+RECORD_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+ACTIVITY_TYPES = [
+    'EmailSend', 'EmailOpen', 'EmailClickthrough',
+    'Subscribe', 'Unsubscribe', 'Bounceback'
+]
+CONTACT_FIELDS = [
+    ('C_EmailAddress', '{{Contact.Field(C_EmailAddress)}}'),
+    ('C_DateCreated', '{{Contact.Field(C_DateCreated)}}'),
+    ('C_DateModified', '{{Contact.Field(C_DateModified)}}'),
+    ('ContactID', '{{Contact.Id}}')
+]
+ACTIVITY_FIELDS = [
+    ('Id', '{{Activity.Id}}'),
+    ('ActivityDate', '{{Activity.CreatedAt}}'),
+    ('ActivityType', '{{Activity.Type}}'),
+    ('EmailAddress', '{{Activity.Field(EmailAddress)}}'),
+    ('ContactId', '{{Activity.Contact.Id}}')
+]
+
+START_FILTER = re.compile(r">='([^']+)'")
+EVENT_FILTER = re.compile(r"'\{\{Activity.Type\}\}'='([^']+)'")
+END_FILTER = re.compile(r"<'([^']+)'")
+
+
+class SimulatorSettings:
+    """
+    Behaviour of the simulated site
+    """
+
+    def __init__(self, sync_latency=2.0, failure_rate=0.0, warning_rate=0.0,
+                 rows_per_hour=1000.0, field_width=20, export_limit=5000000,
+                 seed=None):
+        """
+        Args:
+            sync_latency (float): seconds before a sync finishes
+            failure_rate (float): fraction of syncs ending in 'error'
+            warning_rate (float): fraction of syncs ending in 'warning'
+            rows_per_hour (float): rows in an export per hour of its window
+            field_width (int): extra custom fields per record
+            export_limit (int): largest export that returns data
+            seed (int)
+        """
+        self.sync_latency = sync_latency
+        self.failure_rate = failure_rate
+        self.warning_rate = warning_rate
+        self.rows_per_hour = rows_per_hour
+        self.field_width = field_width
+        self.export_limit = export_limit
+        self.random = random.Random(seed)
+
+
+class SimulatedSite:
+    """
+    In-memory exports and syncs of one simulated Eloqua site
+    """
+
+    def __init__(self, settings):
+        """
+        Args:
+            settings (SimulatorSettings)
+        """
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.exports = {}
+        self.syncs = {}
+        self.next_id = 1
+        self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'by_endpoint': {}}
+
+    def new_id(self):
+        with self.lock:
+            new_id = self.next_id
+            self.next_id += 1
+            return new_id
+
+    def count(self, endpoint, bytes_in, bytes_out):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+            by_endpoint = self.stats['by_endpoint']
+            by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + 1
+
+    def fields(self, endpoint):
+        """
+        Returns:
+            field metadata items (list)
+        """
+        custom = [
+            ('C_Custom%s' % i, '{{Contact.Field(C_Custom%s)}}' % i)
+            for i in range(self.settings.field_width)
+        ]
+        if endpoint == 'contacts':
+            return [
+                {'internalName': name, 'statement': statement}
+                for name, statement in CONTACT_FIELDS + custom
+            ]
+        return [
+            {'internalName': name, 'statement': statement,
+             'activityTypes': list(ACTIVITY_TYPES)}
+            for name, statement in ACTIVITY_FIELDS
+        ]
+
+    def create_export(self, endpoint, body):
+        export_id = self.new_id()
+        self.exports[export_id] = dict(body, endpoint=endpoint)
+        return {'uri': '/%s/exports/%s' % (endpoint, export_id)}
+
+    def create_sync(self, body):
+        export_id = int(body['syncedInstanceUri'].rstrip('/').split('/')[-1])
+        export = dict(self.exports[export_id])
+        roll = self.settings.random.random()
+        if roll < self.settings.failure_rate:
+            outcome = 'error'
+        elif roll < self.settings.failure_rate + self.settings.warning_rate:
+            outcome = 'warning'
+        else:
+            outcome = 'success'
+
+        sync_id = self.new_id()
+        self.syncs[sync_id] = {
+            'export': export,
+            'created': time.time(),
+            'outcome': outcome,
+            'total': self.count_rows(export)
+        }
+        return {'uri': '/syncs/%s' % sync_id, 'status': 'pending'}
+
+    def count_rows(self, export):
+        start, end = self.window(export)
+        hours = max((end - start).total_seconds(), 0) / 3600
+        return int(hours * self.settings.rows_per_hour)
+
+    @staticmethod
+    def window(export):
+        start = START_FILTER.search(export['filter']).group(1)
+        end_match = END_FILTER.search(export['filter'])
+        end = end_match.group(1) if end_match else datetime.now().strftime(DATE_FORMAT)
+        return (datetime.strptime(start[:19], DATE_FORMAT),
+                datetime.strptime(end[:19], DATE_FORMAT))
+
+    def sync_status(self, sync_id):
+        sync = self.syncs[sync_id]
+        elapsed = time.time() - sync['created']
+        if elapsed < self.settings.sync_latency * 0.1:
+            status = 'pending'
+        elif elapsed < self.settings.sync_latency:
+            status = 'active'
+        else:
+            status = sync['outcome']
+        return {'uri': '/syncs/%s' % sync_id, 'status': status}
+
+    def sync_logs(self, sync_id):
+        outcome = self.syncs[sync_id]['outcome']
+        items = [{'severity': 'information', 'message': 'Sync started.'}]
+        if outcome != 'success':
+            items.append({'severity': outcome, 'message': 'Simulated %s.' % outcome})
+        return {'items': items}
+
+    def sync_data(self, sync_id, offset, limit):
+        sync = self.syncs[sync_id]
+        total = sync['total']
+        if total > self.settings.export_limit:
+            return {'totalResults': total, 'hasMore': False, 'count': 0,
+                    'offset': offset, 'limit': limit, 'items': []}
+
+        export = sync['export']
+        start, end = self.window(export)
+        step = (end - start) / total if total else timedelta(0)
+        end_offset = min(offset + limit, total)
+        event = EVENT_FILTER.search(export['filter'])
+        items = [
+            self.record(export['fields'], start + step * i, i,
+                        event.group(1) if event else None)
+            for i in range(offset, end_offset)
+        ]
+        return {'totalResults': total, 'hasMore': end_offset < total,
+                'count': len(items), 'offset': offset, 'limit': limit,
+                'items': items}
+
+    @staticmethod
+    def record(fields, date, index, event):
+        date_str = date.strftime(RECORD_DATE_FORMAT)[:-3]
+        record = {}
+        for name in fields:
+            if name == 'activitytype':
+                record[name] = event
+            elif name in ('activitydate', 'c_datecreated', 'c_datemodified'):
+                record[name] = date_str
+            elif name in ('id', 'contactid'):
+                # Stable across the column groups of one window, which
+                # are joined on it
+                record[name] = '%s%08d' % (date.strftime('%Y%m%d%H%M%S'), index)
+            elif name in ('emailaddress', 'c_emailaddress'):
+                record[name] = 'user%s@example.com' % index
+            else:
+                record[name] = '%s-%s' % (name, index)
+        return record
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    site = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self):
+        url = urlparse(self.path)
+        path = re.sub('/+', '/', url.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        body = json.loads(raw_body.decode('utf-8')) if raw_body else {}
+        return path, query, body, len(raw_body)
+
+    def respond(self, endpoint, payload, bytes_in, status=200):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.site.count(endpoint, bytes_in, len(data))
+
+    def handle_any(self, method):
+        path, query, body, bytes_in = self.route()
+        site = self.site
+        bulk = path[len(BULK_PATH) - 1:] if path.startswith(BULK_PATH) else None
+        parts = bulk.strip('/').split('/') if bulk else []
+
+        if path == '/id':
+            host = 'http://%s:%s' % self.server.server_address[:2]
+            return self.respond('id', {'urls': {'base': host}}, bytes_in)
+        if path == '/__stats__':
+            return self.respond('stats', site.stats, bytes_in)
+        if len(parts) == 2 and parts[1] == 'fields':
+            return self.respond('fields', {'items': site.fields(parts[0])}, bytes_in)
+        if len(parts) == 2 and parts[1] == 'exports' and method == 'POST':
+            return self.respond('exports', site.create_export(parts[0], body), bytes_in, 201)
+        if len(parts) == 3 and parts[1] == 'exports':
+            export_id = int(parts[2])
+            if method == 'PUT':
+                site.exports[export_id] = dict(body, endpoint=parts[0])
+                return self.respond('exports', dict(body, uri=bulk), bytes_in)
+            if method == 'DELETE':
+                site.exports.pop(export_id, None)
+                return self.respond('exports', None, bytes_in, 204)
+        if parts == ['syncs'] and method == 'POST':
+            return self.respond('syncs', site.create_sync(body), bytes_in, 201)
+        if len(parts) == 2 and parts[0] == 'syncs':
+            return self.respond('sync_status', site.sync_status(int(parts[1])), bytes_in)
+        if len(parts) == 3 and parts[0] == 'syncs' and parts[2] == 'logs':
+            return self.respond('sync_logs', site.sync_logs(int(parts[1])), bytes_in)
+        if len(parts) == 3 and parts[0] == 'syncs' and parts[2] == 'data':
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['50000'])[0])
+            return self.respond(
+                'sync_data', site.sync_data(int(parts[1]), offset, limit), bytes_in
+            )
+
+        return self.respond('unknown', {'error': 'Not found'}, bytes_in, 404)
+
+    def do_GET(self):
+        self.handle_any('GET')
+
+    def do_POST(self):
+        self.handle_any('POST')
+
+    def do_PUT(self):
+        self.handle_any('PUT')
+
+    def do_DELETE(self):
+        self.handle_any('DELETE')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_simulator(settings, host='127.0.0.1', port=0):
+    """
+    Starts the simulator on a background thread
+    Args:
+        settings (SimulatorSettings)
+        host (str)
+        port (int): 0 picks a free port
+    Returns:
+        server (ThreadingHTTPServer), site (SimulatedSite)
+    """
+    site = SimulatedSite(settings)
+    handler = type('BoundSimulatorHandler', (SimulatorHandler,), {'site': site})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, site
+
+
+def add_settings_arguments(parser):
+    """
+    Adds the simulator behaviour options to an argument parser
+    Args:
+        parser (argparse.ArgumentParser)
+    """
+    parser.add_argument('--sync-latency', type=float, default=2.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--warning-rate', type=float, default=0.0)
+    parser.add_argument('--rows-per-hour', type=float, default=1000.0)
+    parser.add_argument('--field-width', type=int, default=20)
+    parser.add_argument('--export-limit', type=int, default=5000000)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def settings_from_args(args):
+    """
+    Args:
+        args (argparse.Namespace)
+    Returns:
+        settings (SimulatorSettings)
+    """
+    return SimulatorSettings(
+        sync_latency=args.sync_latency,
+        failure_rate=args.failure_rate,
+        warning_rate=args.warning_rate,
+        rows_per_hour=args.rows_per_hour,
+        field_width=args.field_width,
+        export_limit=args.export_limit,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server, _ = start_simulator(settings_from_args(args), args.host, args.port)
+    print('Eloqua simulator listening on http://%s:%s' % server.server_address[:2])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
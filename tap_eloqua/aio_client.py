@@ -0,0 +1,654 @@
+import asyncio
+import contextvars
+
+from contextlib import asynccontextmanager
+
+import singer
+
+from .cache import FieldCache
+from .client import EloquaClient, FailedSyncException, \
+    MaxPollingAttemptsException, assemble_export_body, export_filter_key, \
+    select_request_fields, selected_export_fields, ACTIVITIES, BASE_URL_PATH, \
+    BULK_PATH, CONTACTS, DEFAULT_HTTP_POOL_SIZE, DELETE, EXPORT_DATA_ENDPOINT, \
+    EXPORTS_ENDPOINT, GET, MAX_REQUEST_TRIES, MAX_RETRY_ATTEMPTS, POST, PUT, \
+    SCHEMA_ENDPOINT, SYNC_EXPORT_DATA_ENDPOINT, parse_request_timeout
+from .exports import ExportRegistry
+from .governor import RequestGovernor, MAX_THROTTLE_RETRIES, \
+    THROTTLE_STATUS_CODES
+from .instrumentation import PhaseMetrics, EXPORT_CREATE, PAGE_DOWNLOAD, \
+    REQUESTS, SYNC_RETRIES, SYNC_WAIT, THROTTLED
+from .polling import PollingPolicy
+from .shards import DEFAULT_MAX_EXPORT_FIELDS, SHARDED_URI_SEPARATOR, \
+    ShardMerger, ShardMismatchException, add_join_field, build_sharded_uri, \
+    parse_sharded_uri, split_export_body
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOGGER = singer.get_logger()
+
+# Stream and window of the requests the current task sends, for metrics
+REQUEST_TAGS = contextvars.ContextVar('request_tags', default=(None, None))
+
+
+async def gather_or_cancel(tasks):
+    """
+    Like asyncio.gather, but a failure cancels the tasks still running and
+    waits for them to finish before it is raised
+    Args:
+        tasks (list of asyncio.Future)
+    Returns:
+        results, in order (list)
+    """
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class AsyncEloquaClient:
+    """
+    asyncio variant of EloquaClient covering the bulk export operations:
+    base url lookup, fields, export creation, sync, status, logs and paged
+    data. Polling sleeps with asyncio and every request shares one aiohttp
+    connection pool, so a single thread can keep many syncs and page
+    downloads in flight. Requires aiohttp.
+    Requests go through the site's request governor and throttled ones
+    are retried as in the blocking client, and export definitions are
+    reused through an export registry the same way. Given a blocking
+    client, the governor, metrics, export registry and sync bookkeeping
+    are shared with it, so pages of async syncs are read, tagged and
+    released like any other and definitions are cleaned up with the rest
+    of the run's; otherwise the client keeps its own and deletes its
+    definitions on `close` when `cleanup_export_definitions` is set.
+    """
+
+    build_headers = EloquaClient.build_headers
+    build_basic_authorization = EloquaClient.build_basic_authorization
+
+    def __init__(self, config, base_url=None, field_cache=None,
+                 polling_policy=None, client=None):
+        """
+        Args:
+            config (dict)
+            base_url (str): skips the login lookup when already known
+            field_cache (FieldCache): shared with a blocking client
+            polling_policy (PollingPolicy): shared with a blocking client
+            client (EloquaClient): blocking client to share the governor
+                and export definitions with
+        """
+        if aiohttp is None:
+            raise ImportError('The async Eloqua client requires aiohttp: '
+                              'pip install aiohttp')
+
+        self.config = config
+        self.request_headers = self.build_headers()
+        self.base_url = base_url
+        self.field_cache = field_cache or FieldCache.from_config(config)
+        self.polling_policy = polling_policy or PollingPolicy.from_config(config)
+        self.max_export_fields = int(
+            config.get('max_export_fields', DEFAULT_MAX_EXPORT_FIELDS)
+        )
+        self.pool_size = int(config.get('http_pool_size') or DEFAULT_HTTP_POOL_SIZE)
+        self.request_timeout = parse_request_timeout(config.get('request_timeout'))
+        self.session = None
+        self.owns_registry = client is None
+        if client is not None:
+            self.governor = client.governor
+            self.metrics = client.metrics
+            self.export_registry = client.export_registry
+            self.sync_exports = client.sync_exports
+            self.sync_tags = client.sync_tags
+        else:
+            self.governor = RequestGovernor.from_config(config)
+            self.metrics = PhaseMetrics.from_config(config)
+            self.export_registry = ExportRegistry(
+                self, reuse=config.get('reuse_export_definitions', True)
+            )
+            self.sync_exports = {}
+            self.sync_tags = {}
+        # Merger joining the pages of each sharded sync being read
+        self.shard_mergers = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        """
+        Opens the shared connection pool and looks up the base url
+        """
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        connect_timeout, read_timeout = self.request_timeout
+        self.session = aiohttp.ClientSession(
+            connector=connector, headers=self.request_headers,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=connect_timeout, sock_read=read_timeout
+            )
+        )
+        if not self.base_url:
+            self.base_url = await self.build_base_url()
+
+    async def close(self):
+        """
+        Deletes the export definitions this client created, unless they
+        belong to a shared registry or `cleanup_export_definitions` is
+        off, and closes the connection pool
+        """
+        created = []
+        if self.owns_registry and self.config.get('cleanup_export_definitions', True):
+            created = self.export_registry.take_created()
+        for export_uri in created:
+            try:
+                await self.delete_export_definition(export_uri)
+            except Exception as exc:
+                LOGGER.warning('Could not delete export definition %s: %s' % (
+                    export_uri, exc
+                ))
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def make_request(self, method, url, params=None, body=None,
+                           throttle_limit=None):
+        """
+        Sends a request through the shared pool, retrying connection errors
+        and timeouts with exponential backoff
+        Args:
+            method (str)
+            url (str)
+            params (dict)
+            body (dict)
+            throttle_limit (AdaptiveLimit): lowered if Eloqua throttles
+                the request
+        Returns:
+            response json (dict), or None for an empty response
+        """
+        if params:
+            params = dict((key, str(value)) for key, value in params.items())
+
+        for attempt in range(MAX_REQUEST_TRIES):
+            try:
+                return await self.send(method, url, params, body, throttle_limit)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt + 1 >= MAX_REQUEST_TRIES:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def send(self, method, url, params=None, body=None,
+                   throttle_limit=None):
+        """
+        Sends a request once the governor allows it, waiting out throttled
+        responses as their Retry-After asks
+        Args:
+            method (str)
+            url (str)
+            params (dict)
+            body (dict)
+            throttle_limit (AdaptiveLimit)
+        Returns:
+            response json (dict), or None for an empty response
+        """
+        stream_name, window = REQUEST_TAGS.get()
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            wait = self.governor.reserve()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.governor.reserve()
+
+            async with self.session.request(method, url, params=params,
+                                            json=body) as response:
+                self.metrics.count(REQUESTS, 1, stream_name, window, log=False)
+                throttled = response.status in THROTTLE_STATUS_CODES
+                if not throttled or attempt == MAX_THROTTLE_RETRIES:
+                    if not throttled:
+                        self.governor.succeeded()
+                    response.raise_for_status()
+                    if response.status == 204:
+                        return None
+                    return await response.json(content_type=None)
+                retry_after = response.headers.get('Retry-After')
+            self.metrics.count(THROTTLED, 1, stream_name, window)
+            self.governor.throttled(retry_after, throttle_limit)
+
+    @asynccontextmanager
+    async def holding(self, limit):
+        """
+        Holds a slot of one of the governor's concurrency limits without
+        blocking the event loop, waiting on a future that the limit
+        resolves, from whichever thread frees a slot
+        Args:
+            limit (AdaptiveLimit)
+        """
+        loop = asyncio.get_running_loop()
+        while not limit.try_acquire():
+            freed = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(
+                    lambda: freed.done() or freed.set_result(None)
+                )
+
+            limit.add_waiter(wake)
+            try:
+                # A slot freed before the waiter was added wakes nobody
+                if limit.try_acquire():
+                    break
+                await freed
+            finally:
+                limit.remove_waiter(wake)
+        try:
+            yield
+        finally:
+            limit.release()
+
+    async def build_base_url(self):
+        """
+        Returns:
+            request url (str)
+        """
+        path = self.config.get('login_url', BASE_URL_PATH)
+        response_json = await self.make_request(GET, path)
+        return response_json.get('urls').get('base')
+
+    async def request_stream_schema(self, stream_name):
+        """
+        Returns the stream schema from the field cache, requesting it when
+        there is no fresh copy
+        Args:
+            stream_name (str)
+        Returns:
+            field schema (list)
+        """
+        data_endpoint = CONTACTS if stream_name == CONTACTS else ACTIVITIES
+        cache_key = self.field_cache.build_key(
+            self.config.get('sitename'), data_endpoint
+        )
+        schema = self.field_cache.get_fresh(cache_key)
+        if schema is None:
+            request_url = self.base_url + BULK_PATH + data_endpoint + SCHEMA_ENDPOINT
+            response_json = await self.make_request(GET, request_url)
+            schema = response_json.get('items')
+            self.field_cache.store(cache_key, schema)
+        return schema
+
+    async def request_bulk_export(self, stream, start_date, end_date, event,
+                                  expected_rows=None):
+        """
+        Creates and syncs a data export, splitting wide field sets into
+        column-group exports synced concurrently
+        Args:
+            stream (cls)
+            start_date (str)
+            end_date (str)
+            event (str)
+            expected_rows (float): planner estimate, for polling
+        Returns:
+            sync status uri (str)
+        """
+        endpoint_name = ACTIVITIES if event else CONTACTS
+        schema = await self.request_stream_schema(stream.stream)
+        fields = select_request_fields(
+            stream.stream, schema, selected_export_fields(stream)
+        )
+        request_body = assemble_export_body(
+            stream, fields, start_date, end_date, event
+        )
+
+        if len(request_body['fields']) <= self.max_export_fields:
+            return await self.sync_export(
+                stream.stream, endpoint_name, request_body, start_date,
+                expected_rows
+            )
+
+        request_body, join_field = add_join_field(endpoint_name, request_body)
+        key_fields = list(stream.meta_fields.get('key_properties') or [])
+        request_bodies = split_export_body(
+            request_body, self.max_export_fields,
+            [join_field] + key_fields + [stream.meta_fields.get('replication_key'),
+                                         export_filter_key(stream)]
+        )
+        tasks = [
+            asyncio.ensure_future(self.sync_export(
+                stream.stream, endpoint_name, body, start_date, expected_rows
+            ))
+            for body in request_bodies
+        ]
+        try:
+            sync_uris = await gather_or_cancel(tasks)
+        except BaseException:
+            # The groups that did sync are of no use without the others
+            for task in tasks:
+                if not task.cancelled() and task.exception() is None:
+                    self.release_export(task.result())
+            raise
+        sharded_uri = build_sharded_uri(join_field, list(sync_uris))
+        self.sync_exports[sharded_uri] = SHARDED_URI_SEPARATOR.join(
+            self.sync_exports.pop(sync_uri) for sync_uri in sync_uris
+        )
+        self.tag_sync(sharded_uri, stream.stream, start_date)
+        return sharded_uri
+
+    async def sync_export(self, stream_name, endpoint_name, request_body,
+                          window=None, expected_rows=None):
+        """
+        Syncs an export definition within the governor's export and sync
+        limits, reusing one of the same shape from the registry when one
+        is idle, and retries failed syncs. The definition stays checked
+        out until `release_export` is called for the sync.
+        Args:
+            stream_name (str)
+            endpoint_name (str)
+            request_body (dict)
+            window (str): start of the export window, for metrics
+            expected_rows (float)
+        Returns:
+            sync status uri (str)
+        """
+        tags = REQUEST_TAGS.set((stream_name, window))
+        try:
+            async with self.holding(self.governor.exports):
+                with self.metrics.phase(EXPORT_CREATE, stream_name, window):
+                    export_uri = await self.acquire_export_definition(
+                        endpoint_name, request_body
+                    )
+                try:
+                    sync_status_uri = await self.sync_definition(
+                        export_uri, stream_name, window, expected_rows
+                    )
+                except BaseException:
+                    # Cancellation included, so a cancelled group of a
+                    # sharded export gives its definition back too
+                    self.export_registry.release(export_uri)
+                    raise
+            self.governor.exports.recover()
+        finally:
+            REQUEST_TAGS.reset(tags)
+
+        self.sync_exports[sync_status_uri] = export_uri
+        self.tag_sync(sync_status_uri, stream_name, window)
+        return sync_status_uri
+
+    async def sync_definition(self, export_uri, stream_name, window=None,
+                              expected_rows=None):
+        """
+        Syncs a definition until a sync succeeds or the retries run out
+        Args:
+            export_uri (str)
+            stream_name (str)
+            window (str)
+            expected_rows (float)
+        Returns:
+            sync status uri (str)
+        """
+        retries = 0
+        while True:
+            LOGGER.info('Attempting sync; %s previous attempt(s) made.' % retries)
+            if retries >= MAX_RETRY_ATTEMPTS:
+                LOGGER.error('Max number of sync retries made.')
+                raise FailedSyncException()
+
+            async with self.holding(self.governor.syncs):
+                with self.metrics.phase(SYNC_WAIT, stream_name, window):
+                    sync_status_uri = await self.synchronize_export_data(export_uri)
+                    synced = await self.poll_eloqua_api(
+                        sync_status_uri, stream_name, expected_rows
+                    )
+            if synced:
+                self.governor.syncs.recover()
+                return sync_status_uri
+
+            self.metrics.count(SYNC_RETRIES, 1, stream_name, window)
+            retries = retries + 1
+            await asyncio.sleep(self.polling_policy.max_delay)
+
+    def tag_sync(self, sync_status_uri, stream_name, window=None):
+        """
+        Remembers which stream and window a sync belongs to, so page
+        downloads from it are tagged in metrics
+        Args:
+            sync_status_uri (str)
+            stream_name (str)
+            window (str)
+        """
+        self.sync_tags[sync_status_uri] = (stream_name, window)
+
+    def release_export(self, sync_status_uri):
+        """
+        Returns the definitions behind a sync to the registry once its last
+        page has been read; with a shared registry the blocking client's
+        `release_export` does the same
+        Args:
+            sync_status_uri (str)
+        """
+        self.shard_mergers.pop(sync_status_uri, None)
+        self.sync_tags.pop(sync_status_uri, None)
+        sharded = parse_sharded_uri(sync_status_uri)
+        for sync_uri in (sharded[1] if sharded else [sync_status_uri]):
+            self.polling_policy.forget(sync_uri)
+            self.sync_tags.pop(sync_uri, None)
+        export_uris = self.sync_exports.pop(sync_status_uri, None)
+        for export_uri in (export_uris or '').split(SHARDED_URI_SEPARATOR):
+            if export_uri:
+                self.export_registry.release(export_uri)
+
+    async def acquire_export_definition(self, endpoint_name, request_body):
+        """
+        Returns an export definition matching request_body, updating an
+        idle one of the same shape from the registry when possible and
+        creating one otherwise
+        Args:
+            endpoint_name (str)
+            request_body (dict)
+        Returns:
+            export uri (str)
+        """
+        key, export_uri = self.export_registry.checkout(endpoint_name, request_body)
+        if export_uri:
+            await self.update_export_definition(export_uri, request_body)
+            self.export_registry.track(export_uri, key)
+        else:
+            export_uri = await self.create_export_definition(
+                endpoint_name, request_body
+            )
+            self.export_registry.track(export_uri, key, created=True)
+        return export_uri
+
+    async def create_export_definition(self, endpoint_name, request_body):
+        """
+        Args:
+            endpoint_name (str)
+            request_body (dict)
+        Returns:
+            export uri (str)
+        """
+        request_url = self.base_url + BULK_PATH + endpoint_name + EXPORTS_ENDPOINT
+        response_json = await self.make_request(
+            POST, request_url, body=request_body,
+            throttle_limit=self.governor.exports
+        )
+        return response_json.get('uri')
+
+    async def update_export_definition(self, export_uri, request_body):
+        """
+        Replaces the name, fields and filter of an existing data export
+        Args:
+            export_uri (str)
+            request_body (dict)
+        """
+        request_url = self.base_url + BULK_PATH + export_uri
+        await self.make_request(PUT, request_url, body=request_body)
+
+    async def delete_export_definition(self, export_uri):
+        """
+        Args:
+            export_uri (str)
+        """
+        request_url = self.base_url + BULK_PATH + export_uri
+        await self.make_request(DELETE, request_url)
+
+    async def synchronize_export_data(self, export_uri):
+        """
+        Args:
+            export_uri (str)
+        Returns:
+            sync_status_uri (str)
+        """
+        request_url = self.base_url + BULK_PATH + SYNC_EXPORT_DATA_ENDPOINT
+        response_json = await self.make_request(
+            POST, request_url, body={"syncedInstanceUri": export_uri},
+            throttle_limit=self.governor.syncs
+        )
+        return response_json.get('uri')
+
+    async def check_sync_status(self, sync_status_uri):
+        """
+        Args:
+            sync_status_uri (str)
+        Returns:
+            status (str)
+        """
+        sharded = parse_sharded_uri(sync_status_uri)
+        if sharded:
+            statuses = await gather_or_cancel([
+                asyncio.ensure_future(self.check_sync_status(shard_uri))
+                for shard_uri in sharded[1]
+            ])
+            failed = [status for status in statuses if status != 'success']
+            return failed[0] if failed else 'success'
+
+        request_url = self.base_url + BULK_PATH + sync_status_uri
+        response_json = await self.make_request(GET, request_url)
+        return response_json.get('status')
+
+    async def poll_eloqua_api(self, sync_status_uri, stream_name=None,
+                              expected_rows=None):
+        """
+        Checks sync status on the polling policy's schedule without
+        blocking the event loop
+        Args:
+            sync_status_uri (str)
+            stream_name (str)
+            expected_rows (float)
+        Returns:
+            True on success, False when the sync failed with logged errors
+        """
+        num_polling_attempts = 0
+        sync_started = self.polling_policy.now()
+        for delay in self.polling_policy.delays(stream_name, expected_rows):
+            num_polling_attempts += 1
+            await asyncio.sleep(delay)
+            status = await self.check_sync_status(sync_status_uri)
+            if status == 'success':
+                LOGGER.info('Eloqua sync successfully completed')
+                if stream_name:
+                    self.polling_policy.synced(
+                        sync_status_uri, stream_name,
+                        self.polling_policy.now() - sync_started
+                    )
+                return True
+            elif status in ('pending', 'active'):
+                LOGGER.info('Eloqua sync not completed yet - try %d',
+                            num_polling_attempts)
+            else:
+                LOGGER.error('Eloqua export sync failed.')
+                errors = await self.fetch_sync_logs(sync_status_uri + '/logs')
+                if errors:
+                    LOGGER.error('Errors during sync: {}.'.format(errors))
+                    LOGGER.info('Retrying activities export with new sync URI.')
+                    return False
+                LOGGER.error('Failure during custom object sync. No '
+                             'error logs were found from Eloqua.')
+                raise FailedSyncException()
+
+        LOGGER.error('Sync did not complete within %ss.',
+                     self.polling_policy.deadline)
+        raise MaxPollingAttemptsException()
+
+    async def fetch_sync_logs(self, sync_logs_uri):
+        """
+        Args:
+            sync_logs_uri (str)
+        Returns:
+            errors (list)
+        """
+        request_url = self.base_url + BULK_PATH + sync_logs_uri
+        response_json = await self.make_request(GET, request_url)
+        return [
+            log_obj['message'] for log_obj in response_json['items']
+            if log_obj['severity'] != 'information'
+        ]
+
+    async def fetch_bulk_export_records(self, sync_status_uri, offset, limit):
+        """
+        Column-group exports are merged by their join field and must be
+        read one page at a time, in offset order from offset 0
+        Args:
+            sync_status_uri (str)
+            offset (int)
+            limit (int)
+        Returns:
+            records (list)
+            has_more (bool)
+            total_records (int)
+        """
+        sharded = parse_sharded_uri(sync_status_uri)
+        if sharded:
+            key_field, shard_uris = sharded
+            if offset == 0:
+                self.shard_mergers[sync_status_uri] = ShardMerger(
+                    key_field, len(shard_uris)
+                )
+            merger = self.shard_mergers.get(sync_status_uri)
+            if merger is None:
+                raise ValueError('Column-group exports must be read from offset 0.')
+            try:
+                results = await gather_or_cancel([
+                    asyncio.ensure_future(
+                        self.fetch_bulk_export_records(shard_uri, offset, limit)
+                    )
+                    for shard_uri in shard_uris
+                ])
+                totals = set(total for _, _, total in results)
+                if len(totals) > 1:
+                    raise ShardMismatchException(
+                        'Column-group exports returned differing totals: %s' % sorted(totals)
+                    )
+            except Exception as exc:
+                merger.fail(exc)
+                raise
+            # Pages are read one after another on the loop, so the merge
+            # never waits on another page
+            total_records = totals.pop()
+            records = merger.merge(
+                offset, limit, [records or [] for records, _, _ in results],
+                total_records
+            )
+            if offset + limit >= total_records:
+                self.shard_mergers.pop(sync_status_uri, None)
+            return (records, any(has_more for _, has_more, _ in results),
+                    total_records)
+
+        request_url = self.base_url + BULK_PATH + sync_status_uri + \
+            EXPORT_DATA_ENDPOINT
+        stream_name, window = self.sync_tags.get(sync_status_uri, (None, None))
+        tags = REQUEST_TAGS.set((stream_name, window))
+        try:
+            with self.metrics.phase(PAGE_DOWNLOAD, stream_name, window):
+                response_json = await self.make_request(
+                    GET, request_url, params={'offset': offset, 'limit': limit}
+                )
+        finally:
+            REQUEST_TAGS.reset(tags)
+        total_records = response_json.get('totalResults')
+        if offset == 0:
+            self.polling_policy.observe_rows(sync_status_uri, total_records)
+        return response_json.get('items'), response_json.get('hasMore'), total_records
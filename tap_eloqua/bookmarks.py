@@ -0,0 +1,68 @@
+import re
+
+import pendulum
+
+# Leading date and time of an Eloqua timestamp, e.g. 2019-08-06 04:29:15.440
+ELOQUA_DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}')
+
+
+def normalize_datetime_string(value):
+    """
+    Converts a timestamp to the `datetime_string` bookmark format
+    (YYYY-MM-DD HH:MM:SS). Eloqua's own format is sliced rather than
+    parsed; anything else goes through pendulum.
+    Args:
+        value (str)
+    Returns:
+        bookmark value (str)
+    """
+    if ELOQUA_DATETIME_PATTERN.match(value):
+        return value[:10] + ' ' + value[11:19]
+    return pendulum.parse(value).to_datetime_string()
+
+
+class BookmarkTracker:
+    """
+    Tracks the largest replication key value as records flow to the
+    writer, so the bookmark comes out of the same pass that writes the
+    records and no page has to be kept for a second scan. Eloqua
+    timestamps share one zero-padded layout and sort chronologically as
+    strings, so each value is compared as is and only a page's maximum is
+    normalized.
+    """
+
+    def __init__(self, replication_key, value=None):
+        """
+        Args:
+            replication_key (str)
+            value (str): bookmark to start from
+        """
+        self.replication_key = replication_key
+        self.value = value
+
+    def observe(self, records):
+        """
+        Passes records through unchanged while tracking the page maximum
+        Args:
+            records (iterable)
+        Returns:
+            records (generator)
+        """
+        replication_key = self.replication_key
+        page_max = None
+        for record in records:
+            value = record.get(replication_key)
+            if value and (page_max is None or value > page_max):
+                page_max = value
+            yield record
+
+        if page_max is not None:
+            self.update(normalize_datetime_string(page_max))
+
+    def update(self, value):
+        """
+        Args:
+            value (str): bookmark in datetime_string format
+        """
+        if value and (self.value is None or value > self.value):
+            self.value = value
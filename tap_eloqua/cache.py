@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Seconds field metadata stays fresh
+DEFAULT_FIELD_CACHE_TTL_SECS = 3600
+
+
+class FieldCache:
+    """
+    Keeps `/fields` responses keyed by site and endpoint so discovery and
+    every export definition share one request per endpoint. Entries expire
+    after `ttl` seconds. With a `path` the cache is also written to disk
+    and reloaded by later runs while its entries are still fresh.
+    """
+
+    def __init__(self, ttl=DEFAULT_FIELD_CACHE_TTL_SECS, path=None):
+        """
+        Args:
+            ttl (float)
+            path (str)
+        """
+        self.ttl = ttl
+        self.path = path
+        self.entries = {}
+        self.lock = threading.RLock()
+        if path:
+            self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            cache (FieldCache)
+        """
+        return cls(
+            ttl=float(config.get('field_cache_ttl', DEFAULT_FIELD_CACHE_TTL_SECS)),
+            path=config.get('field_cache_path')
+        )
+
+    @staticmethod
+    def build_key(site, endpoint):
+        """
+        Args:
+            site (str)
+            endpoint (str)
+        Returns:
+            cache key (str)
+        """
+        return '{site}:{endpoint}'.format(site=site, endpoint=endpoint)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached fields for key, calling fetch to fill the entry
+        when it is missing or stale. Concurrent callers wait for a single
+        fetch rather than each requesting the fields.
+        Args:
+            key (str)
+            fetch (callable): returns the field list
+        Returns:
+            fields (list)
+        """
+        with self.lock:
+            items = self.get_fresh(key)
+            if items is None:
+                items = fetch()
+                self.store(key, items)
+            return items
+
+    def get_fresh(self, key):
+        """
+        Args:
+            key (str)
+        Returns:
+            fields (list), or None when missing or stale
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry['fetched_at'] < self.ttl:
+                return entry['items']
+            return None
+
+    def store(self, key, items):
+        """
+        Args:
+            key (str)
+            items (list)
+        """
+        with self.lock:
+            self.entries[key] = {'fetched_at': time.time(), 'items': items}
+            if self.path:
+                self.save()
+
+    def clear(self):
+        """
+        Drops every in-memory entry
+        """
+        with self.lock:
+            self.entries = {}
+
+    def load(self):
+        """
+        Reads fresh entries from the cache file, ignoring a missing or
+        unreadable file
+        """
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            return
+
+        now = time.time()
+        for key, entry in entries.items():
+            if now - entry.get('fetched_at', 0) < self.ttl:
+                self.entries[key] = entry
+        LOGGER.info('Loaded %s cached field lists from %s.' % (
+            len(self.entries), self.path
+        ))
+
+    def save(self):
+        """
+        Writes all entries to the cache file, replacing it atomically
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(tmp_path, self.path)
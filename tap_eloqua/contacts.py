@@ -9,11 +9,14 @@ class ContactsStream(Stream):
         self.stream = 'contacts'
         self.meta_fields = {
                 "key_properties": ['c_emailaddress'],
-                "replication_method": 'full_table',
-                "replication_key": 'c_datecreated',
-                "incremental_search_key": 'c_datecreated',
+                "replication_method": 'incremental',
+                "replication_key": 'c_datemodified',
+                "incremental_search_key": 'c_datemodified',
                 "selected_by_default": False
         }
+        # Catalogs that replicate contacts as full_table walk them by
+        # creation date, as before contacts became incremental
+        self.full_table_filter_key = 'c_datecreated'
         self.schema = self.generate_schema(schema_generator)
 
     def generate_schema(self, schema_generator):
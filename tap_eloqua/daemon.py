@@ -0,0 +1,227 @@
+import argparse
+import glob
+import io
+import json
+import os
+import signal
+import threading
+import time
+
+import singer
+
+from .client import EloquaClient
+from .executor import EloquaExecutor
+from .output import ThreadOutputRouter, DEFAULT_OUTPUT_BUFFER_SIZE
+from .progress import in_flight_export_uris
+from .sites import parse_site_args
+
+LOGGER = singer.get_logger()
+
+# Seconds from the start of one sync cycle to the start of the next
+DEFAULT_DAEMON_INTERVAL_SECS = 300
+# Rotated output files kept when the output path names each cycle
+DEFAULT_KEEP_OUTPUTS = 24
+# Cycles between full table syncs after the first cycle; 0 runs them in
+# the first successful cycle only
+DEFAULT_DAEMON_FULL_TABLE_CYCLES = 0
+
+
+class SyncDaemon:
+    """
+    Runs incremental syncs of the selected streams on an interval in one
+    long-lived process. Full table streams run in the first cycle and then
+    only every `daemon_full_table_cycles` cycles. The client is built
+    once, so the base url, the field cache, idle export definitions and
+    pooled connections stay warm between cycles, and each cycle starts
+    from the state the previous one ended with. Each cycle's Singer output
+    goes to its own file, or is appended to the same file or pipe, and its
+    final state is saved after it succeeds. A signal lets the running
+    cycle finish and then stops the daemon.
+    """
+
+    def __init__(self, args, output_path, state_path=None,
+                 interval=DEFAULT_DAEMON_INTERVAL_SECS,
+                 keep_outputs=DEFAULT_KEEP_OUTPUTS):
+        """
+        Args:
+            args (argparse.Namespace): as parsed for a single sync
+            output_path (str): may name each cycle with {cycle} and {time}
+            state_path (str)
+            interval (float)
+            keep_outputs (int)
+        """
+        self.args = args
+        self.output_path = output_path
+        self.state_path = state_path
+        self.interval = interval
+        self.keep_outputs = keep_outputs
+        # Idle export definitions are kept for later cycles and deleted
+        # when the daemon stops
+        self.config = dict(args.config, cleanup_export_definitions=False)
+        self.state = args.state or {}
+        self.router = ThreadOutputRouter()
+        self.stopping = threading.Event()
+        self.cycle = 0
+        self.full_table_cycles = int(self.config.get(
+            'daemon_full_table_cycles', DEFAULT_DAEMON_FULL_TABLE_CYCLES
+        ))
+        # Last cycle whose full table streams finished
+        self.full_table_cycle = None
+
+    def install_signal_handlers(self):
+        """
+        Stops the daemon after the running cycle on SIGTERM or SIGINT
+        """
+        def request_stop(signum, frame):
+            LOGGER.info('Received signal %s; stopping after the current cycle.' % signum)
+            self.stopping.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+    def run(self):
+        """
+        Runs cycles until a signal arrives
+        """
+        client = EloquaClient(self.config)
+        self.router.install()
+        try:
+            while not self.stopping.is_set():
+                started = time.time()
+                self.run_cycle(client)
+                wait = self.interval - (time.time() - started)
+                if wait > 0:
+                    self.stopping.wait(wait)
+        finally:
+            self.router.uninstall()
+            if self.args.config.get('cleanup_export_definitions', True):
+                client.export_registry.cleanup(
+                    keep=in_flight_export_uris(self.state)
+                )
+            LOGGER.info('Stopped after %s cycles.' % self.cycle)
+
+    def run_cycle(self, client):
+        """
+        Runs one sync with a fresh executor on the shared client. A failed
+        cycle is logged and retried from the same state next time.
+        Args:
+            client (EloquaClient)
+        """
+        self.cycle += 1
+        path = self.output_path.format(
+            cycle=self.cycle, time=time.strftime('%Y%m%dT%H%M%S')
+        )
+        buffer_size = int(self.config.get('output_buffer_size', DEFAULT_OUTPUT_BUFFER_SIZE))
+        # A path shared by every cycle is appended to, so earlier cycles'
+        # records are never truncated
+        mode = 'w' if self.names_each_cycle() else 'a'
+        cycle_output = io.open(path, mode, buffering=buffer_size,
+                               encoding='utf-8', newline='\n')
+        run_full_table = self.runs_full_table()
+        try:
+            self.router.bind(cycle_output)
+            LOGGER.info('Starting cycle %s, writing to %s.' % (self.cycle, path))
+            args = argparse.Namespace(**vars(self.args))
+            args.config = self.config
+            args.state = json.loads(json.dumps(self.state))
+
+            executor = EloquaExecutor(None, args, client)
+            executor.output_router = self.router
+            executor.site_output = cycle_output
+            executor.run_full_table_streams = run_full_table
+            executor.sync()
+            cycle_output.flush()
+
+            self.state = executor.state
+            if run_full_table:
+                self.full_table_cycle = self.cycle
+            if self.state_path:
+                self.write_state()
+            LOGGER.info('Finished cycle %s.' % self.cycle)
+        except Exception:
+            LOGGER.exception('Cycle %s failed.' % self.cycle)
+        finally:
+            self.router.unbind()
+            cycle_output.close()
+        self.rotate_outputs()
+
+    def runs_full_table(self):
+        """
+        Returns:
+            whether this cycle syncs full table streams (bool): until they
+            have finished once, then every `daemon_full_table_cycles`
+        """
+        if self.full_table_cycle is None:
+            return True
+        return bool(self.full_table_cycles) and \
+            self.cycle - self.full_table_cycle >= self.full_table_cycles
+
+    def names_each_cycle(self):
+        """
+        Returns:
+            whether the output path names a file per cycle (bool)
+        """
+        return '{cycle}' in self.output_path or '{time}' in self.output_path
+
+    def write_state(self):
+        """
+        Saves the latest state, replacing the state file atomically
+        """
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def rotate_outputs(self):
+        """
+        Deletes the oldest cycle outputs beyond `keep_outputs` when the
+        output path names each cycle
+        """
+        if not self.keep_outputs or not self.names_each_cycle():
+            return
+
+        pattern = self.output_path.format(cycle='*', time='*')
+        outputs = sorted(glob.glob(pattern), key=os.path.getmtime)
+        for path in outputs[:-self.keep_outputs]:
+            os.remove(path)
+
+
+def main():
+    """
+    Entry point running incremental syncs on an interval
+    """
+    from . import REQUIRED_CONFIG_KEYS
+
+    parser = argparse.ArgumentParser(
+        description='Run Eloqua syncs on an interval in one process.'
+    )
+    parser.add_argument('-c', '--config', help='Config file', required=True)
+    parser.add_argument('-p', '--properties', help='Catalog file')
+    parser.add_argument('--catalog', help='Catalog file')
+    parser.add_argument('-s', '--state', help='State file to start from')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output file or pipe, appended to by every '
+                             'cycle; {cycle} and {time} name a file per cycle')
+    parser.add_argument('--state-output', help='State file updated after each cycle')
+    parser.add_argument('--interval', type=float,
+                        help='Seconds between cycle starts')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP_OUTPUTS,
+                        help='Cycle outputs kept when rotating')
+    options = parser.parse_args()
+
+    args = parse_site_args({
+        'config': options.config,
+        'properties': options.properties,
+        'catalog': options.catalog,
+        'state': options.state
+    }, REQUIRED_CONFIG_KEYS)
+    interval = options.interval or float(args.config.get(
+        'daemon_interval', DEFAULT_DAEMON_INTERVAL_SECS
+    ))
+
+    daemon = SyncDaemon(
+        args, options.output, state_path=options.state_output,
+        interval=interval, keep_outputs=options.keep
+    )
+    daemon.install_signal_handlers()
+    daemon.run()
@@ -5,25 +5,62 @@ from .opens import OpensStream
 from .sends import SendsStream
 from .subscribes import SubscribesStream
 from .unsubscribes import UnsubscribesStream
+from .scheduler import AsyncExportScheduler, ExportScheduler, \
+    DEFAULT_MAX_CONCURRENT_EXPORTS
+from .aio_client import AsyncEloquaClient
+from .client import export_filter_key
+from .pages import PageFetcher, DEFAULT_MAX_CONCURRENT_PAGES
+from .planner import WindowPlanner, DEFAULT_TARGET_EXPORT_ROWS, density_key
+from .progress import DEFAULT_STATE_CHECKPOINT_PAGES, ExportProgress, \
+    IN_FLIGHT_KEY, in_flight_export_uris
+from .transform import StringRecordTransformer
+from .output import BufferedOutput, iter_batches, DEFAULT_OUTPUT_BATCH_SIZE
+from .sink import FileSink
+from .spill import SpillBuffer
+from .shards import ShardMismatchException, parse_sharded_uri
+from .bookmarks import BookmarkTracker
+from .instrumentation import ROWS, WRITE
+from .profiling import Profiler, BOOKMARK_SCAN, PAGE_PARSE, TRANSFORM
 from tap_kit import TapExecutor
 from tap_kit.utils import timestamp_to_iso8601, transform_write_and_count, \
     format_last_updated_for_request
 from requests import request
 from datetime import datetime
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from singer import metrics
 
+import itertools
 import json
 import pendulum
 import singer
 import sys
+import threading
+import time
 
 LOGGER = singer.get_logger()
 
 # Extract limit per request
 MAX_RECORDS_RETURNED = 50000
 
-# Export dataset size limit
+# Export dataset size limit, when `export_limit` is not set
 EXPORT_LIMIT = 5000000
 
+# State key holding typical sync durations and row counts learned by the
+# polling policy
+SYNC_DURATIONS_KEY = 'sync_durations'
+# State key holding row densities learned by the window planner
+ROW_DENSITIES_KEY = 'row_densities'
+
+# Times a window's column-group exports are synced again when they
+# disagree before the sync fails
+MAX_SHARD_RESYNCS = 3
+
+# Multiple of `rest_max_rows` a rest window may turn out to hold before
+# it falls back to a bulk export
+REST_ROWS_TOLERANCE = 2
+
 # Stream names
 CONTACTS = 'contacts'
 SENDS = 'sends'
@@ -44,6 +81,9 @@ EVENT_TYPES = {
     CONTACTS: None
 }
 
+# Streams the rest api can list by modification date
+REST_STREAMS = [CONTACTS]
+
 # Streams with dynamic schemas
 DYNAMIC_SCHEMAS = [
     (CONTACTS, ContactsStream),
@@ -67,6 +107,33 @@ class EloquaExecutor(TapExecutor):
         super().__init__(streams, args, client)
 
         self.replication_key_format = 'datetime_string'
+        self.output_lock = threading.RLock()
+        self.stream_pages = bool(self.config.get('stream_export_pages', False))
+        self.fast_transform = bool(self.config.get('fast_transform', True))
+        self.write_batch_size = max(1, int(self.config.get(
+            'output_batch_size', DEFAULT_OUTPUT_BATCH_SIZE
+        )))
+        self.output = None
+        if self.config.get('buffered_output', True):
+            self.output = BufferedOutput.from_config(self.config)
+        self.transformers = {}
+        self.sink = FileSink.from_config(self.config)
+        self.profiler = Profiler.from_config(self.config)
+        self.spill = SpillBuffer.from_config(self.config, MAX_RECORDS_RETURNED)
+        self.export_limit = int(self.config.get('export_limit', EXPORT_LIMIT))
+        # Windows are sized to stay under the limit, with the same margin
+        # as the defaults when a lower limit is configured
+        self.planner = WindowPlanner(min(
+            int(self.config.get('target_export_rows', DEFAULT_TARGET_EXPORT_ROWS)),
+            max(1, self.export_limit * 4 // 5)
+        ))
+        # Set by the multi-site runner: an export pool shared by every
+        # site, and the router and stream this site's output goes to
+        self.export_pool = None
+        self.output_router = None
+        self.site_output = None
+        # Daemon cycles between full table runs turn this off
+        self.run_full_table_streams = True
 
     def discover(self):
         """
@@ -114,9 +181,279 @@ class EloquaExecutor(TapExecutor):
                 if EVENT_TYPES[stream_name] in field.get('activityTypes'):
                     yield field.get('internalName').lower()
 
+
+    def sync(self):
+        """
+        Syncs the selected streams side by side. Bulk exports for every
+        stream and date window are created and polled on the export
+        scheduler, bounded by the `max_concurrent_exports` config, while
+        page writes are serialized so stdout remains valid Singer output.
+        tap_kit's own SCHEMA and STATE messages and bookmark updates run
+        under the same output lock, which a stream only gives up while its
+        exports run.
+        """
+        max_in_flight = int(self.config.get(
+            'max_concurrent_exports', DEFAULT_MAX_CONCURRENT_EXPORTS
+        ))
+        self.scheduler = self.build_scheduler(max_in_flight)
+        self.page_fetcher = PageFetcher(
+            self.client,
+            MAX_RECORDS_RETURNED,
+            self.config.get('max_concurrent_pages', DEFAULT_MAX_CONCURRENT_PAGES)
+        )
+        self.stream_pool = ThreadPoolExecutor(
+            max_workers=min(max_in_flight, len(DYNAMIC_SCHEMAS)),
+            thread_name_prefix='eloqua-stream',
+            initializer=self.bind_site_output
+        )
+        self.stream_futures = []
+        if self.state is None:
+            self.state = {}
+        self.client.polling_policy.load_history(
+            (self.state or {}).get(SYNC_DURATIONS_KEY)
+        )
+        self.planner.load_history((self.state or {}).get(ROW_DENSITIES_KEY))
+        # Definitions behind windows resumed from state are deleted by this
+        # run once it no longer needs them
+        for export_uri in in_flight_export_uris(self.state):
+            self.client.export_registry.adopt(export_uri)
+
+        if self.profiler:
+            self.start_profiling()
+
+        # Routed output is already written to its own stream
+        install_output = self.output and self.output_router is None
+        self.bind_site_output()
+        if install_output:
+            self.output.install()
+        try:
+            try:
+                with self.output_lock:
+                    super().sync()
+                for future in self.stream_futures:
+                    future.result()
+            finally:
+                self.stream_pool.shutdown()
+                self.scheduler.shutdown()
+                self.page_fetcher.shutdown()
+                if self.config.get('cleanup_export_definitions', True):
+                    # A failed run leaves windows in state that the next
+                    # run resumes from their syncs, so their definitions
+                    # are kept
+                    self.client.export_registry.cleanup(
+                        keep=in_flight_export_uris(self.state)
+                    )
+                if self.sink:
+                    self.sink.close()
+                self.client.metrics.write()
+
+            self.write_learned_history()
+        finally:
+            if install_output:
+                self.output.uninstall()
+            if self.profiler:
+                self.profiler.stop()
+
+    def build_scheduler(self, max_in_flight):
+        """
+        Builds the export scheduler: threads over the blocking client by
+        default, or the asyncio client on an event loop when
+        `async_exports` is set
+        Args:
+            max_in_flight (int)
+        Returns:
+            scheduler (ExportScheduler or AsyncExportScheduler)
+        """
+        if not self.config.get('async_exports'):
+            return ExportScheduler(self.client, max_in_flight, self.export_pool)
+
+        async_client = AsyncEloquaClient(
+            self.config,
+            base_url=self.client.base_url,
+            field_cache=self.client.field_cache,
+            polling_policy=self.client.polling_policy,
+            client=self.client
+        )
+        return AsyncExportScheduler(async_client, max_in_flight)
+
+    def start_profiling(self):
+        """
+        Wraps the page parse and write methods of the client and executor
+        for profiling. Transformers and bookmark trackers are wrapped as
+        they are created.
+        """
+        self.profiler.start()
+        self.profiler.wrap(self.client, 'fetch_bulk_export_records', PAGE_PARSE)
+        self.profiler.wrap(self.client, 'stream_bulk_export_records', PAGE_PARSE)
+        self.profiler.wrap(self, 'write_records', WRITE)
+        self.profiler.wrap(self, 'write_page_file', WRITE)
+
+    def bind_site_output(self):
+        """
+        Routes the calling thread's output to this site's stream when run
+        by the multi-site runner
+        """
+        if self.output_router is not None:
+            self.output_router.bind(self.site_output)
+
+    def write_learned_history(self):
+        """
+        Saves the sync durations, with the rows they covered, and row
+        densities observed this run into state so the next run can schedule
+        status checks and size export windows from them
+        """
+        with self.output_lock:
+            self.state[SYNC_DURATIONS_KEY] = dict(
+                self.client.polling_policy.sync_durations
+            )
+            self.state[ROW_DENSITIES_KEY] = dict(self.planner.densities)
+            self.write_state()
+
+    def write_state(self):
+        """
+        Writes the current state, serialized with record output
+        """
+        with self.output_lock:
+            singer.write_state(self.state)
+
+    def sync_stream(self, stream):
+        """
+        Hands the stream to the stream pool instead of syncing it inline
+        Args:
+            stream (cls)
+        """
+        future = self.stream_pool.submit(self.locked_sync_stream, stream)
+        self.stream_futures.append(future)
+
+    def locked_sync_stream(self, stream):
+        """
+        Runs tap_kit's stream sync holding the output lock, so the SCHEMA
+        and STATE messages it writes and its changes to state never
+        interleave with other streams' output. The lock is given up while
+        the stream's exports run; see `exporting`.
+        Args:
+            stream (cls)
+        """
+        with self.output_lock:
+            super().sync_stream(stream)
+
+    @contextmanager
+    def exporting(self):
+        """
+        Releases the output lock held by `locked_sync_stream` while a
+        stream's exports run, and takes it back before tap_kit updates the
+        bookmark. Records and progress take the lock for each write.
+        """
+        self.output_lock.release()
+        try:
+            yield
+        finally:
+            self.output_lock.acquire()
+
+    def write_records(self, stream, records, window=None):
+        """
+        Transforms and writes a page of records in batches of
+        `output_batch_size`. Records are read (for a streamed page, that
+        is downloaded and parsed) and encoded outside the output lock,
+        which is only held while each batch is written, so messages from
+        concurrently synced streams never interleave and no stream waits
+        on another's download.
+        Args:
+            stream (cls)
+            records (iterable)
+            window (str): start of the export window, for metrics
+        Returns:
+            record count (int)
+        """
+        transformer = self.get_transformer(stream)
+        if transformer:
+            with metrics.record_counter(stream.stream) as counter:
+                count, write_seconds = self.write_batches(
+                    transformer.encode(records), transformer.write_lines
+                )
+                counter.increment(count)
+        else:
+            count, write_seconds = self.write_batches(
+                records, lambda batch: transform_write_and_count(stream, batch)
+            )
+        self.client.metrics.record_phase(WRITE, write_seconds, stream.stream, window)
+        self.client.metrics.count(ROWS, count, stream.stream, window)
+        return count
+
+    def write_batches(self, items, write):
+        """
+        Writes items in batches, holding the output lock only while each
+        batch is written
+        Args:
+            items (iterable)
+            write (callable): writes a batch and returns its count
+        Returns:
+            items written (int)
+            seconds spent writing (float)
+        """
+        count = 0
+        seconds = 0.0
+        for batch in iter_batches(items, self.write_batch_size):
+            started = time.time()
+            with self.output_lock:
+                count += write(batch)
+            seconds += time.time() - started
+        return count, seconds
+
+    def write_page_file(self, stream, window, offset, records, tracker=None):
+        """
+        Writes a page of records to its own file in the file sink. Files
+        are independent, so streams write them without the output lock.
+        Args:
+            stream (cls)
+            window (dict)
+            offset (int)
+            records (iterable)
+            tracker (BookmarkTracker)
+        Returns:
+            record count (int)
+        """
+        transformer = self.get_transformer(stream)
+        window_tag = pendulum.parse(window['start']).to_datetime_string()
+        with self.client.metrics.phase(WRITE, stream.stream, window_tag):
+            count = self.sink.write_page(
+                stream, window, offset, records,
+                transform=transformer.transform if transformer else None,
+                tracker=tracker
+            )
+        self.client.metrics.count(ROWS, count, stream.stream, window_tag)
+        return count
+
+    def get_transformer(self, stream):
+        """
+        Returns the stream's compiled string transformer, built on first
+        use, or None when the schema needs the general tap_kit path
+        Args:
+            stream (cls)
+        Returns:
+            transformer (StringRecordTransformer)
+        """
+        if not self.fast_transform:
+            return None
+
+        if stream.stream not in self.transformers:
+            transformer = None
+            if StringRecordTransformer.supports(stream.schema):
+                transformer = StringRecordTransformer(
+                    stream.stream, stream.schema,
+                    getattr(stream, 'metadata', None), self.output
+                )
+                if self.profiler:
+                    self.profiler.wrap(transformer, 'encode', TRANSFORM)
+            self.transformers[stream.stream] = transformer
+        return self.transformers[stream.stream]
+
     def call_incremental_stream(self, stream):
         """
         Method to call incrementally synced streams
+        Contacts are exported by modification date from the bookmark, or
+        from `full_table_start_date` when `contacts_full_reconciliation`
+        is set, which re-exports every contact once.
         TODO: only for bulk api, update for rest api too
         Args:
             stream (cls)
@@ -124,123 +461,375 @@ class EloquaExecutor(TapExecutor):
             last_record_date (dttime)
         """
         stream_name = stream.stream
-        event_name = EVENT_TYPES.get(stream_name)
         last_updated = format_last_updated_for_request(
             stream.update_and_return_bookmark(), self.replication_key_format
         )
-        LOGGER.info("Extracting %s since %s." % (stream_name, last_updated))
-        latest_record_date = last_updated
         start_date = pendulum.parse(last_updated)
         end_date = pendulum.now()
+        default_months = None
 
-        requests = [(start_date, end_date)]
-
-        while requests:
-            request_filters = requests.pop(0)
-            request_start = request_filters[0]
-            request_end = request_filters[1]
-            request_start_str = request_start.to_datetime_string()
-            request_end_str = request_end.to_datetime_string()
-            LOGGER.info('Requesting export from %s to %s.' % (
-                request_start_str, request_end_str
-            ))
+        if stream_name == CONTACTS:
+            default_months = 1
+            if self.config.get('contacts_full_reconciliation'):
+                LOGGER.info('Reconciling all contacts.')
+                start_date = pendulum.parse(self.config['full_table_start_date'])
 
-            sync_uri = self.client.request_bulk_export(stream, request_start_str, request_end_str, event_name)
-            offset = 0
-            run = True
+        LOGGER.info("Extracting %s since %s." % (stream_name, start_date))
+        with self.exporting():
+            if self.use_rest_path(stream, start_date, end_date):
+                latest = self.sync_rest_window(stream, start_date, end_date, last_updated)
+                if latest is not False:
+                    return latest
+
+            return self.sync_export_windows(
+                stream, start_date, end_date, last_updated=last_updated,
+                default_months=default_months
+            )
+
+    def use_rest_path(self, stream, start_date, end_date):
+        """
+        Small windows of streams the rest api can list are read through it,
+        skipping the export definition, sync and polling. The choice is
+        made from the row count the planner expects for the window, so it
+        applies once the stream's density has been learned, and never while
+        bulk exports from an earlier run are still being resumed.
+        Args:
+            stream (cls)
+            start_date (datetime)
+            end_date (datetime)
+        Returns:
+            whether to use the rest api (bool)
+        """
+        max_rows = int(self.config.get('rest_max_rows', 0))
+        if not max_rows or stream.stream not in REST_STREAMS:
+            return False
 
-            while run:
-                records, has_more, total_records = self.client.fetch_bulk_export_records(
-                    sync_uri, offset, MAX_RECORDS_RETURNED, run
-                )
-                if total_records >= EXPORT_LIMIT:
-                    LOGGER.info('Export exceeds 5M record limit. Splitting into multiple requests.')
-                    new_end_date = request_start + ((request_end - request_start) / 2)
-                    requests.append((request_start, new_end_date))
-                    requests.append((new_end_date, request_end))
-                    run = False
+        in_flight = self.state.get(IN_FLIGHT_KEY, {}).get(stream.stream) or {}
+        if in_flight.get('windows'):
+            return False
 
-                elif total_records == 0:
-                    LOGGER.info('No records found between %s and %s.' % (request_start, request_end))
-                    run = False
+        estimate = self.planner.estimate(self.density_key(stream), start_date, end_date)
+        return estimate is not None and estimate <= max_rows
 
+    def sync_rest_window(self, stream, start_date, end_date, last_updated):
+        """
+        Reads a window through the rest api, keyed by `updatedAt`, tracking
+        the bookmark as the bulk path does. Each request lists contacts
+        from the largest timestamp read so far; contacts read again at
+        that timestamp are dropped, while ones edited since they were
+        written come back later in the listing and are written again.
+        Falls back to the bulk path, before anything is written, when the
+        window turns out to hold far more rows than expected.
+        Args:
+            stream (cls)
+            start_date (datetime)
+            end_date (datetime)
+            last_updated (str)
+        Returns:
+            latest_record_date (str), or False to use the bulk path
+        """
+        max_rows = int(self.config.get('rest_max_rows', 0))
+        tracker = BookmarkTracker(
+            stream.meta_fields.get('replication_key'), last_updated
+        )
+        if self.profiler:
+            self.profiler.wrap(tracker, 'observe', BOOKMARK_SCAN)
+        window = {
+            'start': start_date.to_iso8601_string(),
+            'end': end_date.to_iso8601_string()
+        }
+        window_tag = start_date.to_datetime_string()
+
+        updated_since = None
+        # Contacts already written at the `updated_since` timestamp
+        written_ids = set()
+        page = 1
+        offset = 0
+        while True:
+            records, keys, has_more, total_records = self.client.fetch_rest_contacts(
+                stream, start_date, end_date, updated_since, page
+            )
+            if updated_since is None and page == 1:
+                if total_records > max_rows * REST_ROWS_TOLERANCE:
+                    LOGGER.info('%s rows found between %s and %s; using a bulk '
+                                'export instead.' % (total_records, start_date, end_date))
+                    return False
+                LOGGER.info('Reading %s rows through the rest api.' % total_records)
+                self.planner.record(self.density_key(stream), start_date, end_date, total_records)
+
+            records = [
+                record for record, (updated_at, contact_id) in zip(records, keys)
+                if updated_at != updated_since or contact_id not in written_ids
+            ]
+            if records:
+                count = len(records)
+                records = tracker.observe(records)
+                if self.sink:
+                    self.write_page_file(stream, window, offset, records, tracker)
                 else:
-                    transform_write_and_count(stream, records)
-
-                    latest_record_batch = self.get_latest_for_next_call(
-                        records=records,
-                        replication_key=stream.meta_fields.get('replication_key'),
-                        last_updated=last_updated
-                    )
-                    if latest_record_batch > latest_record_date:
-                        latest_record_date = latest_record_batch
-                    
-                    if not has_more:
-                        run = False
-                        LOGGER.info('Completed fetching records. Fetched %s records.' % total_records)
-
-                    else:
-                        offset = offset + MAX_RECORDS_RETURNED
-                        LOGGER.info('Fetched %s of %s records. Fetching next set of records.' % (
-                            offset, total_records
-                        ))
-
-        return latest_record_date
+                    self.write_records(stream, records, window_tag)
+                offset += count
+
+            if not has_more:
+                break
+            latest = max(updated_at for updated_at, _ in keys)
+            if latest == updated_since:
+                # A full page sharing one timestamp; the next page holds
+                # the rest of them
+                page += 1
+            else:
+                updated_since = latest
+                written_ids = set()
+                page = 1
+            written_ids.update(
+                contact_id for updated_at, contact_id in keys
+                if updated_at == updated_since
+            )
+
+        return tracker.value
+
+    def density_key(self, stream):
+        """
+        Args:
+            stream (cls)
+        Returns:
+            key of the planner density for the stream's export filter (str)
+        """
+        return density_key(stream.stream, export_filter_key(stream))
 
     def call_full_stream(self, stream):
         """
         Method to call all fully synced streams
+        Streams with a `full_table_filter_key` are windowed on it rather
+        than on their replication key, e.g. contacts by creation date.
         """
 
         stream_name = stream.stream
-        event_name = EVENT_TYPES.get(stream_name)
+        if not self.run_full_table_streams:
+            LOGGER.info("Skipping full table stream %s this cycle." % stream_name)
+            return
+        stream.export_filter_key = getattr(stream, 'full_table_filter_key', None)
         start_date = pendulum.parse(self.config['full_table_start_date'])
-        end_date = start_date.add(months=1)
         LOGGER.info("Extracting %s since %s." % (stream_name, start_date))
 
-        requests = [(start_date, end_date)]
+        # Windows are monthly until the stream's row density is learned
+        with self.exporting():
+            self.sync_export_windows(
+                stream, start_date, pendulum.now(), default_months=1
+            )
+
+    def submit_export_window(self, stream, window):
+        """
+        Queues a bulk export for one date window on the scheduler. A window
+        resumed from state with a valid sync is returned as already done.
+        Args:
+            stream (cls)
+            window (dict)
+        Returns:
+            window with pending export (tuple)
+        """
+        if window['sync_uri']:
+            LOGGER.info('Resuming export from %s to %s at offset %s.' % (
+                window['start'], window['end'], window['offset']
+            ))
+            export = Future()
+            export.set_result(window['sync_uri'])
+            return window, export
+
+        event_name = EVENT_TYPES.get(stream.stream)
+        request_start = pendulum.parse(window['start'])
+        request_end = pendulum.parse(window['end'])
+        request_start_str = request_start.to_datetime_string()
+        request_end_str = request_end.to_datetime_string()
+        LOGGER.info('Requesting export from %s to %s.' % (
+            request_start_str, request_end_str
+        ))
+
+        # The expected row count scales the wait before the first poll
+        export = self.scheduler.submit(
+            stream, request_start_str, request_end_str, event_name,
+            self.planner.estimate(self.density_key(stream), request_start, request_end)
+        )
+        return window, export
 
-        while requests:
-            request_filters = requests.pop(0)
-            request_start = request_filters[0]
-            request_end = request_filters[1]
-            request_start_str = request_start.to_datetime_string()
-            request_end_str = request_end.to_datetime_string()
-            LOGGER.info('Requesting export from %s to %s.' % (
-                request_start_str, request_end_str
+    def load_export_progress(self, stream, start_date, end_date,
+                             default_months=None):
+        """
+        Loads the stream's unfinished windows from state, dropping syncs
+        that can no longer be read, and plans windows for whatever part of
+        the range they do not cover
+        Args:
+            stream (cls)
+            start_date (datetime)
+            end_date (datetime)
+            default_months (int)
+        Returns:
+            progress (ExportProgress)
+        """
+        progress = ExportProgress(
+            self.state, stream.stream, self.write_state, self.output_lock,
+            int(self.config.get('state_checkpoint_pages', DEFAULT_STATE_CHECKPOINT_PAGES))
+        )
+        if progress.windows:
+            LOGGER.info('Found %s unfinished export windows in state.' % len(
+                progress.windows
             ))
+            for window in progress.windows:
+                if window['sync_uri'] and not window['complete']:
+                    status = self.client.check_sync_status(window['sync_uri'])
+                    if status != 'success':
+                        LOGGER.info('Sync %s is %s; exporting window again.' % (
+                            window['sync_uri'], status
+                        ))
+                        progress.mark_unsynced(window)
+            start_date = max(start_date, progress.last_end())
+
+        if start_date < end_date:
+            for window_start, window_end in self.planner.plan(
+                    self.density_key(stream), start_date, end_date, default_months):
+                progress.add_window(window_start, window_end)
+        progress.save()
 
-            sync_uri = self.client.request_bulk_export(stream, request_start_str, request_end_str, event_name)
-            offset = 0
-            run = True
+        return progress
 
-            while run:
-                records, has_more, total_records = self.client.fetch_bulk_export_records(
-                    sync_uri, offset, MAX_RECORDS_RETURNED, run
+    def sync_export_windows(self, stream, start_date, end_date,
+                            last_updated=None, default_months=None):
+        """
+        Exports each date window of the range and writes its records. All
+        windows are submitted before any are read; windows that exceed the
+        export limit are split by the planner and resubmitted. Pages after
+        the first are downloaded by the page fetcher and written in offset
+        order, or streamed one record at a time when `stream_export_pages`
+        is set. Pages go to the file sink instead of stdout when
+        `file_sink_dir` is set. With `spill_pages` the pages are read
+        ahead into a spill buffer so a slow writer never holds up the
+        download. The bookmark is tracked as records are written. Progress
+        is kept in state every `state_checkpoint_pages` pages and at the
+        end of each window, so an interrupted run resumes from the last
+        saved offset. Column-group exports whose groups disagree are
+        synced again, and are always read from their first page.
+        Args:
+            stream (cls)
+            start_date (datetime)
+            end_date (datetime)
+            last_updated (str): bookmark to track, for incremental streams
+            default_months (int): window size before density is known
+        Returns:
+            latest_record_date (str)
+        """
+        progress = self.load_export_progress(
+            stream, start_date, end_date, default_months
+        )
+        tracker = None
+        if last_updated is not None:
+            tracker = BookmarkTracker(
+                stream.meta_fields.get('replication_key'), last_updated
+            )
+            if self.profiler:
+                self.profiler.wrap(tracker, 'observe', BOOKMARK_SCAN)
+            tracker.update(progress.latest)
+
+        pending = deque(
+            self.submit_export_window(stream, window)
+            for window in list(progress.windows) if not window['complete']
+        )
+        shard_resyncs = {}
+
+        while pending:
+            window, export = pending.popleft()
+            sync_uri = export.result()
+            window_tag = pendulum.parse(window['start']).to_datetime_string()
+            if not window['sync_uri']:
+                progress.mark_synced(
+                    window, sync_uri, self.client.sync_exports.get(sync_uri)
                 )
-                if total_records >= EXPORT_LIMIT:
-                    LOGGER.info('Export exceeds 5M record limit. Splitting into multiple requests.')
-                    new_end_date = request_start + ((request_end - request_start) / 2)
-                    requests.append((request_start, new_end_date))
-                    requests.append((new_end_date, request_end))
-                    run = False
+            elif sync_uri not in self.client.sync_tags:
+                self.client.tag_sync(sync_uri, stream.stream, window_tag)
+            request_start = pendulum.parse(window['start'])
+            request_end = pendulum.parse(window['end'])
+            start_offset = window['offset']
+            if start_offset and parse_sharded_uri(sync_uri):
+                # Rows carried between the pages of column groups are not
+                # kept in state, so their pages are read again from the start
+                LOGGER.info('Reading column-group export again from offset 0.')
+                start_offset = 0
+
+            try:
+                if self.stream_pages:
+                    # Only the totals are needed up front; every page, the
+                    # first included, is then streamed record by record
+                    total_records = self.client.fetch_export_totals(sync_uri)
+                else:
+                    records, has_more, total_records = self.client.fetch_bulk_export_records(
+                        sync_uri, start_offset, MAX_RECORDS_RETURNED, True
+                    )
+            except ShardMismatchException as exc:
+                # Column groups synced at different moments can disagree
+                # when rows change in between; all of them are synced again
+                shard_resyncs[window['start']] = shard_resyncs.get(window['start'], 0) + 1
+                if shard_resyncs[window['start']] > MAX_SHARD_RESYNCS:
+                    raise
+                LOGGER.warning('%s Syncing the window again.' % exc)
+                self.client.release_export(sync_uri)
+                progress.mark_unsynced(window)
+                progress.save()
+                pending.append(self.submit_export_window(stream, window))
+                continue
+            self.planner.record(
+                self.density_key(stream), request_start, request_end, total_records
+            )
+            if total_records >= self.export_limit:
+                LOGGER.info('Export exceeds %s record limit. Splitting into multiple requests.' % (
+                    self.export_limit
+                ))
+                self.client.release_export(sync_uri)
+                for new_window in progress.replace(window, self.planner.split(
+                        request_start, request_end, total_records)):
+                    pending.append(self.submit_export_window(stream, new_window))
+                continue
+
+            if total_records == 0:
+                LOGGER.info('No records found between %s and %s.' % (request_start, request_end))
+                progress.mark_complete(window)
+                self.client.release_export(sync_uri)
+                continue
+
+            if self.stream_pages:
+                pages = (
+                    self.client.stream_bulk_export_records(
+                        sync_uri, offset, MAX_RECORDS_RETURNED
+                    )
+                    for offset in range(start_offset, total_records, MAX_RECORDS_RETURNED)
+                )
+            else:
+                pages = [records]
+                if has_more:
+                    pages = itertools.chain(pages, self.page_fetcher.fetch_remaining(
+                        sync_uri, total_records, start_offset + MAX_RECORDS_RETURNED
+                    ))
+
+            if self.spill:
+                pages = self.spill.drain(pages)
+
+            offset = start_offset
+            for records in pages:
+                if tracker:
+                    records = tracker.observe(records)
+                if self.sink:
+                    self.write_page_file(stream, window, offset, records, tracker)
+                else:
+                    self.write_records(stream, records, window_tag)
 
-                elif total_records == 0:
-                    LOGGER.info('No records found between %s and %s.' % (request_start, request_end))
-                    run = False
+                offset = min(offset + MAX_RECORDS_RETURNED, total_records)
+                progress.mark_written(window, offset, tracker.value if tracker else None)
+                if offset < total_records:
+                    LOGGER.info('Fetched %s of %s records. Fetching next set of records.' % (
+                        offset, total_records
+                    ))
 
-                else:
-                    transform_write_and_count(stream, records)
-                    
-                    if not has_more:
-                        run = False
-                        LOGGER.info('Completed fetching records. Fetched %s records.' % total_records)
-
-                    else:
-                        offset = offset + MAX_RECORDS_RETURNED
-                        LOGGER.info('Fetched %s of %s records. Fetching next set of records.' % (
-                            offset, total_records
-                        ))
-            if request_end < pendulum.now():
-                new_end_date = request_end.add(months=1)
-                requests.append((request_end, new_end_date))
\ No newline at end of file
+            progress.mark_complete(window)
+            self.client.release_export(sync_uri)
+            LOGGER.info('Completed fetching records. Fetched %s records.' % total_records)
+
+        progress.finish()
+        return tracker.value if tracker else None
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import re
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Quoted date literals in an export filter, e.g. '2019-08-06 04:29:15'
+FILTER_DATE_PATTERN = re.compile(r"'\d{4}-\d{2}-\d{2}[^']*'")
+
+
+class ExportRegistry:
+    """
+    Tracks the export definitions the tap creates so later windows and
+    retries can reuse them instead of POSTing a new definition each time.
+    Definitions are keyed by endpoint, field set and filter shape (the
+    filter with its dates removed). A definition is checked out while its
+    sync runs and its data is read, updated in place with the new window's
+    filter, and returned for reuse once the window's last page is read.
+    Definitions created by the tap, or adopted from a resumed run, are
+    deleted by `cleanup`.
+    """
+
+    def __init__(self, client, reuse=True):
+        """
+        Args:
+            client (EloquaClient)
+            reuse (bool)
+        """
+        self.client = client
+        self.reuse = reuse
+        self.idle = {}
+        self.keys = {}
+        self.created = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def build_key(endpoint_name, request_body):
+        """
+        Args:
+            endpoint_name (str)
+            request_body (dict)
+        Returns:
+            definition shape key (str)
+        """
+        shape = {
+            'endpoint': endpoint_name,
+            'fields': request_body.get('fields'),
+            'filter': FILTER_DATE_PATTERN.sub("''", request_body.get('filter', ''))
+        }
+        shape_json = json.dumps(shape, sort_keys=True)
+        return hashlib.sha1(shape_json.encode('utf-8')).hexdigest()
+
+    def acquire(self, endpoint_name, request_body):
+        """
+        Returns an export definition matching request_body, updating an
+        idle one of the same shape when possible and creating one otherwise
+        Args:
+            endpoint_name (str)
+            request_body (dict)
+        Returns:
+            export uri (str)
+        """
+        key, export_uri = self.checkout(endpoint_name, request_body)
+        if export_uri:
+            self.client.update_export_definition(export_uri, request_body)
+            self.track(export_uri, key)
+        else:
+            export_uri = self.client.create_export_definition(
+                endpoint_name, request_body
+            )
+            self.track(export_uri, key, created=True)
+        return export_uri
+
+    def checkout(self, endpoint_name, request_body):
+        """
+        Takes an idle definition of the request's shape, for callers that
+        update or create the definition on their own, e.g. with asyncio,
+        and then `track` it
+        Args:
+            endpoint_name (str)
+            request_body (dict)
+        Returns:
+            shape key (str), idle export uri (str) or None
+        """
+        key = self.build_key(endpoint_name, request_body)
+        export_uri = None
+        if self.reuse:
+            with self.lock:
+                idle = self.idle.get(key)
+                if idle:
+                    export_uri = idle.pop()
+        if export_uri:
+            LOGGER.info('Reusing export definition %s.' % export_uri)
+        return key, export_uri
+
+    def track(self, export_uri, key, created=False):
+        """
+        Records a checked out definition until it is released
+        Args:
+            export_uri (str)
+            key (str): from checkout
+            created (bool): whether the definition was just created, so
+                cleanup deletes it
+        """
+        with self.lock:
+            if created:
+                self.created.append(export_uri)
+            self.keys[export_uri] = key
+
+    def release(self, export_uri):
+        """
+        Makes a definition available to the next export of the same shape
+        Args:
+            export_uri (str)
+        """
+        with self.lock:
+            key = self.keys.pop(export_uri, None)
+            if key is not None:
+                self.idle.setdefault(key, []).append(export_uri)
+
+    def adopt(self, export_uri):
+        """
+        Takes over a definition created by an earlier run, so it is deleted
+        once the windows resumed from it are done
+        Args:
+            export_uri (str)
+        """
+        with self.lock:
+            if export_uri not in self.created:
+                self.created.append(export_uri)
+
+    def take_created(self, keep=()):
+        """
+        Stops tracking the definitions created by the tap, except those in
+        `keep`, for the caller to delete
+        Args:
+            keep (set)
+        Returns:
+            export uris (list)
+        """
+        with self.lock:
+            created = [uri for uri in self.created if uri not in keep]
+            self.created = [uri for uri in self.created if uri in keep]
+            self.idle = {}
+            self.keys = {}
+        return created
+
+    def cleanup(self, keep=()):
+        """
+        Deletes every export definition created by the tap, except those
+        in `keep`, which stay tracked for a later cleanup. Failures are
+        logged rather than raised so they never fail a completed sync.
+        Args:
+            keep (set): export uris still needed, e.g. by windows left
+                unfinished in state
+        """
+        created = self.take_created(keep)
+        for export_uri in created:
+            try:
+                self.client.delete_export_definition(export_uri)
+            except Exception as exc:
+                LOGGER.warning('Could not delete export definition %s: %s' % (
+                    export_uri, exc
+                ))
+        if created:
+            LOGGER.info('Deleted %s export definitions.' % len(created))
+        if self.created:
+            LOGGER.info('Kept %s export definitions for unfinished windows.' % len(
+                self.created
+            ))
@@ -0,0 +1,314 @@
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Requests per second allowed to one site when not set by config
+DEFAULT_REQUESTS_PER_SECOND = 20
+# Status codes Eloqua answers with when a site is over its limits
+THROTTLE_STATUS_CODES = (429, 503)
+# Seconds to wait after a throttled response without a Retry-After
+DEFAULT_THROTTLE_WAIT_SECS = 5
+# Throttled responses waited out before the last one is returned
+MAX_THROTTLE_RETRIES = 8
+# Fraction of the request rate and concurrency limit kept after throttling
+THROTTLE_BACKOFF = 0.5
+# Lowest request rate throttling can push the governor down to
+MIN_REQUESTS_PER_SECOND = 0.5
+# Successful requests before the request rate grows back by a tenth
+RECOVERY_REQUESTS = 50
+
+
+def parse_retry_after(value):
+    """
+    Args:
+        value (str): Retry-After header, in seconds or as an HTTP date
+    Returns:
+        seconds to wait (float)
+    """
+    if not value:
+        return DEFAULT_THROTTLE_WAIT_SECS
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_THROTTLE_WAIT_SECS
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average with bursts of up to
+    `burst`. A rate of None allows everything.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float)
+            burst (float)
+        """
+        self.rate = rate
+        self.burst = max(1.0, float(burst or rate or 1))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """
+        Takes a token when one is available, without blocking
+        Returns:
+            0 once a token is taken, otherwise seconds until one will
+            be available (float)
+        """
+        with self.lock:
+            if not self.rate:
+                return 0
+
+            now = time.time()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def set_rate(self, rate):
+        """
+        Args:
+            rate (float)
+        """
+        with self.lock:
+            self.rate = rate
+
+
+class AdaptiveLimit:
+    """
+    Semaphore whose limit can be lowered while slots are held. Lowering it
+    blocks new holders until enough slots are released; it grows back by
+    one slot per `recover` up to the configured ceiling. A limit of None
+    is unlimited until the first `reduce`. Callers that cannot block, e.g.
+    on an event loop, register a waiter to be called whenever a slot may
+    have come free.
+    """
+
+    def __init__(self, name, limit=None):
+        """
+        Args:
+            name (str)
+            limit (int)
+        """
+        self.name = name
+        self.ceiling = limit
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = set()
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.limit is not None and self.in_use >= self.limit:
+                self.condition.wait()
+            self.in_use += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def try_acquire(self):
+        """
+        Takes a slot when one is free, without blocking
+        Returns:
+            whether a slot was taken (bool)
+        """
+        with self.condition:
+            if self.limit is not None and self.in_use >= self.limit:
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self):
+        """
+        Gives back a slot taken with `try_acquire` or `with`
+        """
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
+        self.wake_waiters()
+
+    def add_waiter(self, callback):
+        """
+        Args:
+            callback (callable): called, from any thread, whenever a slot
+                may have come free
+        """
+        with self.condition:
+            self.waiters.add(callback)
+
+    def remove_waiter(self, callback):
+        """
+        Args:
+            callback (callable)
+        """
+        with self.condition:
+            self.waiters.discard(callback)
+
+    def wake_waiters(self):
+        """
+        Calls the registered waiters, outside the lock
+        """
+        with self.condition:
+            waiters = list(self.waiters)
+        for callback in waiters:
+            callback()
+
+    def reduce(self):
+        """
+        Lowers the limit after Eloqua throttled a holder
+        """
+        with self.condition:
+            current = self.limit if self.limit is not None else self.in_use
+            self.limit = max(1, int(current * THROTTLE_BACKOFF))
+        LOGGER.warning('Lowered concurrent %s to %s.' % (self.name, self.limit))
+
+    def recover(self):
+        """
+        Raises a lowered limit by one slot
+        """
+        with self.condition:
+            if self.limit is None or self.limit == self.ceiling:
+                return
+            self.limit += 1
+            self.condition.notify_all()
+        self.wake_waiters()
+
+
+class RequestGovernor:
+    """
+    Keeps one site's traffic under Eloqua's limits. Requests take a token
+    from a rate-limited bucket, syncs and exports hold a slot of their
+    concurrency limit, and a throttled response pauses every request
+    until its Retry-After has passed. Throttling halves the request rate
+    (and the limit of the operation that was throttled); sustained success
+    grows them back to the configured ceilings.
+    """
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 burst=None, max_syncs=None, max_exports=None):
+        """
+        Args:
+            requests_per_second (float): None for no rate limit
+            burst (float)
+            max_syncs (int): None for no limit
+            max_exports (int): None for no limit
+        """
+        self.max_rate = requests_per_second
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.syncs = AdaptiveLimit('syncs', max_syncs)
+        self.exports = AdaptiveLimit('exports', max_exports)
+        self.paused_until = 0
+        self.successes = 0
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            governor (RequestGovernor)
+        """
+        def optional_number(key, default=None, cast=int):
+            value = config.get(key, default)
+            return cast(value) if value else None
+
+        return cls(
+            requests_per_second=optional_number(
+                'max_requests_per_second', DEFAULT_REQUESTS_PER_SECOND, float
+            ),
+            burst=optional_number('request_burst', cast=float),
+            max_syncs=optional_number('max_concurrent_syncs'),
+            max_exports=optional_number('max_active_exports')
+        )
+
+    def wait(self):
+        """
+        Blocks until the site is not paused and the request rate allows
+        another request
+        """
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def reserve(self):
+        """
+        Takes the next request's turn when the site is not paused and the
+        rate allows it, without blocking, for callers that wait on their
+        own, e.g. with asyncio
+        Returns:
+            0 once the request may be sent, otherwise seconds to wait
+            before asking again (float)
+        """
+        wait = self.paused_until - time.time()
+        if wait > 0:
+            return wait
+        return self.bucket.try_acquire()
+
+    def succeeded(self):
+        """
+        Counts a request that was not throttled, growing a lowered request
+        rate back towards its ceiling
+        """
+        with self.lock:
+            self.successes += 1
+            rate = self.bucket.rate
+            if not self.max_rate or rate is None or rate >= self.max_rate:
+                return
+            if self.successes % RECOVERY_REQUESTS == 0:
+                self.bucket.set_rate(min(self.max_rate, rate * 1.1))
+
+    def throttled(self, retry_after, limit=None):
+        """
+        Pauses requests for the Retry-After period and lowers the request
+        rate, and the given concurrency limit when the throttled request
+        was starting a sync or export
+        Args:
+            retry_after (str): Retry-After header
+            limit (AdaptiveLimit)
+        """
+        wait = parse_retry_after(retry_after)
+        with self.lock:
+            self.throttled_count += 1
+            self.paused_until = max(self.paused_until, time.time() + wait)
+            if self.bucket.rate:
+                self.bucket.set_rate(
+                    max(MIN_REQUESTS_PER_SECOND, self.bucket.rate * THROTTLE_BACKOFF)
+                )
+        LOGGER.warning('Eloqua throttled a request; pausing %.1fs at %s '
+                       'requests/s.' % (wait, self.bucket.rate))
+        if limit is not None:
+            limit.reduce()
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# Phases of an export timed by PhaseMetrics
+EXPORT_CREATE = 'export_create'
+SYNC_WAIT = 'sync_wait'
+PAGE_DOWNLOAD = 'page_download'
+WRITE = 'write'
+# Counters kept by PhaseMetrics
+REQUESTS = 'requests'
+BYTES = 'bytes'
+ROWS = 'rows'
+SYNC_RETRIES = 'sync_retries'
+THROTTLED = 'throttled'
+# Prefix of every Prometheus metric name
+PROMETHEUS_PREFIX = 'tap_eloqua_'
+
+
+def escape_label(value):
+    """
+    Args:
+        value (str)
+    Returns:
+        Prometheus label value (str)
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PhaseMetrics:
+    """
+    Times each phase of an export (export creation, sync wait, page
+    download and transform/write) and counts requests, bytes, rows and
+    retries. Every measurement is logged as a Singer METRIC tagged with its
+    stream and window, and totals per stream are kept for a JSON summary
+    or Prometheus textfile written at the end of the run.
+    """
+
+    def __init__(self, json_path=None, prometheus_path=None):
+        """
+        Args:
+            json_path (str)
+            prometheus_path (str)
+        """
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.phases = {}
+        self.counters = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            metrics (PhaseMetrics)
+        """
+        return cls(
+            json_path=config.get('metrics_json_path'),
+            prometheus_path=config.get('metrics_prometheus_path')
+        )
+
+    @contextmanager
+    def phase(self, name, stream=None, window=None):
+        """
+        Times the body as one occurrence of a phase
+        Args:
+            name (str)
+            stream (str)
+            window (str): start of the export window
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.time() - started, stream, window)
+
+    def record_phase(self, name, seconds, stream=None, window=None):
+        """
+        Args:
+            name (str)
+            seconds (float)
+            stream (str)
+            window (str)
+        """
+        with self.lock:
+            totals = self.phases.setdefault((name, stream), {
+                'count': 0, 'seconds': 0.0, 'max_seconds': 0.0
+            })
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+        self.log('timer', name, seconds, stream, window)
+
+    def count(self, name, value=1, stream=None, window=None, log=True):
+        """
+        Args:
+            name (str)
+            value (int)
+            stream (str)
+            window (str)
+            log (bool): also log a METRIC for this increment
+        """
+        with self.lock:
+            key = (name, stream)
+            self.counters[key] = self.counters.get(key, 0) + value
+        if log:
+            self.log('counter', name, value, stream, window)
+
+    def log(self, metric_type, name, value, stream=None, window=None):
+        """
+        Logs a Singer METRIC message
+        Args:
+            metric_type (str)
+            name (str)
+            value (float)
+            stream (str)
+            window (str)
+        """
+        tags = {}
+        if stream:
+            tags['stream'] = stream
+        if window:
+            tags['window'] = window
+        metrics.log(LOGGER, metrics.Point(metric_type, name, value, tags))
+
+    def summary(self):
+        """
+        Returns:
+            totals per phase and counter, by stream (dict)
+        """
+        with self.lock:
+            phases = {}
+            for (name, stream), totals in self.phases.items():
+                phases.setdefault(name, {})[stream or 'all'] = dict(totals)
+            counters = {}
+            for (name, stream), value in self.counters.items():
+                counters.setdefault(name, {})[stream or 'all'] = value
+
+        return {
+            'elapsed_seconds': time.time() - self.started,
+            'phases': phases,
+            'counters': counters
+        }
+
+    def write(self):
+        """
+        Writes the configured summary files
+        """
+        if self.json_path:
+            self.write_file(self.json_path, json.dumps(
+                self.summary(), indent=2, sort_keys=True
+            ))
+        if self.prometheus_path:
+            self.write_file(self.prometheus_path, self.format_prometheus())
+
+    def format_prometheus(self):
+        """
+        Returns:
+            Prometheus text exposition of the totals (str)
+        """
+        summary = self.summary()
+        lines = []
+
+        def add_family(name, metric_type, samples):
+            lines.append('# TYPE {prefix}{name} {type}'.format(
+                prefix=PROMETHEUS_PREFIX, name=name, type=metric_type
+            ))
+            for labels, value in samples:
+                label_text = ','.join(
+                    '{key}="{value}"'.format(key=key, value=escape_label(label))
+                    for key, label in sorted(labels.items())
+                )
+                if label_text:
+                    label_text = '{' + label_text + '}'
+                lines.append('{prefix}{name}{labels} {value}'.format(
+                    prefix=PROMETHEUS_PREFIX, name=name, labels=label_text,
+                    value=value
+                ))
+
+        for field, suffix in (('seconds', 'phase_seconds_total'),
+                              ('count', 'phase_count_total')):
+            add_family(suffix, 'counter', [
+                ({'phase': phase, 'stream': stream}, totals[field])
+                for phase, streams in sorted(summary['phases'].items())
+                for stream, totals in sorted(streams.items())
+            ])
+        add_family('phase_max_seconds', 'gauge', [
+            ({'phase': phase, 'stream': stream}, totals['max_seconds'])
+            for phase, streams in sorted(summary['phases'].items())
+            for stream, totals in sorted(streams.items())
+        ])
+        for name, streams in sorted(summary['counters'].items()):
+            add_family(name + '_total', 'counter', [
+                ({'stream': stream}, value)
+                for stream, value in sorted(streams.items())
+            ])
+        add_family('run_seconds', 'gauge', [({}, summary['elapsed_seconds'])])
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def write_file(path, content):
+        """
+        Writes a file atomically, so collectors never read a partial one
+        Args:
+            path (str)
+            content (str)
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,232 @@
+import io
+import itertools
+import json
+import sys
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Bytes buffered before stdout is written
+DEFAULT_OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Encoded messages joined into a single write
+DEFAULT_OUTPUT_BATCH_SIZE = 1000
+# Encoder for RECORD messages when `json_encoder` is not set; the standard
+# library writes exactly what singer's write_record does
+DEFAULT_JSON_ENCODER = 'json'
+
+
+def iter_batches(items, batch_size):
+    """
+    Args:
+        items (iterable)
+        batch_size (int)
+    Returns:
+        lists of up to batch_size items, in order (generator)
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_json_encoder(name=DEFAULT_JSON_ENCODER):
+    """
+    Picks the JSON encoder used for RECORD messages. With 'auto' the
+    fastest installed of orjson and ujson is used, falling back to the
+    standard library. orjson and ujson write compact JSON with raw UTF-8,
+    which parses the same but is not byte for byte singer's output.
+    Args:
+        name (str): 'auto', 'orjson', 'ujson' or 'json'
+    Returns:
+        encoder name (str), dumps returning str (callable)
+    """
+    candidates = ['orjson', 'ujson', 'json'] if name == 'auto' else [name]
+    for candidate in candidates:
+        if candidate == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                continue
+            return candidate, lambda obj: orjson.dumps(obj).decode('utf-8')
+        if candidate == 'ujson':
+            try:
+                import ujson
+            except ImportError:
+                continue
+            return candidate, ujson.dumps
+        if candidate == 'json':
+            return candidate, json.dumps
+
+    raise ValueError('JSON encoder %s is not installed.' % name)
+
+
+class BufferedOutput:
+    """
+    Replaces stdout with a large-buffered writer for the duration of a sync
+    and writes encoded messages in batches. Every message, including the
+    SCHEMA and STATE messages singer writes itself, still goes through the
+    same stdout object, so ordering is unchanged; singer's flush after a
+    STATE message pushes out every record written before it.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE,
+                 batch_size=DEFAULT_OUTPUT_BATCH_SIZE, encoder=DEFAULT_JSON_ENCODER):
+        """
+        Args:
+            buffer_size (int)
+            batch_size (int)
+            encoder (str)
+        """
+        self.buffer_size = buffer_size
+        self.batch_size = max(1, batch_size)
+        self.encoder_name, self.dumps = load_json_encoder(encoder)
+        self.original_stdout = None
+        self.records = 0
+        self.bytes = 0
+        self.started = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            output (BufferedOutput)
+        """
+        return cls(
+            buffer_size=int(config.get('output_buffer_size', DEFAULT_OUTPUT_BUFFER_SIZE)),
+            batch_size=int(config.get('output_batch_size', DEFAULT_OUTPUT_BATCH_SIZE)),
+            encoder=config.get('json_encoder', DEFAULT_JSON_ENCODER)
+        )
+
+    def install(self):
+        """
+        Flushes the current stdout and swaps in the buffered writer
+        """
+        sys.stdout.flush()
+        self.original_stdout = sys.stdout
+        raw = io.open(sys.stdout.fileno(), 'wb', buffering=self.buffer_size,
+                      closefd=False)
+        sys.stdout = io.TextIOWrapper(raw, encoding='utf-8', newline='\n')
+        self.started = time.time()
+        LOGGER.info('Buffering output with the %s encoder.' % self.encoder_name)
+
+    def uninstall(self):
+        """
+        Flushes buffered output, restores stdout and reports throughput
+        """
+        if self.original_stdout is None:
+            return
+
+        sys.stdout.flush()
+        sys.stdout.detach()
+        sys.stdout = self.original_stdout
+        self.original_stdout = None
+        self.report()
+
+    def write_lines(self, lines):
+        """
+        Writes newline-terminated messages, joined into batches
+        Args:
+            lines (iterable of str)
+        Returns:
+            messages written (int)
+        """
+        write = sys.stdout.write
+        batch = []
+        count = 0
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                count += self.write_batch(write, batch)
+                batch = []
+        if batch:
+            count += self.write_batch(write, batch)
+        return count
+
+    def write_batch(self, write, batch):
+        """
+        Args:
+            write (callable)
+            batch (list of str)
+        Returns:
+            messages written (int)
+        """
+        data = ''.join(batch)
+        write(data)
+        self.records += len(batch)
+        self.bytes += len(data)
+        return len(batch)
+
+    def report(self):
+        """
+        Logs messages and bytes written and the rate since install
+        """
+        elapsed = max(time.time() - (self.started or time.time()), 1e-6)
+        LOGGER.info('Wrote %s records (%.1f MB) at %.0f records/s.' % (
+            self.records, self.bytes / 1048576.0, self.records / elapsed
+        ))
+
+
+class ThreadOutputRouter:
+    """
+    Stands in for stdout and sends each write to the stream bound to the
+    writing thread, so several syncs in one process (one per site) can
+    each produce their own Singer output. Threads with nothing bound
+    write to the stdout that was replaced.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.original_stdout = None
+
+    def install(self):
+        """
+        Flushes the current stdout and routes writes through the router
+        """
+        sys.stdout.flush()
+        self.original_stdout = sys.stdout
+        sys.stdout = self
+
+    def uninstall(self):
+        """
+        Restores the stdout that was replaced
+        """
+        if self.original_stdout is None:
+            return
+
+        sys.stdout = self.original_stdout
+        self.original_stdout = None
+
+    def bind(self, target):
+        """
+        Routes the calling thread's writes to target
+        Args:
+            target (file)
+        """
+        self.local.target = target
+
+    def unbind(self):
+        """
+        Routes the calling thread's writes back to stdout
+        """
+        self.local.target = None
+
+    @property
+    def target(self):
+        return getattr(self.local, 'target', None) or \
+            self.original_stdout or sys.__stdout__
+
+    def write(self, data):
+        return self.target.write(data)
+
+    def flush(self):
+        self.target.flush()
+
+    def fileno(self):
+        return self.target.fileno()
@@ -0,0 +1,82 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Default number of export data pages downloaded at once
+DEFAULT_MAX_CONCURRENT_PAGES = 1
+
+
+class PageFetcher:
+    """
+    Downloads the pages of a finished export sync on a bounded worker pool.
+    Once the first page reports `totalResults` every remaining offset is
+    known, so later pages can be in flight while earlier ones are written.
+    Pages are handed back strictly in offset order and at most
+    `max_workers` pages are held at once.
+    """
+
+    def __init__(self, client, page_size,
+                 max_workers=DEFAULT_MAX_CONCURRENT_PAGES):
+        """
+        Args:
+            client (EloquaClient)
+            page_size (int)
+            max_workers (int)
+        """
+        self.client = client
+        self.page_size = page_size
+        self.max_workers = max(1, int(max_workers))
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='eloqua-page'
+        )
+
+    def fetch_page(self, sync_uri, offset):
+        """
+        Args:
+            sync_uri (str)
+            offset (int)
+        Returns:
+            records (list)
+        """
+        records, _, _ = self.client.fetch_bulk_export_records(
+            sync_uri, offset, self.page_size, True
+        )
+        return records
+
+    def fetch_remaining(self, sync_uri, total_records, start_offset):
+        """
+        Yields the pages from start_offset to the end of the export in
+        offset order. The first failed page stops the fetch and re-raises,
+        so no page after it is ever returned.
+        Args:
+            sync_uri (str)
+            total_records (int)
+            start_offset (int)
+        Returns:
+            pages of records (generator)
+        """
+        offsets = deque(range(start_offset, total_records, self.page_size))
+        in_flight = deque()
+
+        try:
+            while offsets or in_flight:
+                while offsets and len(in_flight) < self.max_workers:
+                    offset = offsets.popleft()
+                    in_flight.append(
+                        self.pool.submit(self.fetch_page, sync_uri, offset)
+                    )
+                yield in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Args:
+            wait (bool)
+        """
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,159 @@
+import math
+
+from datetime import timedelta
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Rows an export window is sized to hold when the stream's density is known
+DEFAULT_TARGET_EXPORT_ROWS = 4000000
+# Smallest window the planner will produce, in seconds
+MIN_WINDOW_SECS = 60
+# Weight given to the newest observation when updating a stream's density
+DENSITY_WEIGHT = 0.5
+# Joins a stream name and the field its windows filter on in density keys
+DENSITY_KEY_SEPARATOR = ':'
+
+
+def density_key(stream_name, filter_key):
+    """
+    Densities are learned per stream and filter field, since a stream's
+    rows spread differently over, e.g., creation and modification dates
+    Args:
+        stream_name (str)
+        filter_key (str): field the stream's export windows filter on
+    Returns:
+        key (str), e.g. contacts:c_datemodified
+    """
+    return stream_name + DENSITY_KEY_SEPARATOR + filter_key
+
+
+class WindowPlanner:
+    """
+    Sizes export date windows from each stream's row density (rows per
+    hour) along the field its windows filter on, learned from the
+    `totalResults` of earlier exports and carried between runs in state. Oversized exports are split straight into
+    enough windows to fit the target rather than halved repeatedly, and
+    new ranges are cut into windows expected to hold about `target_rows`.
+    """
+
+    def __init__(self, target_rows=DEFAULT_TARGET_EXPORT_ROWS):
+        """
+        Args:
+            target_rows (int)
+        """
+        self.target_rows = target_rows
+        self.densities = {}
+
+    def load_history(self, densities):
+        """
+        Seeds row densities, usually from a previous run's state
+        Args:
+            densities (dict): rows per hour by density_key
+        """
+        for key, density in (densities or {}).items():
+            # Densities saved by stream name alone may mix filter fields
+            if DENSITY_KEY_SEPARATOR in key:
+                self.densities[key] = float(density)
+
+    def record(self, key, start, end, total_records):
+        """
+        Folds the row count of an export window into its density
+        Args:
+            key (str): from density_key
+            start (datetime)
+            end (datetime)
+            total_records (int)
+        """
+        hours = (end - start).total_seconds() / 3600
+        if hours <= 0:
+            return
+
+        density = total_records / hours
+        previous = self.densities.get(key)
+        if previous is not None:
+            density = DENSITY_WEIGHT * density + (1 - DENSITY_WEIGHT) * previous
+        self.densities[key] = density
+
+    def estimate(self, key, start, end):
+        """
+        Args:
+            key (str): from density_key
+            start (datetime)
+            end (datetime)
+        Returns:
+            expected rows in the window (float), or None while the
+            density is unknown
+        """
+        density = self.densities.get(key)
+        if density is None:
+            return None
+        return density * (end - start).total_seconds() / 3600
+
+    def split(self, start, end, total_records):
+        """
+        Splits an oversized window into enough equal windows for each to
+        hold about target_rows
+        Args:
+            start (datetime)
+            end (datetime)
+            total_records (int)
+        Returns:
+            windows (list of (datetime, datetime))
+        """
+        count = max(2, int(math.ceil(total_records / float(self.target_rows))))
+        LOGGER.info('Splitting export into %s windows.' % count)
+
+        step = timedelta(seconds=(end - start).total_seconds() / count)
+        boundaries = [start + step * i for i in range(1, count)]
+        return list(zip([start] + boundaries, boundaries + [end]))
+
+    def plan(self, key, start, end, default_months=None):
+        """
+        Cuts a date range into windows sized for target_rows from the
+        known density. Without a density the range is cut into
+        default_months windows, or left whole when that is not given.
+        Args:
+            key (str): from density_key
+            start (datetime)
+            end (datetime)
+            default_months (int)
+        Returns:
+            windows (list of (datetime, datetime))
+        """
+        density = self.densities.get(key)
+        if density is None:
+            if not default_months:
+                return [(start, end)]
+            windows = []
+            window_start = start
+            while window_start < end:
+                window_end = min(window_start.add(months=default_months), end)
+                windows.append((window_start, window_end))
+                window_start = window_end
+            return windows or [(start, end)]
+
+        if density <= 0:
+            return [(start, end)]
+
+        return self.cut(start, end, self.target_rows / density * 3600)
+
+    def cut(self, start, end, window_secs):
+        """
+        Cuts a date range into consecutive windows of window_secs
+        Args:
+            start (datetime)
+            end (datetime)
+            window_secs (float)
+        Returns:
+            windows (list of (datetime, datetime))
+        """
+        window_secs = max(window_secs, MIN_WINDOW_SECS)
+        windows = []
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + timedelta(seconds=window_secs), end)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows or [(start, end)]
@@ -0,0 +1,199 @@
+import random
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Seconds before the first sync status check
+DEFAULT_FIRST_DELAY_SECS = 5
+# Growth factor applied to the delay after each status check
+DEFAULT_MULTIPLIER = 2
+# Longest delay between two status checks
+DEFAULT_MAX_DELAY_SECS = 60
+# Give up on a sync that has not finished after this long
+DEFAULT_DEADLINE_SECS = 6000
+# Fraction of each delay randomized so concurrent syncs do not poll in step
+DEFAULT_JITTER = 0.1
+# Fraction of a window's expected sync duration to wait before the first check
+LEARNED_FIRST_POLL_RATIO = 0.8
+# Weight given to the newest observation when updating a typical duration
+LEARNED_DURATION_WEIGHT = 0.5
+
+
+class PollingPolicy:
+    """
+    Schedules sync status checks: a short first check, exponential growth
+    with jitter up to a cap, and an overall deadline measured on the
+    monotonic clock from the start of polling, so time spent in status
+    requests counts towards it. Typical sync durations and the rows they
+    covered are learned per stream, and the first check for a window is
+    pushed out in proportion to the rows expected in it, never beyond the
+    typical duration. Windows without an estimate are checked early. A
+    finished sync's duration is only learned once its first page reports
+    how many rows it actually returned, so a poor estimate does not feed
+    back into later ones. The executor carries what was learned between
+    runs in state.
+    """
+
+    def __init__(self, first_delay=DEFAULT_FIRST_DELAY_SECS,
+                 multiplier=DEFAULT_MULTIPLIER,
+                 max_delay=DEFAULT_MAX_DELAY_SECS,
+                 deadline=DEFAULT_DEADLINE_SECS,
+                 jitter=DEFAULT_JITTER):
+        """
+        Args:
+            first_delay (float)
+            multiplier (float)
+            max_delay (float)
+            deadline (float)
+            jitter (float)
+        """
+        self.first_delay = first_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+        self.sync_durations = {}
+        # Stream and duration of finished syncs whose row count is not
+        # known yet, by sync uri
+        self.pending = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a policy from the optional `poll_*` config keys
+        Args:
+            config (dict)
+        Returns:
+            policy (PollingPolicy)
+        """
+        return cls(
+            first_delay=float(config.get('poll_first_delay', DEFAULT_FIRST_DELAY_SECS)),
+            multiplier=float(config.get('poll_multiplier', DEFAULT_MULTIPLIER)),
+            max_delay=float(config.get('poll_max_delay', DEFAULT_MAX_DELAY_SECS)),
+            deadline=float(config.get('poll_deadline', DEFAULT_DEADLINE_SECS)),
+            jitter=float(config.get('poll_jitter', DEFAULT_JITTER))
+        )
+
+    def load_history(self, sync_durations):
+        """
+        Seeds typical sync durations, usually from a previous run's state
+        Args:
+            sync_durations (dict): typical `seconds` and `rows` keyed by
+                stream name
+        """
+        for stream_name, typical in (sync_durations or {}).items():
+            # Durations saved without their row counts cannot be scaled
+            if isinstance(typical, dict):
+                self.sync_durations[stream_name] = {
+                    'seconds': float(typical['seconds']),
+                    'rows': float(typical['rows'])
+                }
+
+    def record(self, stream_name, seconds, rows):
+        """
+        Folds an observed sync duration and the rows the sync returned
+        into the stream's typical sync
+        Args:
+            stream_name (str)
+            seconds (float)
+            rows (float): None when the row count is unknown
+        """
+        if rows is None:
+            return
+
+        previous = self.sync_durations.get(stream_name)
+        if previous is None:
+            self.sync_durations[stream_name] = {'seconds': seconds, 'rows': rows}
+            return
+
+        self.sync_durations[stream_name] = dict(
+            (key, LEARNED_DURATION_WEIGHT * value
+             + (1 - LEARNED_DURATION_WEIGHT) * previous[key])
+            for key, value in (('seconds', seconds), ('rows', rows))
+        )
+
+    def synced(self, sync_uri, stream_name, seconds):
+        """
+        Holds a finished sync's duration until `observe_rows` reports the
+        rows it returned
+        Args:
+            sync_uri (str)
+            stream_name (str)
+            seconds (float)
+        """
+        self.pending[sync_uri] = (stream_name, seconds)
+
+    def observe_rows(self, sync_uri, rows):
+        """
+        Learns from a finished sync once its row count is known; later
+        pages of the same sync are ignored
+        Args:
+            sync_uri (str)
+            rows (int): `totalResults` of the sync
+        """
+        pending = self.pending.pop(sync_uri, None)
+        if pending is not None and rows is not None:
+            stream_name, seconds = pending
+            self.record(stream_name, seconds, float(rows))
+
+    def forget(self, sync_uri):
+        """
+        Drops a sync that was released without its rows being read
+        Args:
+            sync_uri (str)
+        """
+        self.pending.pop(sync_uri, None)
+
+    def first_delay_for(self, stream_name, expected_rows=None):
+        """
+        Args:
+            stream_name (str)
+            expected_rows (float): rows the window is expected to hold
+        Returns:
+            seconds to wait before the first status check (float)
+        """
+        typical = self.sync_durations.get(stream_name)
+        if not typical or expected_rows is None:
+            return self.first_delay
+
+        scale = min(1.0, expected_rows / max(typical['rows'], 1.0))
+        learned = typical['seconds'] * scale * LEARNED_FIRST_POLL_RATIO
+        return min(max(self.first_delay, learned), self.deadline)
+
+    def delays(self, stream_name=None, expected_rows=None):
+        """
+        Yields the delay before each status check until the deadline
+        would be passed
+        Args:
+            stream_name (str)
+            expected_rows (float)
+        Returns:
+            delays in seconds (generator)
+        """
+        started = self.now()
+        delay = self.first_delay_for(stream_name, expected_rows)
+        while True:
+            remaining = self.deadline - (self.now() - started)
+            if remaining <= 0:
+                return
+            jittered = delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            yield min(jittered, remaining)
+            delay = min(max(delay, self.first_delay) * self.multiplier,
+                        self.max_delay)
+
+    def now(self):
+        """
+        Returns:
+            monotonic clock reading in seconds (float)
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """
+        Blocks for the given delay; separate so callers can swap the clock
+        Args:
+            seconds (float)
+        """
+        time.sleep(seconds)
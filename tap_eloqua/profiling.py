@@ -0,0 +1,275 @@
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Phases that can be profiled
+PAGE_PARSE = 'page_parse'
+TRANSFORM = 'transform'
+BOOKMARK_SCAN = 'bookmark_scan'
+WRITE = 'write'
+PHASES = (PAGE_PARSE, TRANSFORM, BOOKMARK_SCAN, WRITE)
+# Allocation sites listed in each memory snapshot
+DEFAULT_TOP_ALLOCATIONS = 10
+# Functions listed in each phase's text report
+REPORT_FUNCTIONS = 50
+# Frames kept per traced allocation
+TRACEMALLOC_FRAMES = 5
+# Python 3.12+ allows one active cProfile per interpreter, which then
+# sees every thread
+SHARED_PROFILER = sys.version_info >= (3, 12)
+# Name of the profile covering every phase when the profiler is shared
+ALL_PHASES = 'all'
+
+
+class Profiler:
+    """
+    Profiles selected phases of a sync by wrapping the methods that run
+    them on the client, executor, transformers and bookmark trackers.
+    Each phase gets its own CPU profile per thread, and a phase running
+    inside another (a bookmark scan feeding a write) is switched to its
+    own profile while it runs, so time lands in exactly one phase. With
+    memory profiling on, the top allocation sites are recorded each time
+    a page finishes. Nothing is wrapped unless profiling is configured.
+    Results are written to a directory per run. On Python 3.12+, where
+    only one profiler can run at a time, a single profile covers the whole
+    sync and is written as 'all'.
+    """
+
+    def __init__(self, directory, phases=PHASES, memory=True,
+                 top_allocations=DEFAULT_TOP_ALLOCATIONS):
+        """
+        Args:
+            directory (str): parent of the run directory
+            phases (iterable of str)
+            memory (bool): record allocation snapshots
+            top_allocations (int)
+        """
+        unknown = set(phases) - set(PHASES)
+        if unknown:
+            raise ValueError('Unknown profile_phases: %s' % ', '.join(sorted(unknown)))
+
+        self.directory = os.path.join(directory, '{time}-{pid}'.format(
+            time=time.strftime('%Y%m%dT%H%M%S'), pid=os.getpid()
+        ))
+        self.phases = frozenset(phases)
+        self.memory = memory
+        self.top_allocations = top_allocations
+        self.profiles = {}
+        self.shared = None
+        self.pages = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            profiler (Profiler), or None when `profile_dir` is not set
+        """
+        directory = config.get('profile_dir')
+        if not directory:
+            return None
+
+        phases = config.get('profile_phases', PHASES)
+        if isinstance(phases, str):
+            phases = [phase.strip() for phase in phases.split(',') if phase.strip()]
+        return cls(
+            directory,
+            phases=phases,
+            memory=bool(config.get('profile_memory', True)),
+            top_allocations=int(config.get(
+                'profile_top_allocations', DEFAULT_TOP_ALLOCATIONS
+            ))
+        )
+
+    def start(self):
+        """
+        Creates the run directory, starts tracing allocations and, when
+        the profiler is shared, starts the profile of the whole sync
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if SHARED_PROFILER:
+            self.shared = cProfile.Profile()
+            self.shared.enable()
+        LOGGER.info('Profiling %s into %s.' % (
+            ', '.join(sorted(self.phases)), self.directory
+        ))
+
+    def stop(self):
+        """
+        Writes each phase's CPU profile and stops tracing allocations.
+        Profiles that never collected data are skipped. Failures are
+        logged rather than raised, since this runs as a sync finishes.
+        """
+        try:
+            self.write_profiles()
+            LOGGER.info('Wrote profiles for %s pages to %s.' % (
+                self.pages, self.directory
+            ))
+        except Exception as exc:
+            LOGGER.warning('Could not write profiles to %s: %s' % (self.directory, exc))
+        finally:
+            if self.memory and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def write_profiles(self):
+        """
+        Writes a .prof file and a text report per phase
+        """
+        if self.shared is not None:
+            self.shared.disable()
+            profiles = {(ALL_PHASES, None): self.shared}
+        else:
+            with self.lock:
+                profiles = dict(self.profiles)
+
+        by_phase = {}
+        for (phase, _), profile in profiles.items():
+            profile.create_stats()
+            if profile.stats:
+                by_phase.setdefault(phase, []).append(profile)
+
+        for phase, phase_profiles in sorted(by_phase.items()):
+            stats = pstats.Stats(phase_profiles[0])
+            for profile in phase_profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.directory, phase + '.prof'))
+
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats('cumulative').print_stats(REPORT_FUNCTIONS)
+            with open(os.path.join(self.directory, phase + '.txt'), 'w') as report_file:
+                report_file.write(report.getvalue())
+
+    def wrap(self, obj, method_name, phase):
+        """
+        Replaces a method on one object with a version profiled as phase.
+        Generator methods are profiled each time they are resumed.
+        Args:
+            obj (object)
+            method_name (str)
+            phase (str)
+        Returns:
+            obj (object)
+        """
+        if phase not in self.phases:
+            return obj
+
+        method = getattr(obj, method_name)
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def profiled(*args, **kwargs):
+                generator = method(*args, **kwargs)
+                while True:
+                    self.enter(phase)
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.exit(page_done=False)
+                    yield item
+        else:
+            @functools.wraps(method)
+            def profiled(*args, **kwargs):
+                self.enter(phase)
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self.exit()
+
+        setattr(obj, method_name, profiled)
+        return obj
+
+    def enter(self, phase):
+        """
+        Switches the calling thread's profiling to phase
+        Args:
+            phase (str)
+        """
+        stack = self.thread_stack()
+        if stack:
+            self.switch(stack[-1], False)
+        stack.append(phase)
+        self.switch(phase, True)
+
+    def exit(self, page_done=True):
+        """
+        Switches the calling thread's profiling back to the enclosing
+        phase, or records a memory snapshot when a page-level call ends
+        Args:
+            page_done (bool): False when a generator is only pausing
+        """
+        stack = self.thread_stack()
+        phase = stack.pop()
+        self.switch(phase, False)
+        if stack:
+            self.switch(stack[-1], True)
+        elif self.memory and page_done:
+            self.snapshot(phase)
+
+    def thread_stack(self):
+        """
+        Returns:
+            phases running in the calling thread, innermost last (list)
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def switch(self, phase, enable):
+        """
+        Turns the calling thread's profile for phase on or off; the shared
+        profiler runs throughout instead
+        Args:
+            phase (str)
+            enable (bool)
+        """
+        if SHARED_PROFILER:
+            return
+
+        key = (phase, threading.get_ident())
+        profile = self.profiles.get(key)
+        if profile is None:
+            with self.lock:
+                profile = self.profiles.setdefault(key, cProfile.Profile())
+        if enable:
+            profile.enable()
+        else:
+            profile.disable()
+
+    def snapshot(self, phase):
+        """
+        Appends the top allocation sites after a page to the run's
+        memory report
+        Args:
+            phase (str)
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:self.top_allocations]
+        with self.lock:
+            self.pages += 1
+            with open(os.path.join(self.directory, 'memory.txt'), 'a') as memory_file:
+                memory_file.write('page {page} ({phase}, {thread}): current {current:.1f} MB, '
+                                  'peak {peak:.1f} MB\n'.format(
+                                      page=self.pages, phase=phase,
+                                      thread=threading.current_thread().name,
+                                      current=current / 1048576.0,
+                                      peak=peak / 1048576.0))
+                for stat in top:
+                    memory_file.write('    %s\n' % stat)
@@ -0,0 +1,176 @@
+import pendulum
+
+from .shards import SHARDED_URI_SEPARATOR
+
+# State key holding the export windows of streams that have not finished
+IN_FLIGHT_KEY = 'in_flight_exports'
+# Pages written between two saves of a window's offset
+DEFAULT_STATE_CHECKPOINT_PAGES = 10
+
+
+def in_flight_export_uris(state):
+    """
+    Args:
+        state (dict)
+    Returns:
+        export uris behind windows not yet complete, column groups
+        included (set)
+    """
+    export_uris = set()
+    for entry in (state or {}).get(IN_FLIGHT_KEY, {}).values():
+        for window in entry['windows']:
+            if window['export_uri'] and not window['complete']:
+                export_uris.update(window['export_uri'].split(SHARDED_URI_SEPARATOR))
+    return export_uris
+
+
+class ExportProgress:
+    """
+    The export windows of one stream's current run, kept in Singer state so
+    a crashed or pre-empted run can pick up where it stopped. Each window
+    records its bounds, the export and sync uris once the sync succeeds,
+    the offset up to which pages have been fully written, and whether it
+    is complete. The written offset is saved every `checkpoint_pages`
+    pages and when the window completes, so a resumed run may write up to
+    that many pages again. The entry is removed once the stream finishes.
+    """
+
+    def __init__(self, state, stream_name, save, lock,
+                 checkpoint_pages=DEFAULT_STATE_CHECKPOINT_PAGES):
+        """
+        Args:
+            state (dict)
+            stream_name (str)
+            save (callable): writes state after each change
+            lock (threading.RLock): guards state while it is written
+            checkpoint_pages (int): pages written between saves
+        """
+        self.state = state
+        self.stream_name = stream_name
+        self.save = save
+        self.lock = lock
+        self.checkpoint_pages = max(1, int(checkpoint_pages))
+        self.unsaved_pages = 0
+        with self.lock:
+            in_flight = state.setdefault(IN_FLIGHT_KEY, {})
+            self.entry = in_flight.setdefault(stream_name, {
+                'latest': None,
+                'windows': []
+            })
+
+    @property
+    def windows(self):
+        """
+        Returns:
+            saved windows (list of dict)
+        """
+        return self.entry['windows']
+
+    @property
+    def latest(self):
+        """
+        Returns:
+            bookmark covering every record written so far (str)
+        """
+        return self.entry['latest']
+
+    def last_end(self):
+        """
+        Returns:
+            end of the latest saved window (datetime)
+        """
+        return max(pendulum.parse(window['end']) for window in self.windows)
+
+    def add_window(self, start, end):
+        """
+        Args:
+            start (datetime)
+            end (datetime)
+        Returns:
+            window (dict)
+        """
+        window = {
+            'start': start.to_iso8601_string(),
+            'end': end.to_iso8601_string(),
+            'export_uri': None,
+            'sync_uri': None,
+            'offset': 0,
+            'complete': False
+        }
+        with self.lock:
+            self.windows.append(window)
+        return window
+
+    def replace(self, window, windows):
+        """
+        Swaps an oversized window for the windows it was split into
+        Args:
+            window (dict)
+            windows (list of (datetime, datetime))
+        Returns:
+            new windows (list of dict)
+        """
+        with self.lock:
+            self.windows.remove(window)
+            replacements = [self.add_window(start, end) for start, end in windows]
+            self.save()
+        return replacements
+
+    def mark_synced(self, window, sync_uri, export_uri):
+        """
+        Args:
+            window (dict)
+            sync_uri (str)
+            export_uri (str): comma-separated for column-group exports
+        """
+        with self.lock:
+            window['sync_uri'] = sync_uri
+            window['export_uri'] = export_uri
+            self.save()
+
+    def mark_unsynced(self, window):
+        """
+        Forgets a sync that can no longer be read so it is exported again
+        Args:
+            window (dict)
+        """
+        with self.lock:
+            window['sync_uri'] = None
+            window['export_uri'] = None
+            window['offset'] = 0
+
+    def mark_written(self, window, offset, latest=None):
+        """
+        Records a written page, saving state every `checkpoint_pages`
+        pages
+        Args:
+            window (dict)
+            offset (int): offset up to which pages are fully written
+            latest (str): bookmark covering the written records
+        """
+        with self.lock:
+            window['offset'] = offset
+            if latest is not None:
+                self.entry['latest'] = latest
+            self.unsaved_pages += 1
+            if self.unsaved_pages >= self.checkpoint_pages:
+                self.unsaved_pages = 0
+                self.save()
+
+    def mark_complete(self, window):
+        """
+        Args:
+            window (dict)
+        """
+        with self.lock:
+            window['complete'] = True
+            self.unsaved_pages = 0
+            self.save()
+
+    def finish(self):
+        """
+        Drops the stream's progress from state
+        """
+        with self.lock:
+            self.state.get(IN_FLIGHT_KEY, {}).pop(self.stream_name, None)
+            self.save()
@@ -0,0 +1,209 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+import asyncio
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Default number of bulk exports allowed to be syncing at once
+DEFAULT_MAX_CONCURRENT_EXPORTS = 1
+
+
+class ExportScheduler:
+    """
+    Runs bulk export creation and sync polling on a bounded worker pool.
+    Most of a bulk export's lifetime is spent waiting on Eloqua, so letting
+    several exports wait at once (across streams and date windows) removes
+    the serial wall-clock cost of those waits. Records are not read here;
+    the caller fetches and writes pages once an export's future resolves.
+    On a pool shared across sites, at most `max_in_flight` of this
+    scheduler's exports are handed to the pool at a time and the rest wait
+    here, so one site's backlog never queues ahead of every other site's
+    exports.
+    """
+
+    def __init__(self, client, max_in_flight=DEFAULT_MAX_CONCURRENT_EXPORTS,
+                 pool=None):
+        """
+        Args:
+            client (EloquaClient)
+            max_in_flight (int)
+            pool (ThreadPoolExecutor): shared with other schedulers, e.g.
+                across sites; it bounds exports overall and is left
+                running on shutdown
+        """
+        self.client = client
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.shared_pool = pool is not None
+        self.pool = pool or ThreadPoolExecutor(
+            max_workers=self.max_in_flight,
+            thread_name_prefix='eloqua-export'
+        )
+        self.waiting = deque()
+        self.in_flight = 0
+        self.stopped = False
+        self.lock = threading.Lock()
+        if not self.shared_pool:
+            LOGGER.info('Allowing %s concurrent bulk exports.' % self.max_in_flight)
+
+    def submit(self, stream, start_date, end_date, event, expected_rows=None):
+        """
+        Queues a bulk export for the given window
+        Args:
+            stream (cls)
+            start_date (str)
+            end_date (str)
+            event (str)
+            expected_rows (float): planner estimate, for polling
+        Returns:
+            future resolving to the sync status uri (Future)
+        """
+        export_args = (stream, start_date, end_date, event, expected_rows)
+        if not self.shared_pool:
+            return self.pool.submit(self.client.request_bulk_export, *export_args)
+
+        future = Future()
+        with self.lock:
+            self.waiting.append((future, export_args))
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        """
+        Hands waiting exports to the shared pool while fewer than
+        `max_in_flight` are there
+        """
+        while True:
+            with self.lock:
+                if self.stopped or not self.waiting or \
+                        self.in_flight >= self.max_in_flight:
+                    return
+                future, export_args = self.waiting.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.in_flight += 1
+
+            try:
+                pooled = self.pool.submit(self.client.request_bulk_export, *export_args)
+            except Exception as exc:
+                self.finished(future, None, exc)
+                continue
+            pooled.add_done_callback(partial(self.finished, future))
+
+    def finished(self, future, pooled, exc=None):
+        """
+        Passes a pooled export's outcome on and lets the next one in
+        Args:
+            future (Future): returned by `submit`
+            pooled (Future): from the shared pool
+            exc (Exception): raised while submitting to the pool
+        """
+        with self.lock:
+            self.in_flight -= 1
+        if exc is None and pooled.cancelled():
+            exc = RuntimeError('Export was cancelled by the shared pool.')
+        if exc is None:
+            exc = pooled.exception()
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(pooled.result())
+        self.dispatch()
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting exports and optionally waits for queued ones.
+        Exports still waiting for the shared pool are cancelled.
+        Args:
+            wait (bool)
+        """
+        if not self.shared_pool:
+            self.pool.shutdown(wait=wait)
+            return
+
+        with self.lock:
+            self.stopped = True
+            waiting, self.waiting = list(self.waiting), deque()
+        for future, _ in waiting:
+            future.cancel()
+
+
+class AsyncExportScheduler:
+    """
+    Same interface as ExportScheduler, backed by an AsyncEloquaClient
+    running on an event loop in one background thread. Waiting syncs cost
+    a coroutine rather than a thread, and `max_in_flight` is enforced
+    with a semaphore on the loop.
+    """
+
+    def __init__(self, client, max_in_flight=DEFAULT_MAX_CONCURRENT_EXPORTS):
+        """
+        Args:
+            client (AsyncEloquaClient)
+            max_in_flight (int)
+        """
+        self.client = client
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name='eloqua-export-loop', daemon=True
+        )
+        self.thread.start()
+
+        self.semaphore = self.run(self.create_semaphore())
+        self.run(self.client.open())
+        LOGGER.info('Allowing %s concurrent bulk exports on the event loop.' % (
+            self.max_in_flight
+        ))
+
+    async def create_semaphore(self):
+        return asyncio.Semaphore(self.max_in_flight)
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the loop and waits for its result
+        Args:
+            coroutine (coroutine)
+        Returns:
+            result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def limited_export(self, stream, start_date, end_date, event,
+                             expected_rows=None):
+        async with self.semaphore:
+            return await self.client.request_bulk_export(
+                stream, start_date, end_date, event, expected_rows
+            )
+
+    def submit(self, stream, start_date, end_date, event, expected_rows=None):
+        """
+        Queues a bulk export for the given window
+        Args:
+            stream (cls)
+            start_date (str)
+            end_date (str)
+            event (str)
+            expected_rows (float): planner estimate, for polling
+        Returns:
+            future resolving to the sync status uri (Future)
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.limited_export(stream, start_date, end_date, event, expected_rows),
+            self.loop
+        )
+
+    def shutdown(self, wait=True):
+        """
+        Closes the client and stops the loop
+        Args:
+            wait (bool)
+        """
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if wait:
+            self.thread.join()
@@ -0,0 +1,201 @@
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Eloqua's cap on fields in one export definition
+DEFAULT_MAX_EXPORT_FIELDS = 250
+# Marks a sync uri standing for several column-group syncs
+SHARDED_URI_PREFIX = 'shards:'
+# Separates the join key and shard sync uris in a sharded uri
+SHARDED_URI_SEPARATOR = ','
+# Field column groups are joined on for each endpoint, and its statement:
+# the immutable Eloqua id rather than a key that can change
+JOIN_FIELDS = {
+    'contacts': ('contactid', '{{Contact.Id}}'),
+    'activities': ('id', '{{Activity.Id}}')
+}
+
+
+def split_export_body(request_body, max_fields, required_fields):
+    """
+    Splits an export body whose fields exceed max_fields into several
+    bodies with the same name and filter. Every body carries the required
+    fields so its rows can be joined back together.
+    Args:
+        request_body (dict)
+        max_fields (int)
+        required_fields (list)
+    Returns:
+        request bodies (list of dict)
+    """
+    fields = request_body['fields']
+    if len(fields) <= max_fields:
+        return [request_body]
+
+    required = [name for name in dict.fromkeys(required_fields) if name in fields]
+    optional = [name for name in fields if name not in required]
+    group_size = max_fields - len(required)
+    if group_size <= 0:
+        raise ValueError('max_export_fields must leave room beyond the key fields.')
+
+    bodies = []
+    for group_start in range(0, len(optional), group_size):
+        group = required + optional[group_start:group_start + group_size]
+        body = dict(request_body)
+        body['name'] = '{name} ({part})'.format(
+            name=request_body['name'], part=len(bodies) + 1
+        )
+        body['fields'] = dict((name, fields[name]) for name in group)
+        bodies.append(body)
+    return bodies
+
+
+def add_join_field(endpoint_name, request_body):
+    """
+    Makes sure an export body carries the endpoint's join field, reusing
+    a field of the body that already exports it
+    Args:
+        endpoint_name (str)
+        request_body (dict)
+    Returns:
+        request body (dict)
+        join field (str)
+    """
+    join_field, statement = JOIN_FIELDS[endpoint_name]
+    for field_name, field_statement in request_body['fields'].items():
+        if field_statement == statement:
+            return request_body, field_name
+
+    fields = dict(request_body['fields'])
+    fields[join_field] = statement
+    return dict(request_body, fields=fields), join_field
+
+
+def build_sharded_uri(key_field, sync_uris):
+    """
+    Args:
+        key_field (str)
+        sync_uris (list of str)
+    Returns:
+        sharded sync uri (str)
+    """
+    return SHARDED_URI_PREFIX + SHARDED_URI_SEPARATOR.join([key_field] + sync_uris)
+
+
+def parse_sharded_uri(sync_uri):
+    """
+    Args:
+        sync_uri (str)
+    Returns:
+        key field (str) and shard sync uris (list), or None when the uri
+        is a plain sync uri
+    """
+    if not sync_uri.startswith(SHARDED_URI_PREFIX):
+        return None
+
+    parts = sync_uri[len(SHARDED_URI_PREFIX):].split(SHARDED_URI_SEPARATOR)
+    return parts[0], parts[1:]
+
+
+class ShardMismatchException(Exception):
+    pass
+
+
+class ShardMerger:
+    """
+    Joins the pages of a window's column-group exports into full records
+    by the immutable Eloqua id. The groups share a filter, but Eloqua does
+    not promise the same row order in each, so a row whose other parts
+    are not on the same page is carried over to the next page rather than
+    written partly. Pages are merged in offset order, whichever thread
+    fetched them. Rows still unmatched after the last page mean the groups
+    exported different rows, and raise ShardMismatchException.
+    """
+
+    def __init__(self, key_field, group_count):
+        """
+        Args:
+            key_field (str): join field every group exports
+            group_count (int)
+        """
+        self.key_field = key_field
+        self.group_count = group_count
+        self.partial = {}
+        self.next_offset = 0
+        self.error = None
+        self.condition = threading.Condition()
+
+    def merge(self, offset, limit, pages, total_records):
+        """
+        Waits for the pages before this one to be merged, then joins this
+        page of every group
+        Args:
+            offset (int)
+            limit (int)
+            pages (list of list): the page of each group, in group order
+            total_records (int)
+        Returns:
+            records complete in every group (list)
+        """
+        with self.condition:
+            while self.error is None and offset != self.next_offset:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            try:
+                return self.join(pages, offset + limit >= total_records)
+            except Exception as exc:
+                self.error = exc
+                raise
+            finally:
+                self.next_offset = offset + limit
+                self.condition.notify_all()
+
+    def fail(self, exc):
+        """
+        Stops pages waiting on one that could not be fetched
+        Args:
+            exc (Exception)
+        """
+        with self.condition:
+            if self.error is None:
+                self.error = exc
+            self.condition.notify_all()
+
+    def join(self, pages, last):
+        """
+        Args:
+            pages (list of list)
+            last (bool): whether these are the export's last pages
+        Returns:
+            records (list)
+        """
+        key_field = self.key_field
+        partial = self.partial
+        for group, page in enumerate(pages):
+            for record in page:
+                key = record.get(key_field)
+                if key is None:
+                    raise ShardMismatchException(
+                        'Column-group row without %s.' % key_field
+                    )
+                parts = partial.get(key)
+                if parts is None:
+                    parts = partial[key] = ({}, set())
+                parts[0].update(record)
+                parts[1].add(group)
+
+        complete = [
+            key for key, (_, groups) in partial.items()
+            if len(groups) == self.group_count
+        ]
+        records = [partial.pop(key)[0] for key in complete]
+        if last and partial:
+            raise ShardMismatchException(
+                '%s rows were not found in every column group.' % len(partial)
+            )
+        if partial:
+            LOGGER.info('Carrying %s partly fetched rows to the next page.' % len(partial))
+        return records
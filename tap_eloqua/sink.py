@@ -0,0 +1,353 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+
+import pendulum
+import singer
+from singer import metadata as singer_metadata
+from singer import metrics
+from singer.transform import Transformer
+
+from .output import load_json_encoder, DEFAULT_JSON_ENCODER, \
+    DEFAULT_OUTPUT_BUFFER_SIZE, DEFAULT_OUTPUT_BATCH_SIZE
+from .transform import selected_properties
+
+LOGGER = singer.get_logger()
+
+# File in each window directory listing its page files, with their row
+# counts and bookmarks
+MANIFEST_FILE = 'manifest.json'
+# Newline-delimited manifest entries appended per page, folded into the
+# window manifests when the sink is closed
+JOURNAL_FILE = 'manifest.journal'
+# Formats and compressions the sink can write
+NDJSON = 'ndjson'
+PARQUET = 'parquet'
+GZIP = 'gzip'
+NO_COMPRESSION = 'none'
+# gzip level trading file size for CPU
+GZIP_COMPRESSLEVEL = 6
+
+
+def window_partition(window):
+    """
+    Args:
+        window (dict)
+    Returns:
+        directory name for the window (str)
+    """
+    return '{start}_{end}'.format(
+        start=pendulum.parse(window['start']).strftime('%Y%m%dT%H%M%S'),
+        end=pendulum.parse(window['end']).strftime('%Y%m%dT%H%M%S')
+    )
+
+
+class FileSink:
+    """
+    Writes records to files instead of stdout, for loaders that bulk-ingest
+    files in parallel. Each exported page becomes one file under
+    `<directory>/<stream>/<window>/`, written to a temporary name with
+    large buffered writes and renamed once complete. A manifest in each
+    window directory lists the window's finished files with their row
+    counts and the stream's bookmark after them. Each page's entry is
+    appended to a journal before the page's progress is saved, so a
+    resumed run rewrites the same file names and no manifest lists a
+    file that is missing; the journal is folded into the manifests of the
+    windows it touched when the sink is closed, or when a later run finds
+    it left behind. Only the journaled entries are kept in memory, so a
+    long-lived sink never rewrites the manifests of earlier windows.
+    SCHEMA and STATE messages still go to stdout.
+    """
+
+    def __init__(self, directory, file_format=NDJSON, compression=GZIP,
+                 buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE,
+                 batch_size=DEFAULT_OUTPUT_BATCH_SIZE, encoder=DEFAULT_JSON_ENCODER):
+        """
+        Args:
+            directory (str)
+            file_format (str): 'ndjson' or 'parquet'
+            compression (str): 'gzip' or 'none' for ndjson, any codec
+                pyarrow supports for parquet
+            buffer_size (int)
+            batch_size (int)
+            encoder (str)
+        """
+        if file_format not in (NDJSON, PARQUET):
+            raise ValueError('Unknown file_sink_format %s.' % file_format)
+        if file_format == NDJSON and compression not in (GZIP, NO_COMPRESSION):
+            raise ValueError('ndjson files support gzip or no compression.')
+
+        self.directory = directory
+        self.file_format = file_format
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.batch_size = max(1, batch_size)
+        self.encoder_name, self.dumps = load_json_encoder(encoder)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.journal = None
+        # Entries journaled since the manifests were last written
+        self.files = {}
+        self.transformers = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (dict)
+        Returns:
+            sink (FileSink), or None when `file_sink_dir` is not set
+        """
+        directory = config.get('file_sink_dir')
+        if not directory:
+            return None
+
+        return cls(
+            directory,
+            file_format=config.get('file_sink_format', NDJSON),
+            compression=config.get('file_sink_compression', GZIP),
+            buffer_size=int(config.get('output_buffer_size', DEFAULT_OUTPUT_BUFFER_SIZE)),
+            batch_size=int(config.get('output_batch_size', DEFAULT_OUTPUT_BATCH_SIZE)),
+            encoder=config.get('json_encoder', DEFAULT_JSON_ENCODER)
+        )
+
+    def load(self):
+        """
+        Replays and compacts any journal an earlier, interrupted, run did
+        not fold into the manifests. A last journal line cut short by the
+        interruption is skipped; its page was never saved as progress, so
+        it is written again.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    relative_path, entry = json.loads(line)
+                except ValueError:
+                    LOGGER.warning('Skipping an incomplete file sink journal entry.')
+                    continue
+                self.files[relative_path] = entry
+        self.compact()
+
+    def read_manifest(self, partition):
+        """
+        Args:
+            partition (str): window directory relative to the sink directory
+        Returns:
+            manifest entries by file name (dict)
+        """
+        manifest_path = os.path.join(self.directory, partition, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file).get('files', {})
+
+    def save(self):
+        """
+        Adds the journaled entries to the manifests of their windows,
+        replacing each atomically
+        """
+        partitions = {}
+        for relative_path, entry in self.files.items():
+            partition, file_name = os.path.split(relative_path)
+            partitions.setdefault(partition, {})[file_name] = entry
+
+        for partition, entries in partitions.items():
+            files = self.read_manifest(partition)
+            files.update(entries)
+            manifest_path = os.path.join(self.directory, partition, MANIFEST_FILE)
+            tmp_path = manifest_path + '.tmp'
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump({'files': files}, manifest_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+
+    def append_entry(self, relative_path, entry):
+        """
+        Appends a finished file's manifest entry to the journal
+        Args:
+            relative_path (str)
+            entry (dict)
+        """
+        with self.lock:
+            self.files[relative_path] = entry
+            if self.journal is None:
+                self.journal = open(self.journal_path, 'a')
+            self.journal.write(json.dumps([relative_path, entry], sort_keys=True) + '\n')
+            self.journal.flush()
+
+    def compact(self):
+        """
+        Folds the journal into the window manifests and removes it
+        """
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            self.save()
+            self.files = {}
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def close(self):
+        """
+        Writes the manifests once the sync is done with the sink
+        """
+        if self.journal is not None:
+            self.compact()
+
+    def build_path(self, stream_name, window, offset):
+        """
+        Args:
+            stream_name (str)
+            window (dict)
+            offset (int)
+        Returns:
+            path relative to the sink directory (str)
+        """
+        extension = '.' + self.file_format
+        if self.file_format == NDJSON and self.compression == GZIP:
+            extension += '.gz'
+        return os.path.join(
+            stream_name, window_partition(window), '%010d%s' % (offset, extension)
+        )
+
+    def write_page(self, stream, window, offset, records, transform=None,
+                   tracker=None):
+        """
+        Writes one page of records to its own file and adds it to the
+        manifest journal
+        Args:
+            stream (cls)
+            window (dict)
+            offset (int): offset of the page's first record in the export
+            records (iterable)
+            transform (callable): record transform, singer's when not given
+            tracker (BookmarkTracker): read for the bookmark once the page
+                is written
+        Returns:
+            record count (int)
+        """
+        if transform is None:
+            transform = self.get_transform(stream)
+
+        relative_path = self.build_path(stream.stream, window, offset)
+        path = os.path.join(self.directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+
+        started = time.time()
+        with metrics.record_counter(stream.stream) as counter:
+            records = (transform(record) for record in records)
+            if self.file_format == PARQUET:
+                count = self.write_parquet(tmp_path, stream, records)
+            else:
+                count = self.write_ndjson(tmp_path, records)
+            counter.increment(count)
+        os.replace(tmp_path, path)
+
+        entry = {
+            'stream': stream.stream,
+            'window_start': window['start'],
+            'window_end': window['end'],
+            'offset': offset,
+            'format': self.file_format,
+            'compression': self.compression,
+            'rows': count,
+            'bytes': os.path.getsize(path),
+            'bookmark': tracker.value if tracker else None,
+            'written_at': pendulum.now('UTC').to_iso8601_string()
+        }
+        self.append_entry(relative_path, entry)
+        LOGGER.info('Wrote %s %s records to %s in %.1fs.' % (
+            count, stream.stream, relative_path, time.time() - started
+        ))
+        return count
+
+    def write_ndjson(self, path, records):
+        """
+        Args:
+            path (str)
+            records (iterable of dict)
+        Returns:
+            record count (int)
+        """
+        dumps = self.dumps
+        count = 0
+        with io.open(path, 'wb', buffering=self.buffer_size) as raw:
+            target = raw
+            if self.compression == GZIP:
+                target = gzip.GzipFile(
+                    fileobj=raw, mode='wb', compresslevel=GZIP_COMPRESSLEVEL
+                )
+            try:
+                batch = []
+                for record in records:
+                    batch.append(dumps(record))
+                    if len(batch) >= self.batch_size:
+                        target.write(('\n'.join(batch) + '\n').encode('utf-8'))
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    target.write(('\n'.join(batch) + '\n').encode('utf-8'))
+                    count += len(batch)
+            finally:
+                if target is not raw:
+                    target.close()
+        return count
+
+    def write_parquet(self, path, stream, records):
+        """
+        Args:
+            path (str)
+            stream (cls)
+            records (iterable of dict)
+        Returns:
+            record count (int)
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet files require pyarrow: pip install pyarrow')
+
+        keys = selected_properties(stream.schema, getattr(stream, 'metadata', None))
+        columns = dict((key, []) for key in sorted(keys))
+        count = 0
+        for record in records:
+            for key, values in columns.items():
+                values.append(record.get(key))
+            count += 1
+
+        table = pyarrow.table(dict(
+            (key, pyarrow.array(values, type=pyarrow.string()))
+            for key, values in columns.items()
+        ))
+        compression = None if self.compression == NO_COMPRESSION else self.compression
+        pyarrow.parquet.write_table(table, path, compression=compression)
+        return count
+
+    def get_transform(self, stream):
+        """
+        Returns singer's schema transform for the stream, for schemas the
+        string transformer does not cover
+        Args:
+            stream (cls)
+        Returns:
+            transform (callable)
+        """
+        if stream.stream not in self.transformers:
+            transformer = Transformer()
+            schema = stream.schema
+            metadata_map = singer_metadata.to_map(getattr(stream, 'metadata', None) or [])
+            self.transformers[stream.stream] = lambda record: transformer.transform(
+                record, schema, metadata_map
+            )
+        return self.transformers[stream.stream]
@@ -0,0 +1,207 @@
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import singer
+from singer import utils
+
+from .client import EloquaClient, build_pooled_session, DEFAULT_HTTP_POOL_SIZE
+from .executor import EloquaExecutor
+from .output import ThreadOutputRouter, DEFAULT_OUTPUT_BUFFER_SIZE
+
+LOGGER = singer.get_logger()
+
+# Bulk exports syncing at once across every site when not set
+DEFAULT_MAX_SITE_EXPORTS = 10
+
+
+def parse_site_args(site, required_config_keys):
+    """
+    Loads a site's config, catalog and state exactly as the single-site
+    command line would
+    Args:
+        site (dict): `config`, `catalog`, `properties` and `state` paths
+        required_config_keys (list)
+    Returns:
+        args (argparse.Namespace)
+    """
+    argv = ['--config', site['config']]
+    for option in ('catalog', 'properties', 'state'):
+        if site.get(option):
+            argv += ['--' + option, site[option]]
+
+    saved_argv = sys.argv
+    sys.argv = [saved_argv[0]] + argv
+    try:
+        return utils.parse_args(required_config_keys)
+    finally:
+        sys.argv = saved_argv
+
+
+class SiteRunner:
+    """
+    Syncs several Eloqua sites in one process. Sites share one export pool
+    and one HTTP session, so the exports of every site are interleaved and
+    the time each spends waiting on Eloqua overlaps instead of holding a
+    process of its own. Each site's Singer output, including its STATE
+    messages, goes to the site's own file or pipe, and its final state can
+    be saved to a state file.
+    """
+
+    def __init__(self, sites, required_config_keys, max_concurrent_sites=None,
+                 max_concurrent_exports=DEFAULT_MAX_SITE_EXPORTS,
+                 http_pool_size=DEFAULT_HTTP_POOL_SIZE):
+        """
+        Args:
+            sites (list of dict)
+            required_config_keys (list)
+            max_concurrent_sites (int): all sites at once when not set
+            max_concurrent_exports (int): across every site
+            http_pool_size (int): connections kept per Eloqua host
+        """
+        self.sites = sites
+        self.required_config_keys = required_config_keys
+        self.max_concurrent_sites = int(max_concurrent_sites or len(sites) or 1)
+        self.max_concurrent_exports = max(1, int(max_concurrent_exports))
+        # Exports each site may have in the shared pool at once, unless its
+        # config sets `max_concurrent_exports`
+        self.site_export_share = max(1, int(math.ceil(
+            self.max_concurrent_exports / float(min(self.max_concurrent_sites, len(sites) or 1))
+        )))
+        self.session = build_pooled_session(int(http_pool_size))
+        self.router = ThreadOutputRouter()
+        self.failures = {}
+        self.failures_lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, required_config_keys):
+        """
+        Args:
+            path (str): sites file
+            required_config_keys (list)
+        Returns:
+            runner (SiteRunner)
+        """
+        with open(path) as sites_file:
+            sites_config = json.load(sites_file)
+
+        return cls(
+            sites_config['sites'],
+            required_config_keys,
+            max_concurrent_sites=sites_config.get('max_concurrent_sites'),
+            max_concurrent_exports=sites_config.get(
+                'max_concurrent_exports', DEFAULT_MAX_SITE_EXPORTS
+            ),
+            http_pool_size=sites_config.get('http_pool_size', DEFAULT_HTTP_POOL_SIZE)
+        )
+
+    def run(self):
+        """
+        Syncs every site and logs the ones that failed
+        Returns:
+            failed site names (list)
+        """
+        site_args = [
+            parse_site_args(site, self.required_config_keys) for site in self.sites
+        ]
+        export_pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrent_exports,
+            thread_name_prefix='eloqua-export'
+        )
+        site_pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrent_sites,
+            thread_name_prefix='eloqua-site'
+        )
+        LOGGER.info('Syncing %s sites with %s concurrent bulk exports.' % (
+            len(self.sites), self.max_concurrent_exports
+        ))
+
+        self.router.install()
+        try:
+            futures = [
+                site_pool.submit(self.sync_site, site, args, export_pool)
+                for site, args in zip(self.sites, site_args)
+            ]
+            for future in futures:
+                future.result()
+        finally:
+            site_pool.shutdown()
+            export_pool.shutdown()
+            self.router.uninstall()
+
+        for name, exc in self.failures.items():
+            LOGGER.error('Site %s failed: %s' % (name, exc))
+        return list(self.failures)
+
+    def sync_site(self, site, args, export_pool):
+        """
+        Runs one site's sync with its output routed to the site's stream
+        Args:
+            site (dict)
+            args (argparse.Namespace)
+            export_pool (ThreadPoolExecutor)
+        """
+        name = site.get('name') or args.config.get('sitename')
+        buffer_size = int(args.config.get('output_buffer_size', DEFAULT_OUTPUT_BUFFER_SIZE))
+        site_output = io.open(site['output'], 'w', buffering=buffer_size,
+                              encoding='utf-8', newline='\n')
+        try:
+            self.router.bind(site_output)
+            LOGGER.info('Starting sync for site %s.' % name)
+            if 'max_concurrent_exports' not in args.config:
+                args.config = dict(
+                    args.config, max_concurrent_exports=self.site_export_share
+                )
+            client = EloquaClient(args.config, session=self.session)
+            executor = EloquaExecutor(None, args, client)
+            executor.export_pool = export_pool
+            executor.output_router = self.router
+            executor.site_output = site_output
+            executor.sync()
+            site_output.flush()
+            if site.get('state_output'):
+                self.write_site_state(site['state_output'], executor.state)
+            LOGGER.info('Finished sync for site %s.' % name)
+        except Exception as exc:
+            LOGGER.exception('Sync for site %s failed.' % name)
+            with self.failures_lock:
+                self.failures[name] = exc
+        finally:
+            self.router.unbind()
+            site_output.close()
+
+    def write_site_state(self, path, state):
+        """
+        Saves a site's final state for its next run, replacing the file
+        atomically so a crash never leaves it half written
+        Args:
+            path (str)
+            state (dict)
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, path)
+
+
+def main():
+    """
+    Entry point syncing every site listed in a sites file
+    """
+    from . import REQUIRED_CONFIG_KEYS
+
+    parser = argparse.ArgumentParser(
+        description='Sync several Eloqua sites in one process.'
+    )
+    parser.add_argument('-S', '--sites', help='Sites file', required=True)
+    args = parser.parse_args()
+
+    failed = SiteRunner.from_file(args.sites, REQUIRED_CONFIG_KEYS).run()
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,325 @@
+import os
+import pickle
+import tempfile
+import threading
+
+from collections import deque
+
+import singer
+
+from .output import iter_batches
+
+LOGGER = singer.get_logger()
+
+# Pages' worth of records held in memory before later records are
+# spilled to disk
+DEFAULT_SPILL_MEMORY_PAGES = 4
+# Spilled bytes waiting to be written before downloads pause
+DEFAULT_SPILL_MAX_BYTES = 8 * 1024 ** 3
+# Records read from a page and held, or spilled, as one entry
+DEFAULT_SPILL_CHUNK_RECORDS = 5000
+# Queue entry that closes each page
+PAGE_END = object()
+
+
+class SpillBuffer:
+    """
+    Decouples page downloads from a slow Singer target. A background
+    thread reads an export's pages as fast as Eloqua serves them, in
+    chunks of records, keeping the first few pages' worth in memory and
+    spilling the rest to an append-only temporary file, while the caller
+    takes pages back in their original order and writes them at whatever
+    pace stdout allows. A page is never held whole, so a streamed page
+    stays bounded by the chunk size. The export is read to the end within
+    Eloqua's data retention even when writing lags far behind. Downloads
+    only pause when `max_bytes` are waiting on disk.
+    """
+
+    def __init__(self, directory=None, memory_records=None,
+                 max_bytes=DEFAULT_SPILL_MAX_BYTES,
+                 chunk_records=DEFAULT_SPILL_CHUNK_RECORDS):
+        """
+        Args:
+            directory (str): for the spill files, the system temp
+                directory when not given
+            memory_records (int): records held in memory, one chunk
+                when not given
+            max_bytes (int)
+            chunk_records (int)
+        """
+        self.directory = directory
+        self.chunk_records = max(1, int(chunk_records))
+        self.memory_records = max(self.chunk_records, int(memory_records or 0))
+        self.max_bytes = max(1, int(max_bytes))
+
+    @classmethod
+    def from_config(cls, config, page_size):
+        """
+        Args:
+            config (dict)
+            page_size (int): records in a full export page
+        Returns:
+            buffer (SpillBuffer), or None when `spill_pages` is not set
+        """
+        if not config.get('spill_pages'):
+            return None
+
+        memory_pages = int(config.get('spill_memory_pages', DEFAULT_SPILL_MEMORY_PAGES))
+        return cls(
+            directory=config.get('spill_dir'),
+            memory_records=max(1, memory_pages) * page_size,
+            max_bytes=int(config.get('spill_max_bytes', DEFAULT_SPILL_MAX_BYTES))
+        )
+
+    def drain(self, pages):
+        """
+        Args:
+            pages (iterable): pages of records, in order
+        Returns:
+            pages of records, in the same order (generator of generators)
+        """
+        queue = SpillQueue(
+            self.directory, self.memory_records, self.max_bytes, self.chunk_records
+        )
+        return queue.drain(pages)
+
+
+class SpillQueue:
+    """
+    FIFO of one export's record chunks, each held either in memory or as a
+    pickled range of the spill file, with a PAGE_END entry after each
+    page. The file is emptied whenever no spilled chunk is waiting, so it
+    only grows while the writer is behind. The lock only guards the queue
+    and file offsets: chunks are written and read back outside it, the
+    producer into a range it reserved, so neither side waits on the
+    other's disk I/O.
+    """
+
+    def __init__(self, directory, memory_records, max_bytes, chunk_records):
+        """
+        Args:
+            directory (str)
+            memory_records (int)
+            max_bytes (int)
+            chunk_records (int)
+        """
+        self.directory = directory
+        self.memory_records = memory_records
+        self.max_bytes = max_bytes
+        self.chunk_records = chunk_records
+        self.entries = deque()
+        self.in_memory = 0
+        self.spilled_bytes = 0
+        self.spilled_chunks = 0
+        self.waiting_chunks = 0
+        self.write_position = 0
+        self.writing = False
+        self.truncating = False
+        self.spill_file = None
+        self.done = False
+        self.stopped = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def drain(self, pages):
+        """
+        Downloads pages on a background thread and yields them in order,
+        each as a generator of its records. Whatever the caller leaves
+        unread of a page is skipped before the next one. An error while
+        downloading is raised here after the records before it have been
+        yielded.
+        Args:
+            pages (iterable)
+        Returns:
+            pages of records (generator)
+        """
+        producer = threading.Thread(
+            target=self.fill, args=(pages,), name='eloqua-spill', daemon=True
+        )
+        producer.start()
+        try:
+            while self.next_page():
+                page = self.read_page()
+                yield page
+                for _ in page:
+                    pass
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+                while self.writing:
+                    self.condition.wait()
+                if self.spill_file:
+                    self.spill_file.close()
+                    self.spill_file = None
+
+    def next_page(self):
+        """
+        Waits for the next page to start
+        Returns:
+            whether there is one (bool)
+        """
+        with self.condition:
+            while not self.entries and not self.done:
+                self.condition.wait()
+            if self.entries:
+                return True
+            if self.error:
+                raise self.error
+            return False
+
+    def read_page(self):
+        """
+        Returns:
+            records of the page at the head of the queue (generator)
+        """
+        while True:
+            records = self.take()
+            if records is PAGE_END:
+                return
+            for record in records:
+                yield record
+
+    def take(self):
+        """
+        Takes the next chunk off the queue, reading it back from disk when
+        it was spilled
+        Returns:
+            records (list), or PAGE_END
+        """
+        with self.condition:
+            while not self.entries and not self.done:
+                self.condition.wait()
+            if not self.entries:
+                raise self.error or ValueError('Spilled page ended early.')
+            position, payload = self.entries.popleft()
+            if position is None:
+                if payload is not PAGE_END:
+                    self.in_memory -= len(payload)
+                self.condition.notify_all()
+                return payload
+        return pickle.loads(self.read(position, payload))
+
+    def fill(self, pages):
+        """
+        Reads every page into the queue a chunk at a time, spilling to
+        disk once the memory records are taken
+        Args:
+            pages (iterable)
+        """
+        try:
+            for page in pages:
+                for records in iter_batches(page, self.chunk_records):
+                    if not self.put(records):
+                        return
+                with self.condition:
+                    if self.stopped:
+                        return
+                    self.entries.append((None, PAGE_END))
+                    self.condition.notify_all()
+        except Exception as exc:
+            self.error = exc
+        finally:
+            if hasattr(pages, 'close'):
+                pages.close()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+            if self.spilled_chunks:
+                LOGGER.info('Spilled %s chunks of records to disk while the writer caught up.' % (
+                    self.spilled_chunks
+                ))
+
+    def put(self, records):
+        """
+        Queues a chunk in memory, or spills it
+        Args:
+            records (list)
+        Returns:
+            False once the consumer has stopped (bool)
+        """
+        with self.condition:
+            while not self.stopped and self.spilled_bytes >= self.max_bytes:
+                self.condition.wait()
+            if self.stopped:
+                return False
+            if self.in_memory < self.memory_records:
+                self.entries.append((None, records))
+                self.in_memory += len(records)
+                self.condition.notify_all()
+                return True
+
+        data = pickle.dumps(records, pickle.HIGHEST_PROTOCOL)
+        position = self.write(data)
+        if position is None:
+            return False
+        with self.condition:
+            self.entries.append((position, len(data)))
+            self.condition.notify_all()
+        return True
+
+    def write(self, data):
+        """
+        Reserves a range at the end of the spill file and writes a pickled
+        chunk into it
+        Args:
+            data (bytes)
+        Returns:
+            file position of the chunk (int), or None once the consumer
+            has stopped
+        """
+        with self.condition:
+            while self.truncating and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return None
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(
+                    prefix='tap-eloqua-spill-', dir=self.directory
+                )
+            position = self.write_position
+            self.write_position += len(data)
+            self.spilled_bytes += len(data)
+            self.spilled_chunks += 1
+            self.waiting_chunks += 1
+            self.writing = True
+            fileno = self.spill_file.fileno()
+
+        try:
+            os.pwrite(fileno, data, position)
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+        return position
+
+    def read(self, position, length):
+        """
+        Reads a spilled chunk back, emptying the file when it was the last
+        one waiting. Only the consumer reads, and a chunk's range is not
+        reused until it has been read, so no lock is held for the read.
+        Args:
+            position (int)
+            length (int)
+        Returns:
+            pickled records (bytes)
+        """
+        data = os.pread(self.spill_file.fileno(), length, position)
+        with self.condition:
+            self.spilled_bytes -= length
+            self.waiting_chunks -= 1
+            # A chunk still being written counts as waiting, so the file is
+            # only emptied while nothing is reserved in it
+            truncate = not self.waiting_chunks
+            if truncate:
+                self.truncating = True
+                self.write_position = 0
+            self.condition.notify_all()
+        if truncate:
+            try:
+                self.spill_file.truncate(0)
+            finally:
+                with self.condition:
+                    self.truncating = False
+                    self.condition.notify_all()
+        return data
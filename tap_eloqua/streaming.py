@@ -0,0 +1,142 @@
+import codecs
+import json
+
+# Characters JSON allows between tokens
+WHITESPACE = ' \t\n\r'
+
+
+class JSONItemStream:
+    """
+    Incrementally parses a JSON object read from a stream of byte chunks,
+    yielding the elements of one array member (`items` by default) as they
+    are decoded. Other top-level members are collected into `fields` as
+    they are passed, so values such as `hasMore` are only complete once
+    iteration has finished. Only the record being decoded and the unread
+    part of the current chunk are held in memory.
+    """
+
+    def __init__(self, chunks, items_key='items'):
+        """
+        Args:
+            chunks (iterable of bytes)
+            items_key (str)
+        """
+        self.chunks = iter(chunks)
+        self.items_key = items_key
+        self.fields = {}
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == self.items_key:
+                yield from self.items()
+            else:
+                self.fields[key] = self.value()
+
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError('Expected , or } at top level of export page.')
+
+    def items(self):
+        """
+        Yields the decoded elements of the array at the current position
+        Returns:
+            records (generator)
+        """
+        if self.peek() == 'n':
+            self.value()
+            return
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError('Expected , or ] in export page items.')
+
+    def fill(self):
+        """
+        Appends the next chunk to the unread part of the buffer
+        Returns:
+            whether more data was read (bool)
+        """
+        if self.exhausted:
+            return False
+
+        try:
+            text = self.text_decoder.decode(next(self.chunks))
+        except StopIteration:
+            text = self.text_decoder.decode(b'', final=True)
+            self.exhausted = True
+
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return not self.exhausted
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming it
+        Returns:
+            character (str)
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill() and self.pos >= len(self.buffer):
+                raise ValueError('Export page ended unexpectedly.')
+
+    def expect(self, character):
+        """
+        Consumes the next character, which must match
+        Args:
+            character (str)
+        """
+        if self.peek() != character:
+            raise ValueError('Expected %s in export page.' % character)
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the JSON value at the current position, reading more chunks
+        until it is complete. A value that runs to the end of the buffer is
+        only accepted once the stream is exhausted, since a number may
+        continue in the next chunk.
+        Returns:
+            value (object)
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.exhausted:
+                    raise
+            else:
+                if end < len(self.buffer) or self.exhausted:
+                    self.pos = end
+                    return value
+            self.fill()
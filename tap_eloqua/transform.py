@@ -0,0 +1,142 @@
+import json
+import sys
+
+import singer
+from singer import metadata as singer_metadata
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# The only property type Eloqua streams generate
+STRING_TYPE = {'null', 'string'}
+
+
+def selected_properties(schema, stream_metadata=None):
+    """
+    Schema properties singer's Transformer would keep: automatic ones,
+    and those neither deselected nor marked unsupported in metadata
+    Args:
+        schema (dict)
+        stream_metadata (list): catalog metadata entries
+    Returns:
+        keys (frozenset)
+    """
+    metadata_map = singer_metadata.to_map(stream_metadata or [])
+    keys = set()
+    for key in schema['properties']:
+        field_metadata = metadata_map.get(('properties', key), {})
+        inclusion = field_metadata.get('inclusion')
+        if inclusion == 'unsupported':
+            continue
+        if inclusion != 'automatic' and field_metadata.get('selected') is False:
+            continue
+        keys.add(key)
+    return frozenset(keys)
+
+
+class StringRecordTransformer:
+    """
+    Fast path for schemas whose properties are all `["null", "string"]`,
+    which is every schema the bulk API streams generate. The selected keys
+    are resolved once per stream, and each record is projected, coerced and
+    serialized in a single pass with the same records as singer's
+    Transformer followed by `write_record`: record keys keep their order,
+    keys outside the schema or deselected in metadata are dropped, and
+    non-string values are converted with `str`. With the default `json`
+    encoder the lines are also byte for byte singer's; orjson and ujson
+    write compact JSON with raw UTF-8 instead.
+    """
+
+    def __init__(self, stream_name, schema, stream_metadata=None, output=None):
+        """
+        Args:
+            stream_name (str)
+            schema (dict)
+            stream_metadata (list): catalog metadata entries
+            output (BufferedOutput): batches writes when given
+        """
+        self.stream_name = stream_name
+        self.output = output
+        self.dumps = output.dumps if output else json.dumps
+        self.keys = selected_properties(schema, stream_metadata)
+        self.message_prefix = '{"type": "RECORD", "stream": %s, "record": ' % (
+            json.dumps(stream_name)
+        )
+
+    @staticmethod
+    def supports(schema):
+        """
+        Args:
+            schema (dict)
+        Returns:
+            whether every property is a nullable string (bool)
+        """
+        properties = (schema or {}).get('properties')
+        if not properties:
+            return False
+
+        for property_schema in properties.values():
+            property_type = property_schema.get('type')
+            if isinstance(property_type, str):
+                property_type = [property_type]
+            if set(property_type or []) != STRING_TYPE or len(property_schema) > 1:
+                return False
+        return True
+
+    def transform(self, record):
+        """
+        Args:
+            record (dict)
+        Returns:
+            transformed record (dict)
+        """
+        keys = self.keys
+        return {
+            key: value if value is None or value.__class__ is str else str(value)
+            for key, value in record.items() if key in keys
+        }
+
+    def encode(self, records):
+        """
+        Args:
+            records (iterable)
+        Returns:
+            RECORD message lines (generator)
+        """
+        prefix = self.message_prefix
+        transform = self.transform
+        dumps = self.dumps
+        for record in records:
+            yield prefix + dumps(transform(record)) + '}\n'
+
+    def write(self, records):
+        """
+        Transforms and writes RECORD messages for a page of records
+        Args:
+            records (iterable)
+        Returns:
+            record count (int)
+        """
+        with metrics.record_counter(self.stream_name) as counter:
+            count = self.write_lines(self.encode(records))
+            counter.increment(count)
+            return count
+
+    def write_lines(self, lines):
+        """
+        Writes encoded RECORD messages, without counting them in metrics
+        Args:
+            lines (iterable of str)
+        Returns:
+            messages written (int)
+        """
+        if self.output:
+            return self.output.write_lines(lines)
+
+        count = 0
+        write = sys.stdout.write
+        for line in lines:
+            write(line)
+            count += 1
+        sys.stdout.flush()
+        return count
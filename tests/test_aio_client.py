@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import threading
+import types
+import unittest
+
+from unittest import mock
+
+from tap_eloqua import aio_client
+from tap_eloqua.aio_client import AsyncEloquaClient
+from tap_eloqua.client import FailedSyncException
+from tap_eloqua.governor import AdaptiveLimit
+from tap_eloqua.instrumentation import REQUESTS
+from tap_eloqua.polling import PollingPolicy
+
+# Stands in for the parts of aiohttp the client touches outside the session
+FAKE_AIOHTTP = types.SimpleNamespace(ClientConnectionError=ConnectionError)
+
+CONFIG = {'sitename': 'site', 'username': 'user', 'password': 'secret'}
+FIELDS = ['c_emailaddress', 'c_datemodified', 'c_a', 'c_b', 'c_c', 'c_d']
+
+
+class StubResponse:
+
+    def __init__(self, payload, status=200):
+        self.payload = payload
+        self.status = status
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self, content_type=None):
+        return self.payload
+
+
+class StubSession:
+    """
+    Answers the bulk api calls the async client makes. With `fail_first`
+    the first sync fails without logs and the others stay active;
+    otherwise every sync succeeds.
+    """
+
+    def __init__(self, fail_first=False):
+        self.fail_first = fail_first
+        self.failing_sync = None
+        self.ids = itertools.count(1)
+        self.calls = []
+
+    def request(self, method, url, params=None, json=None):
+        path = '/' + url.split('/api/bulk/2.0', 1)[-1].lstrip('/')
+        self.calls.append((method, path))
+        if method == 'GET' and path.endswith('/fields'):
+            return StubResponse({'items': [
+                {'internalName': name.upper(),
+                 'statement': '{{Contact.Field(%s)}}' % name.upper()}
+                for name in FIELDS
+            ]})
+        if method == 'POST' and path.endswith('/exports'):
+            return StubResponse({'uri': '/contacts/exports/%s' % next(self.ids)})
+        if method == 'PUT':
+            return StubResponse({'uri': path})
+        if method == 'POST' and path == '/syncs':
+            sync_uri = '/syncs/%s' % next(self.ids)
+            if self.fail_first and self.failing_sync is None:
+                self.failing_sync = sync_uri
+            return StubResponse({'uri': sync_uri})
+        if method == 'GET' and path.endswith('/logs'):
+            return StubResponse({'items': []})
+        if method == 'GET' and path.startswith('/syncs/'):
+            if path == self.failing_sync:
+                return StubResponse({'status': 'error'})
+            return StubResponse({'status': 'active' if self.fail_first else 'success'})
+        raise AssertionError('Unexpected request %s %s' % (method, path))
+
+    def count(self, method, suffix):
+        return len([call for call in self.calls
+                    if call[0] == method and call[1].endswith(suffix)])
+
+
+class FakeStream:
+    stream = 'contacts'
+    meta_fields = {
+        'key_properties': ['c_emailaddress'],
+        'replication_key': 'c_datemodified'
+    }
+    schema = {'properties': dict(
+        (name, {'type': ['null', 'string']}) for name in FIELDS
+    )}
+
+
+def export_body(start):
+    return {
+        'name': 'Eloqua contacts stream: %s' % start,
+        'fields': {'c_emailaddress': '{{Contact.Field(C_EMAILADDRESS)}}'},
+        'filter': "'{{Contact.Field(C_DATEMODIFIED)}}'>='%s'" % start
+    }
+
+
+class AsyncEloquaClientTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(aio_client, 'aiohttp', FAKE_AIOHTTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build_client(self, session, **config):
+        client = AsyncEloquaClient(
+            dict(CONFIG, **config), base_url='https://site',
+            polling_policy=PollingPolicy(first_delay=0.001, max_delay=0.001, jitter=0)
+        )
+        client.session = session
+        return client
+
+    def test_definitions_are_reused_through_the_registry(self):
+        session = StubSession()
+        client = self.build_client(session)
+
+        async def sync_two_windows():
+            first = await client.sync_export(
+                'contacts', 'contacts', export_body('2019-08-01 00:00:00'),
+                '2019-08-01 00:00:00'
+            )
+            client.release_export(first)
+            second = await client.sync_export(
+                'contacts', 'contacts', export_body('2019-08-02 00:00:00'),
+                '2019-08-02 00:00:00'
+            )
+            return first, second
+
+        first, second = asyncio.run(sync_two_windows())
+
+        self.assertEqual(session.count('POST', '/exports'), 1)
+        self.assertEqual(session.count('PUT', '/contacts/exports/1'), 1)
+        self.assertNotIn(first, client.sync_tags)
+        self.assertEqual(client.sync_tags[second], ('contacts', '2019-08-02 00:00:00'))
+        self.assertEqual(client.metrics.counters[(REQUESTS, 'contacts')], 6)
+
+    def test_failed_column_group_cancels_the_others(self):
+        session = StubSession(fail_first=True)
+        client = self.build_client(session, max_export_fields=5)
+
+        with self.assertRaises(FailedSyncException):
+            asyncio.run(asyncio.wait_for(client.request_bulk_export(
+                FakeStream, '2019-08-01 00:00:00', '2019-08-02 00:00:00', None
+            ), 5))
+
+        # Both definitions went back to the registry for reuse
+        registry = client.export_registry
+        idle = sum(registry.idle.values(), [])
+        self.assertEqual(len(idle), 2)
+        self.assertEqual(sorted(idle), sorted(registry.created))
+        self.assertEqual(registry.keys, {})
+        self.assertEqual(client.sync_exports, {})
+
+    def test_holding_waits_for_a_slot_freed_by_another_thread(self):
+        client = self.build_client(StubSession())
+        limit = AdaptiveLimit('exports', 1)
+        self.assertTrue(limit.try_acquire())
+        threading.Timer(0.05, limit.release).start()
+
+        async def hold():
+            async with client.holding(limit):
+                return limit.in_use
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(hold(), 2)), 1)
+        self.assertEqual(limit.in_use, 0)
+        self.assertEqual(limit.waiters, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
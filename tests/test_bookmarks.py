@@ -0,0 +1,51 @@
+import unittest
+
+from tap_eloqua.bookmarks import BookmarkTracker, normalize_datetime_string
+
+
+class NormalizeDatetimeStringTest(unittest.TestCase):
+
+    def test_eloqua_timestamps_are_sliced(self):
+        self.assertEqual(normalize_datetime_string('2019-08-06 04:29:15.440'),
+                         '2019-08-06 04:29:15')
+        self.assertEqual(normalize_datetime_string('2019-08-06T04:29:15Z'),
+                         '2019-08-06 04:29:15')
+
+    def test_other_formats_are_parsed(self):
+        self.assertEqual(normalize_datetime_string('2019-08-06'), '2019-08-06 00:00:00')
+
+
+class BookmarkTrackerTest(unittest.TestCase):
+
+    def test_records_pass_through_and_the_maximum_is_kept(self):
+        tracker = BookmarkTracker('c_datemodified', '2019-01-01 00:00:00')
+        records = [
+            {'id': '1', 'c_datemodified': '2019-08-06 04:29:15.440'},
+            {'id': '2', 'c_datemodified': None},
+            {'id': '3', 'c_datemodified': '2019-08-07 10:00:00.000'},
+            {'id': '4'},
+            {'id': '5', 'c_datemodified': '2019-08-06 23:59:59.999'}
+        ]
+        self.assertEqual(list(tracker.observe(records)), records)
+        self.assertEqual(tracker.value, '2019-08-07 10:00:00')
+
+    def test_bookmark_never_moves_back(self):
+        tracker = BookmarkTracker('c_datemodified', '2019-09-01 00:00:00')
+        list(tracker.observe([{'c_datemodified': '2019-08-06 04:29:15.440'}]))
+        self.assertEqual(tracker.value, '2019-09-01 00:00:00')
+
+    def test_value_is_updated_once_the_page_is_read(self):
+        tracker = BookmarkTracker('c_datemodified')
+        records = tracker.observe([{'c_datemodified': '2019-08-06 04:29:15.440'}])
+        self.assertIsNone(tracker.value)
+        list(records)
+        self.assertEqual(tracker.value, '2019-08-06 04:29:15')
+
+    def test_empty_page(self):
+        tracker = BookmarkTracker('c_datemodified')
+        self.assertEqual(list(tracker.observe([])), [])
+        self.assertIsNone(tracker.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from tap_eloqua.cache import FieldCache
+
+FIELDS = [{'internalName': 'C_EMAILADDRESS'}, {'internalName': 'C_DATEMODIFIED'}]
+
+
+class CountingFetch:
+
+    def __init__(self, items=FIELDS, delay=0):
+        self.items = items
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.items
+
+
+class FieldCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'fields.json')
+
+    def test_keys_are_per_site_and_endpoint(self):
+        self.assertEqual(FieldCache.build_key('site', 'contacts'), 'site:contacts')
+        cache = FieldCache()
+        fetch = CountingFetch()
+        cache.get_or_fetch(FieldCache.build_key('site', 'contacts'), fetch)
+        cache.get_or_fetch(FieldCache.build_key('site', 'activities'), fetch)
+        cache.get_or_fetch(FieldCache.build_key('other', 'contacts'), fetch)
+        cache.get_or_fetch(FieldCache.build_key('site', 'contacts'), fetch)
+        self.assertEqual(fetch.calls, 3)
+
+    def test_stale_entries_are_fetched_again(self):
+        cache = FieldCache(ttl=60)
+        fetch = CountingFetch()
+        with mock.patch('tap_eloqua.cache.time.time', return_value=1000.0):
+            cache.get_or_fetch('site:contacts', fetch)
+        with mock.patch('tap_eloqua.cache.time.time', return_value=1059.0):
+            cache.get_or_fetch('site:contacts', fetch)
+            self.assertEqual(fetch.calls, 1)
+        with mock.patch('tap_eloqua.cache.time.time', return_value=1060.0):
+            self.assertIsNone(cache.get_fresh('site:contacts'))
+            cache.get_or_fetch('site:contacts', fetch)
+            self.assertEqual(fetch.calls, 2)
+
+    def test_concurrent_callers_share_one_fetch(self):
+        cache = FieldCache()
+        fetch = CountingFetch(delay=0.05)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                cache.get_or_fetch('site:contacts', fetch)
+            ))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results, [FIELDS] * 4)
+
+    def test_fresh_entries_are_reloaded_from_disk(self):
+        cache = FieldCache(path=self.path)
+        cache.get_or_fetch('site:contacts', CountingFetch())
+        with open(self.path) as cache_file:
+            entries = json.load(cache_file)
+        entries['site:activities'] = {'fetched_at': time.time() - 7200, 'items': []}
+        with open(self.path, 'w') as cache_file:
+            json.dump(entries, cache_file)
+
+        reloaded = FieldCache(path=self.path)
+        fetch = CountingFetch()
+        self.assertEqual(reloaded.get_or_fetch('site:contacts', fetch), FIELDS)
+        self.assertEqual(fetch.calls, 0)
+        self.assertEqual(list(reloaded.entries), ['site:contacts'])
+
+    def test_unreadable_cache_file_is_ignored(self):
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{"site:contacts": ')
+        self.assertEqual(FieldCache(path=self.path).entries, {})
+        self.assertEqual(FieldCache(path=self.path + '.missing').entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tap_eloqua import daemon
+from tap_eloqua.client import EloquaClient
+from tap_eloqua.daemon import SyncDaemon
+from tap_eloqua.shards import build_sharded_uri
+
+CONFIG = {'sitename': 'site', 'username': 'user', 'password': 'secret'}
+
+
+class FakeExecutor:
+    """
+    Writes one line per cycle and ends with a state naming the cycle
+    """
+    cycles = []
+
+    def __init__(self, client_args, args, client):
+        self.args = args
+        self.state = dict(args.state)
+
+    def sync(self):
+        FakeExecutor.cycles.append(self.run_full_table_streams)
+        self.site_output.write('cycle %s\n' % len(FakeExecutor.cycles))
+        self.state['cycles'] = len(FakeExecutor.cycles)
+
+
+class FailingExecutor(FakeExecutor):
+
+    def sync(self):
+        raise RuntimeError('sync failed')
+
+
+class SyncDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        FakeExecutor.cycles = []
+
+    def build_daemon(self, output_name, keep_outputs=2, **config):
+        args = argparse.Namespace(config=dict(CONFIG, **config), state=None,
+                                  properties=None, catalog=None)
+        return SyncDaemon(
+            args, os.path.join(self.tmp_dir, output_name),
+            state_path=os.path.join(self.tmp_dir, 'state.json'),
+            interval=0, keep_outputs=keep_outputs
+        )
+
+    def run_cycles(self, sync_daemon, count, executor=FakeExecutor):
+        with mock.patch.object(daemon, 'EloquaExecutor', executor):
+            for _ in range(count):
+                sync_daemon.run_cycle(None)
+
+    def test_full_table_streams_run_once_by_default(self):
+        sync_daemon = self.build_daemon('out.jsonl')
+        self.run_cycles(sync_daemon, 3)
+        self.assertEqual(FakeExecutor.cycles, [True, False, False])
+
+    def test_full_table_streams_run_every_configured_cycles(self):
+        sync_daemon = self.build_daemon('out.jsonl', daemon_full_table_cycles=2)
+        self.run_cycles(sync_daemon, 5)
+        self.assertEqual(FakeExecutor.cycles, [True, False, True, False, True])
+
+    def test_full_table_streams_retry_after_a_failed_cycle(self):
+        sync_daemon = self.build_daemon('out.jsonl')
+        self.run_cycles(sync_daemon, 1, FailingExecutor)
+        self.run_cycles(sync_daemon, 2)
+        self.assertEqual(FakeExecutor.cycles, [True, False])
+
+    def test_fixed_output_path_is_appended_to(self):
+        sync_daemon = self.build_daemon('out.jsonl')
+        self.assertFalse(sync_daemon.names_each_cycle())
+        self.run_cycles(sync_daemon, 3)
+
+        with open(os.path.join(self.tmp_dir, 'out.jsonl')) as output:
+            self.assertEqual(output.read(), 'cycle 1\ncycle 2\ncycle 3\n')
+
+    def test_cycle_outputs_are_rotated(self):
+        sync_daemon = self.build_daemon('out-{cycle}.jsonl')
+        self.assertTrue(sync_daemon.names_each_cycle())
+        self.run_cycles(sync_daemon, 4)
+
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), [
+            'out-3.jsonl', 'out-4.jsonl', 'state.json'
+        ])
+
+    def test_state_is_saved_after_successful_cycles_only(self):
+        sync_daemon = self.build_daemon('out.jsonl')
+        self.run_cycles(sync_daemon, 2)
+        self.run_cycles(sync_daemon, 1, FailingExecutor)
+
+        self.assertEqual(sync_daemon.state, {'cycles': 2})
+        with open(sync_daemon.state_path) as state_file:
+            self.assertEqual(json.load(state_file), {'cycles': 2})
+        self.assertFalse(os.path.exists(sync_daemon.state_path + '.tmp'))
+
+
+class SyncTagTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(EloquaClient, 'build_base_url',
+                                    return_value='https://site')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = EloquaClient(dict(CONFIG))
+
+    def test_released_syncs_drop_their_tags(self):
+        self.client.tag_sync('/syncs/1', 'contacts', '2019-08-01 00:00:00')
+        self.client.release_export('/syncs/1')
+        self.assertEqual(self.client.sync_tags, {})
+
+    def test_released_sharded_syncs_drop_their_shard_tags(self):
+        sharded_uri = build_sharded_uri('c_id', ['/syncs/1', '/syncs/2'])
+        for sync_uri in ['/syncs/1', '/syncs/2', sharded_uri]:
+            self.client.tag_sync(sync_uri, 'contacts')
+        self.client.release_export(sharded_uri)
+        self.assertEqual(self.client.sync_tags, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
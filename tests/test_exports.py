@@ -0,0 +1,98 @@
+import unittest
+
+from tap_eloqua.exports import ExportRegistry
+
+
+class FakeDefinitionClient:
+    """
+    Records the export definition calls made by the registry
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.updated = []
+        self.deleted = []
+
+    def create_export_definition(self, endpoint_name, request_body):
+        self.created += 1
+        return '/%s/exports/%s' % (endpoint_name, self.created)
+
+    def update_export_definition(self, export_uri, request_body):
+        self.updated.append(export_uri)
+
+    def delete_export_definition(self, export_uri):
+        self.deleted.append(export_uri)
+
+
+def export_body(start, end, fields=None):
+    return {
+        'name': 'tap-eloqua',
+        'fields': fields or {'email': '{{Contact.Field(C_EmailAddress)}}'},
+        'filter': "'{{Contact.Field(C_DateModified)}}' >= '%s' AND "
+                  "'{{Contact.Field(C_DateModified)}}' < '%s'" % (start, end)
+    }
+
+
+class ExportRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeDefinitionClient()
+        self.registry = ExportRegistry(self.client)
+
+    def test_released_definition_is_reused_for_the_same_shape(self):
+        first = self.registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        self.registry.release(first)
+        second = self.registry.acquire('contacts', export_body('2019-02-01', '2019-03-01'))
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.client.created, 1)
+        self.assertEqual(self.client.updated, [first])
+
+    def test_checked_out_definition_is_not_shared(self):
+        first = self.registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        second = self.registry.acquire('contacts', export_body('2019-02-01', '2019-03-01'))
+        self.assertNotEqual(first, second)
+
+    def test_other_shapes_get_their_own_definition(self):
+        first = self.registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        self.registry.release(first)
+        second = self.registry.acquire('contacts', export_body(
+            '2019-02-01', '2019-03-01', {'id': '{{Contact.Id}}'}
+        ))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.client.updated, [])
+
+    def test_no_reuse(self):
+        registry = ExportRegistry(self.client, reuse=False)
+        first = registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        registry.release(first)
+        second = registry.acquire('contacts', export_body('2019-02-01', '2019-03-01'))
+        self.assertNotEqual(first, second)
+
+    def test_cleanup_deletes_created_definitions(self):
+        first = self.registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        second = self.registry.acquire('contacts', export_body('2019-02-01', '2019-03-01'))
+        self.registry.release(first)
+        self.registry.cleanup()
+
+        self.assertEqual(sorted(self.client.deleted), sorted([first, second]))
+        self.assertEqual(self.registry.idle, {})
+
+    def test_cleanup_keeps_definitions_still_needed(self):
+        first = self.registry.acquire('contacts', export_body('2019-01-01', '2019-02-01'))
+        second = self.registry.acquire('contacts', export_body('2019-02-01', '2019-03-01'))
+        self.registry.cleanup(keep={second})
+        self.assertEqual(self.client.deleted, [first])
+
+        self.registry.cleanup()
+        self.assertEqual(self.client.deleted, [first, second])
+
+    def test_adopted_definitions_are_cleaned_up_once(self):
+        self.registry.adopt('/contacts/exports/41')
+        self.registry.adopt('/contacts/exports/41')
+        self.registry.cleanup()
+        self.assertEqual(self.client.deleted, ['/contacts/exports/41'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import time
+import unittest
+
+from email.utils import formatdate
+from unittest import mock
+
+from tap_eloqua.client import EloquaClient
+from tap_eloqua.governor import AdaptiveLimit, RequestGovernor, TokenBucket, \
+    parse_retry_after, DEFAULT_THROTTLE_WAIT_SECS, MAX_THROTTLE_RETRIES, \
+    MIN_REQUESTS_PER_SECOND, RECOVERY_REQUESTS
+from tap_eloqua.instrumentation import REQUESTS, THROTTLED
+
+
+class StubResponse:
+
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {'Retry-After': retry_after} if retry_after else {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubSession:
+    """
+    Answers with the given status codes in turn, then with 200
+    """
+
+    def __init__(self, status_codes):
+        self.responses = [StubResponse(code, '0') for code in status_codes]
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if self.responses:
+            return self.responses.pop(0)
+        return StubResponse(200)
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('12'), 12.0)
+        self.assertEqual(parse_retry_after('-3'), 0.0)
+
+    def test_http_date(self):
+        wait = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+        self.assertTrue(25 < wait <= 30, wait)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0.0)
+
+    def test_missing_or_invalid_values_use_the_default(self):
+        self.assertEqual(parse_retry_after(None), DEFAULT_THROTTLE_WAIT_SECS)
+        self.assertEqual(parse_retry_after(''), DEFAULT_THROTTLE_WAIT_SECS)
+        self.assertEqual(parse_retry_after('soon'), DEFAULT_THROTTLE_WAIT_SECS)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_wait_for_the_rate(self):
+        bucket = TokenBucket(10, burst=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        wait = bucket.try_acquire()
+        self.assertTrue(0 < wait <= 0.1, wait)
+
+    def test_no_rate_allows_everything(self):
+        bucket = TokenBucket(None)
+        self.assertEqual([bucket.try_acquire() for _ in range(100)], [0] * 100)
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+
+    def test_reduce_blocks_new_holders_until_released(self):
+        limit = AdaptiveLimit('syncs', 4)
+        for _ in range(4):
+            self.assertTrue(limit.try_acquire())
+        limit.reduce()
+        self.assertEqual(limit.limit, 2)
+
+        limit.release()
+        limit.release()
+        self.assertFalse(limit.try_acquire())
+        limit.release()
+        self.assertTrue(limit.try_acquire())
+
+    def test_recover_grows_back_to_the_ceiling(self):
+        limit = AdaptiveLimit('exports', 4)
+        limit.reduce()
+        limit.reduce()
+        self.assertEqual(limit.limit, 1)
+        for _ in range(5):
+            limit.recover()
+        self.assertEqual(limit.limit, 4)
+
+    def test_unlimited_until_reduced(self):
+        limit = AdaptiveLimit('syncs')
+        for _ in range(6):
+            self.assertTrue(limit.try_acquire())
+        limit.reduce()
+        self.assertEqual(limit.limit, 3)
+        self.assertFalse(limit.try_acquire())
+
+    def test_waiters_are_woken_by_release_and_recover(self):
+        limit = AdaptiveLimit('syncs', 2)
+        calls = []
+        limit.add_waiter(lambda: calls.append(limit.limit))
+        limit.try_acquire()
+        limit.release()
+        limit.reduce()
+        limit.recover()
+        self.assertEqual(calls, [2, 2])
+
+        limit.remove_waiter(next(iter(limit.waiters)))
+        limit.release()
+        self.assertEqual(len(calls), 2)
+
+
+class RequestGovernorTest(unittest.TestCase):
+
+    def test_throttling_pauses_and_halves_the_rate(self):
+        governor = RequestGovernor(requests_per_second=8, max_syncs=4)
+        governor.throttled('30', governor.syncs)
+
+        self.assertTrue(29 < governor.reserve() <= 30)
+        self.assertEqual(governor.bucket.rate, 4)
+        self.assertEqual(governor.syncs.limit, 2)
+        self.assertEqual(governor.exports.limit, None)
+
+    def test_rate_never_drops_below_the_minimum(self):
+        governor = RequestGovernor(requests_per_second=1)
+        for _ in range(5):
+            governor.throttled('0')
+        self.assertEqual(governor.bucket.rate, MIN_REQUESTS_PER_SECOND)
+
+    def test_successes_grow_the_rate_back_to_the_ceiling(self):
+        governor = RequestGovernor(requests_per_second=10)
+        governor.throttled('0')
+        self.assertEqual(governor.bucket.rate, 5)
+
+        for _ in range(RECOVERY_REQUESTS - 1):
+            governor.succeeded()
+        self.assertEqual(governor.bucket.rate, 5)
+        governor.succeeded()
+        self.assertAlmostEqual(governor.bucket.rate, 5.5)
+
+        for _ in range(RECOVERY_REQUESTS * 20):
+            governor.succeeded()
+        self.assertEqual(governor.bucket.rate, 10)
+
+    def test_from_config(self):
+        governor = RequestGovernor.from_config({
+            'max_requests_per_second': '0', 'max_concurrent_syncs': '3'
+        })
+        self.assertEqual([governor.reserve() for _ in range(100)], [0] * 100)
+        self.assertEqual(governor.syncs.limit, 3)
+        self.assertIsNone(governor.exports.limit)
+
+
+class ThrottledRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(EloquaClient, 'build_base_url',
+                                    return_value='https://site')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build_client(self, status_codes):
+        return EloquaClient(
+            {'sitename': 'site', 'username': 'user', 'password': 'secret'},
+            session=StubSession(status_codes)
+        )
+
+    def test_throttled_responses_are_retried(self):
+        client = self.build_client([429, 503])
+        limit = AdaptiveLimit('syncs', 4)
+        limit.try_acquire()
+
+        with client.request_tags('contacts'):
+            response = client.send('POST', 'https://site/syncs', throttle_limit=limit)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.calls, 3)
+        self.assertEqual(client.governor.throttled_count, 2)
+        self.assertEqual(limit.limit, 1)
+        self.assertEqual(client.metrics.counters[(REQUESTS, 'contacts')], 3)
+        self.assertEqual(client.metrics.counters[(THROTTLED, 'contacts')], 2)
+
+    def test_last_throttled_response_is_returned(self):
+        client = self.build_client([429] * (MAX_THROTTLE_RETRIES + 1))
+        with mock.patch('tap_eloqua.governor.time.sleep'):
+            response = client.send('GET', 'https://site/syncs/1')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.closed)
+        self.assertEqual(client.session.calls, MAX_THROTTLE_RETRIES + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tap_eloqua.instrumentation import PhaseMetrics, BYTES, PAGE_DOWNLOAD, REQUESTS, \
+    SYNC_WAIT, escape_label
+
+
+class PhaseMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.object(PhaseMetrics, 'log')
+        self.log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_phases_are_totalled_by_stream(self):
+        phase_metrics = PhaseMetrics()
+        phase_metrics.record_phase(SYNC_WAIT, 10.0, 'contacts', '2019-08-01 00:00:00')
+        phase_metrics.record_phase(SYNC_WAIT, 30.0, 'contacts', '2019-08-02 00:00:00')
+        phase_metrics.record_phase(SYNC_WAIT, 5.0, 'opens')
+
+        phases = phase_metrics.summary()['phases'][SYNC_WAIT]
+        self.assertEqual(phases['contacts'],
+                         {'count': 2, 'seconds': 40.0, 'max_seconds': 30.0})
+        self.assertEqual(phases['opens'], {'count': 1, 'seconds': 5.0, 'max_seconds': 5.0})
+
+    def test_phase_is_timed_when_the_body_raises(self):
+        phase_metrics = PhaseMetrics()
+        with self.assertRaises(ValueError):
+            with phase_metrics.phase(PAGE_DOWNLOAD, 'contacts'):
+                raise ValueError()
+        self.assertEqual(phase_metrics.phases[(PAGE_DOWNLOAD, 'contacts')]['count'], 1)
+
+    def test_counters_log_tagged_metrics(self):
+        phase_metrics = PhaseMetrics()
+        phase_metrics.count(BYTES, 100, 'contacts', '2019-08-01 00:00:00')
+        phase_metrics.count(REQUESTS, 1, log=False)
+        phase_metrics.count(REQUESTS, 1, log=False)
+
+        self.assertEqual(phase_metrics.summary()['counters'], {
+            BYTES: {'contacts': 100}, REQUESTS: {'all': 2}
+        })
+        self.log.assert_called_once_with(
+            'counter', BYTES, 100, 'contacts', '2019-08-01 00:00:00'
+        )
+
+    def test_summary_files(self):
+        phase_metrics = PhaseMetrics(
+            json_path=os.path.join(self.directory, 'metrics.json'),
+            prometheus_path=os.path.join(self.directory, 'metrics.prom')
+        )
+        phase_metrics.record_phase(SYNC_WAIT, 12.5, 'contacts')
+        phase_metrics.count(REQUESTS, 3, 'contacts')
+        phase_metrics.write()
+
+        with open(phase_metrics.json_path) as json_file:
+            summary = json.load(json_file)
+        self.assertEqual(summary['counters'], {REQUESTS: {'contacts': 3}})
+
+        with open(phase_metrics.prometheus_path) as prometheus_file:
+            lines = prometheus_file.read().splitlines()
+        self.assertIn('# TYPE tap_eloqua_phase_seconds_total counter', lines)
+        self.assertIn('tap_eloqua_phase_seconds_total{phase="sync_wait",stream="contacts"} 12.5',
+                      lines)
+        self.assertIn('tap_eloqua_requests_total{stream="contacts"} 3', lines)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['metrics.json', 'metrics.prom'])
+
+    def test_escape_label(self):
+        self.assertEqual(escape_label('a"b\\c\nd'), 'a\\"b\\\\c\\nd')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+from tap_eloqua.output import BufferedOutput, ThreadOutputRouter, iter_batches, \
+    load_json_encoder
+
+
+class RecordingStdout:
+    """
+    Keeps each write separately
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+class BufferedOutputTest(unittest.TestCase):
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+    def test_load_json_encoder(self):
+        name, dumps = load_json_encoder()
+        self.assertEqual(name, 'json')
+        self.assertEqual(dumps({'a': 'ø'}), json.dumps({'a': 'ø'}))
+        self.assertIn(load_json_encoder('auto')[0], ('orjson', 'ujson', 'json'))
+        with self.assertRaises(ValueError):
+            load_json_encoder('simplejson')
+
+    def test_lines_are_written_in_batches(self):
+        output = BufferedOutput(batch_size=2)
+        stdout = RecordingStdout()
+        with mock.patch('sys.stdout', stdout):
+            count = output.write_lines('line %s\n' % index for index in range(5))
+
+        self.assertEqual(count, 5)
+        self.assertEqual(stdout.writes, [
+            'line 0\nline 1\n', 'line 2\nline 3\n', 'line 4\n'
+        ])
+        self.assertEqual(output.records, 5)
+        self.assertEqual(output.bytes, 35)
+
+    def test_from_config(self):
+        output = BufferedOutput.from_config({
+            'output_buffer_size': '4096', 'output_batch_size': '0'
+        })
+        self.assertEqual(output.buffer_size, 4096)
+        self.assertEqual(output.batch_size, 1)
+        self.assertEqual(output.encoder_name, 'json')
+
+    def test_install_buffers_stdout_until_uninstalled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'out.jsonl')
+
+        with io.open(path, 'w', encoding='utf-8') as target, \
+                mock.patch('sys.stdout', target):
+            output = BufferedOutput(buffer_size=1024 * 1024)
+            output.install()
+            self.assertIsNot(sys.stdout, target)
+            output.write_lines(['{"type": "RECORD", "record": {"a": "ø"}}\n'])
+            print('{"type": "STATE"}')
+            self.assertEqual(os.path.getsize(path), 0)
+
+            output.uninstall()
+            self.assertIs(sys.stdout, target)
+            output.uninstall()
+
+        with io.open(path, encoding='utf-8') as written:
+            self.assertEqual(written.read().splitlines(), [
+                '{"type": "RECORD", "record": {"a": "ø"}}', '{"type": "STATE"}'
+            ])
+
+
+class ThreadOutputRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = io.StringIO()
+        patcher = mock.patch('sys.stdout', self.stdout)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ThreadOutputRouter()
+        self.router.install()
+        self.addCleanup(self.router.uninstall)
+
+    def test_each_thread_writes_to_its_own_target(self):
+        targets = [io.StringIO() for _ in range(3)]
+        barrier = threading.Barrier(len(targets))
+
+        def sync_site(index):
+            self.router.bind(targets[index])
+            barrier.wait()
+            for line in range(100):
+                print('site %s line %s' % (index, line))
+            self.router.unbind()
+            print('site %s done' % index)
+
+        threads = [threading.Thread(target=sync_site, args=(index,))
+                   for index in range(len(targets))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index, target in enumerate(targets):
+            self.assertEqual(target.getvalue().splitlines(),
+                             ['site %s line %s' % (index, line) for line in range(100)])
+        self.assertEqual(sorted(self.stdout.getvalue().splitlines()),
+                         ['site 0 done', 'site 1 done', 'site 2 done'])
+
+    def test_unbound_threads_write_to_the_replaced_stdout(self):
+        self.assertIs(sys.stdout, self.router)
+        print('unbound')
+        self.router.uninstall()
+        self.assertIs(sys.stdout, self.stdout)
+        self.assertEqual(self.stdout.getvalue(), 'unbound\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import random
+import threading
+import time
+import unittest
+
+from tap_eloqua.pages import PageFetcher
+from tap_eloqua.streaming import JSONItemStream
+
+
+class FakeExportClient:
+    """
+    Serves pages of numbered records, slowest first, so later pages often
+    finish before earlier ones
+    """
+
+    def __init__(self, failing_offset=None):
+        self.failing_offset = failing_offset
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def fetch_bulk_export_records(self, sync_uri, offset, limit, run):
+        with self.lock:
+            self.requested.append(offset)
+        time.sleep(random.uniform(0, 0.01) + (0.02 if offset % 20 == 0 else 0))
+        if offset == self.failing_offset:
+            raise RuntimeError('page failed')
+        return [{'id': str(index)} for index in range(offset, offset + limit)], True, None
+
+
+def split_chunks(data, sizes):
+    """
+    Cuts bytes into chunks of the given sizes, cycling through them
+    """
+    chunks = []
+    position = 0
+    index = 0
+    while position < len(data):
+        size = sizes[index % len(sizes)]
+        chunks.append(data[position:position + size])
+        position += size
+        index += 1
+    return chunks
+
+
+class PageFetcherTest(unittest.TestCase):
+
+    def test_pages_come_back_in_offset_order(self):
+        fetcher = PageFetcher(FakeExportClient(), 10, max_workers=4)
+        try:
+            pages = list(fetcher.fetch_remaining('/syncs/1', 95, 10))
+        finally:
+            fetcher.shutdown()
+
+        self.assertEqual([page[0]['id'] for page in pages],
+                         [str(offset) for offset in range(10, 95, 10)])
+
+    def test_failed_page_stops_the_fetch(self):
+        client = FakeExportClient(failing_offset=30)
+        fetcher = PageFetcher(client, 10, max_workers=2)
+        pages = []
+        try:
+            with self.assertRaises(RuntimeError):
+                for page in fetcher.fetch_remaining('/syncs/1', 100, 0):
+                    pages.append(page)
+        finally:
+            fetcher.shutdown()
+
+        self.assertEqual([page[0]['id'] for page in pages], ['0', '10', '20'])
+        self.assertLessEqual(max(client.requested), 50)
+
+
+class JSONItemStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.page = {
+            'totalResults': 3,
+            'limit': 50000,
+            'items': [
+                {'c_emailaddress': 'ann@example.com', 'c_datemodified': '2019-08-06 04:29:15.440'},
+                {'c_emailaddress': 'bo@example.com', 'note': 'café ☃ "quoted" ,]}'},
+                {'c_emailaddress': 'cy@example.com', 'score': 12345.5, 'flags': [1, None, True]}
+            ],
+            'hasMore': False
+        }
+        self.data = json.dumps(self.page, ensure_ascii=False).encode('utf-8')
+
+    def test_every_chunk_boundary(self):
+        for size in range(1, 40):
+            stream = JSONItemStream(split_chunks(self.data, [size]))
+            self.assertEqual(list(stream), self.page['items'], size)
+            self.assertEqual(stream.fields['hasMore'], False)
+            self.assertEqual(stream.fields['totalResults'], 3)
+
+    def test_uneven_chunks(self):
+        stream = JSONItemStream(split_chunks(self.data, [3, 1, 7, 2, 64]))
+        self.assertEqual(list(stream), self.page['items'])
+
+    def test_number_split_across_chunks(self):
+        data = b'{"items": [1234567, 89], "totalResults": 2}'
+        stream = JSONItemStream(split_chunks(data, [15, 3]))
+        self.assertEqual(list(stream), [1234567, 89])
+        self.assertEqual(stream.fields['totalResults'], 2)
+
+    def test_empty_and_missing_items(self):
+        self.assertEqual(list(JSONItemStream([b'{"items": [], "hasMore": false}'])), [])
+        self.assertEqual(list(JSONItemStream([b'{"items": null}'])), [])
+        self.assertEqual(list(JSONItemStream([b'{}'])), [])
+
+    def test_truncated_page_raises(self):
+        with self.assertRaises(ValueError):
+            list(JSONItemStream([self.data[:-20]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
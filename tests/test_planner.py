@@ -0,0 +1,91 @@
+import unittest
+
+import pendulum
+
+from tap_eloqua.planner import MIN_WINDOW_SECS, WindowPlanner, density_key
+
+
+class WindowPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start = pendulum.parse('2019-01-01T00:00:00+00:00')
+        self.planner = WindowPlanner(target_rows=1000)
+
+    def test_unknown_density_uses_default_months(self):
+        end = pendulum.parse('2019-03-15T00:00:00+00:00')
+        windows = self.planner.plan('opens', self.start, end, default_months=1)
+        self.assertEqual(
+            [(start.isoformat(), window_end.isoformat()) for start, window_end in windows],
+            [('2019-01-01T00:00:00+00:00', '2019-02-01T00:00:00+00:00'),
+             ('2019-02-01T00:00:00+00:00', '2019-03-01T00:00:00+00:00'),
+             ('2019-03-01T00:00:00+00:00', '2019-03-15T00:00:00+00:00')]
+        )
+
+    def test_unknown_density_without_default_is_one_window(self):
+        end = pendulum.parse('2019-03-15T00:00:00+00:00')
+        self.assertEqual(self.planner.plan('opens', self.start, end), [(self.start, end)])
+
+    def test_windows_sized_from_density(self):
+        end = self.start.add(hours=10)
+        self.planner.record('opens', self.start, end, 2500)
+
+        windows = self.planner.plan('opens', self.start, end)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[0][0], self.start)
+        self.assertEqual(windows[-1][1], end)
+        self.assertEqual((windows[0][1] - windows[0][0]).total_seconds(), 4 * 3600)
+        for (_, first_end), (second_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(first_end, second_start)
+
+    def test_windows_never_shorter_than_the_minimum(self):
+        end = self.start.add(hours=1)
+        self.planner.record('opens', self.start, end, 10 ** 9)
+
+        windows = self.planner.plan('opens', self.start, end)
+        self.assertEqual(len(windows), 3600 // MIN_WINDOW_SECS)
+
+    def test_density_is_averaged(self):
+        self.planner.record('opens', self.start, self.start.add(hours=1), 100)
+        self.planner.record('opens', self.start, self.start.add(hours=1), 300)
+        self.assertEqual(self.planner.densities['opens'], 200)
+        self.assertEqual(
+            self.planner.estimate('opens', self.start, self.start.add(hours=3)), 600
+        )
+        self.assertIsNone(self.planner.estimate('clicks', self.start, self.start.add(hours=3)))
+
+    def test_split_fits_the_target(self):
+        end = self.start.add(hours=9)
+        windows = self.planner.split(self.start, end, 2500)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[0], (self.start, self.start.add(hours=3)))
+        self.assertEqual(windows[-1][1], end)
+
+    def test_split_makes_at_least_two_windows(self):
+        end = self.start.add(hours=2)
+        self.assertEqual(len(self.planner.split(self.start, end, 1001)), 2)
+
+
+class DensityKeyTest(unittest.TestCase):
+
+    def test_filter_fields_learn_separate_densities(self):
+        planner = WindowPlanner(target_rows=1000)
+        start = pendulum.parse('2019-08-01T00:00:00+00:00')
+        end = start.add(hours=10)
+        modified = density_key('contacts', 'c_datemodified')
+        created = density_key('contacts', 'c_datecreated')
+        planner.record(modified, start, end, 10000)
+        planner.record(created, start, end, 100)
+
+        self.assertEqual(planner.estimate(modified, start, end), 10000)
+        self.assertEqual(planner.estimate(created, start, end), 100)
+        self.assertEqual(len(planner.plan(modified, start, end)), 10)
+        self.assertEqual(len(planner.plan(created, start, end)), 1)
+
+    def test_load_history_skips_densities_by_stream_alone(self):
+        planner = WindowPlanner()
+        planner.load_history({'contacts': 50.0, 'contacts:c_datemodified': 20})
+        self.assertEqual(planner.densities, {'contacts:c_datemodified': 20.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
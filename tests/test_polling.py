@@ -0,0 +1,110 @@
+import unittest
+
+from tap_eloqua.polling import PollingPolicy
+
+
+class FakeClockPolicy(PollingPolicy):
+    """
+    Policy whose clock only moves when the test advances it
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.clock = 0.0
+
+    def now(self):
+        return self.clock
+
+
+class PollingPolicyTest(unittest.TestCase):
+
+    def test_delays_grow_to_the_cap(self):
+        policy = FakeClockPolicy(first_delay=5, multiplier=2, max_delay=30,
+                                 deadline=1000, jitter=0)
+        delays = policy.delays('opens')
+        self.assertEqual([next(delays) for _ in range(5)], [5, 10, 20, 30, 30])
+
+    def test_deadline_counts_time_outside_sleeps(self):
+        policy = FakeClockPolicy(first_delay=10, multiplier=1, max_delay=10,
+                                 deadline=100, jitter=0)
+        delays = []
+        for delay in policy.delays('opens'):
+            delays.append(delay)
+            # Each status request takes as long as the sleep before it
+            policy.clock += delay * 2
+        self.assertEqual(delays, [10] * 5)
+
+    def test_last_delay_stops_at_the_deadline(self):
+        policy = FakeClockPolicy(first_delay=40, multiplier=1, max_delay=40,
+                                 deadline=100, jitter=0)
+        delays = []
+        for delay in policy.delays('opens'):
+            delays.append(delay)
+            policy.clock += delay
+        self.assertEqual(delays, [40, 40, 20])
+
+    def test_first_delay_without_history(self):
+        policy = PollingPolicy(first_delay=5)
+        self.assertEqual(policy.first_delay_for('opens', 1000), 5)
+
+    def test_first_delay_scales_with_expected_rows(self):
+        policy = PollingPolicy(first_delay=5, deadline=6000)
+        policy.record('contacts', 1000.0, 1000000)
+
+        self.assertEqual(policy.first_delay_for('contacts', 1000000), 800)
+        self.assertEqual(policy.first_delay_for('contacts', 100000), 80)
+        self.assertEqual(policy.first_delay_for('contacts', 100), 5)
+
+    def test_first_delay_never_exceeds_the_typical_sync(self):
+        policy = PollingPolicy(first_delay=5, deadline=6000)
+        policy.record('contacts', 100.0, 1000)
+        self.assertEqual(policy.first_delay_for('contacts', 1000000), 80)
+
+    def test_first_delay_without_estimate(self):
+        policy = PollingPolicy(first_delay=5)
+        policy.record('contacts', 1000.0, 1000000)
+        self.assertEqual(policy.first_delay_for('contacts'), 5)
+
+    def test_record_without_rows_is_ignored(self):
+        policy = PollingPolicy()
+        policy.record('opens', 100.0, None)
+        self.assertEqual(policy.sync_durations, {})
+
+    def test_record_averages_observations(self):
+        policy = PollingPolicy()
+        policy.record('opens', 100.0, 1000)
+        policy.record('opens', 300.0, 3000)
+        self.assertEqual(policy.sync_durations['opens'],
+                         {'seconds': 200.0, 'rows': 2000.0})
+
+    def test_learns_the_rows_the_sync_returned(self):
+        policy = PollingPolicy(first_delay=5, deadline=6000)
+        # The planner expected a million rows; the sync returned a thousand
+        policy.synced('/syncs/1', 'contacts', 100.0)
+        self.assertEqual(policy.sync_durations, {})
+
+        policy.observe_rows('/syncs/1', 1000)
+        policy.observe_rows('/syncs/1', 1000)
+        self.assertEqual(policy.sync_durations['contacts'],
+                         {'seconds': 100.0, 'rows': 1000.0})
+        self.assertEqual(policy.first_delay_for('contacts', 1000), 80)
+
+    def test_forgotten_sync_is_not_learned(self):
+        policy = PollingPolicy()
+        policy.synced('/syncs/1', 'contacts', 100.0)
+        policy.forget('/syncs/1')
+        policy.observe_rows('/syncs/1', 1000)
+        self.assertEqual(policy.sync_durations, {})
+
+    def test_load_history_skips_durations_without_rows(self):
+        policy = PollingPolicy()
+        policy.load_history({
+            'opens': 120.0,
+            'sends': {'seconds': 60, 'rows': 500}
+        })
+        self.assertEqual(policy.sync_durations,
+                         {'sends': {'seconds': 60.0, 'rows': 500.0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tap_eloqua.profiling import Profiler, SHARED_PROFILER, ALL_PHASES, \
+    TRANSFORM, WRITE
+
+
+class Transformer:
+
+    def transform(self, record):
+        return dict((key, str(value)) for key, value in record.items())
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_writes_only_profiles_with_data(self):
+        profiler = Profiler(self.directory, phases=[TRANSFORM, WRITE], memory=False)
+        profiler.start()
+        transformer = profiler.wrap(Transformer(), 'transform', TRANSFORM)
+        for index in range(100):
+            transformer.transform({'id': index})
+        # Switched off before it ever ran
+        profiler.switch(WRITE, False)
+        profiler.stop()
+
+        written = sorted(os.listdir(profiler.directory))
+        phase = ALL_PHASES if SHARED_PROFILER else TRANSFORM
+        self.assertEqual(written, [phase + '.prof', phase + '.txt'])
+
+    def test_stop_does_not_raise(self):
+        profiler = Profiler(self.directory, memory=False)
+        profiler.start()
+        shutil.rmtree(profiler.directory)
+        profiler.wrap(Transformer(), 'transform', TRANSFORM).transform({'id': 1})
+        profiler.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
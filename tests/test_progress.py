@@ -0,0 +1,52 @@
+import threading
+import unittest
+
+import pendulum
+
+from tap_eloqua.progress import ExportProgress, IN_FLIGHT_KEY, \
+    in_flight_export_uris
+
+
+class ExportProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = {}
+        self.saves = []
+        self.progress = ExportProgress(
+            self.state, 'contacts', self.save, threading.RLock(), checkpoint_pages=3
+        )
+        self.window = self.progress.add_window(
+            pendulum.parse('2019-01-01T00:00:00+00:00'),
+            pendulum.parse('2019-02-01T00:00:00+00:00')
+        )
+
+    def save(self):
+        window = self.state[IN_FLIGHT_KEY]['contacts']['windows'][0]
+        self.saves.append((window['offset'], window['complete']))
+
+    def test_offset_is_saved_every_checkpoint(self):
+        for page in range(1, 8):
+            self.progress.mark_written(self.window, page * 100)
+        self.assertEqual(self.saves, [(300, False), (600, False)])
+
+    def test_completed_window_is_saved(self):
+        self.progress.mark_written(self.window, 100)
+        self.progress.mark_complete(self.window)
+        self.assertEqual(self.saves, [(100, True)])
+
+    def test_in_flight_export_uris(self):
+        self.progress.mark_synced(self.window, 'shards:id,/syncs/1,/syncs/2',
+                                  '/contacts/exports/1,/contacts/exports/2')
+        done = self.progress.add_window(
+            pendulum.parse('2019-02-01T00:00:00+00:00'),
+            pendulum.parse('2019-03-01T00:00:00+00:00')
+        )
+        self.progress.mark_synced(done, '/syncs/3', '/contacts/exports/3')
+        self.progress.mark_complete(done)
+
+        self.assertEqual(in_flight_export_uris(self.state),
+                         {'/contacts/exports/1', '/contacts/exports/2'})
+
+
+if __name__ == '__main__':
+    unittest.main()
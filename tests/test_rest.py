@@ -0,0 +1,217 @@
+import unittest
+
+from unittest import mock
+
+import pendulum
+
+from tap_eloqua.client import EloquaClient, build_rest_record, format_rest_date, \
+    site_timestamp
+from tap_eloqua.executor import EloquaExecutor
+
+# Bulk contact fields by rest field id, as rest_contact_fields maps them
+FIELDS = {
+    '100001': ('c_emailaddress', False),
+    '100002': ('c_firstname', False),
+    '100006': ('c_datecreated', True),
+    '100007': ('c_datemodified', True),
+    '100200': ('c_lead_score', False),
+    '100201': ('c_last_visit', True)
+}
+FIELD_NAMES = set(name for name, _ in FIELDS.values()) | set([
+    'contactid', 'c_company', 'c_city', 'c_state_prov', 'c_busphone'
+])
+
+# One contact as a bulk export of a US Eastern site returns it
+BULK_RECORD = {
+    'contactid': '4242',
+    'c_emailaddress': 'ann@example.com',
+    'c_firstname': 'Ann',
+    'c_company': 'Acme',
+    'c_city': 'Boston',
+    'c_state_prov': 'MA',
+    'c_busphone': '555-0100',
+    'c_datecreated': '2019-01-15 09:30:00.000',
+    'c_datemodified': '2019-08-06 04:29:15.000',
+    'c_lead_score': '12',
+    'c_last_visit': '2019-08-05 23:10:00.000'
+}
+# The same contact from the rest api; January is EST, August is EDT
+REST_CONTACT = {
+    'type': 'Contact',
+    'id': '4242',
+    'emailAddress': 'ann@example.com',
+    'firstName': 'Ann',
+    'accountName': 'Acme',
+    'city': 'Boston',
+    'province': 'MA',
+    'businessPhone': '555-0100',
+    'createdAt': '1547562600',
+    'updatedAt': '1565080155',
+    'fieldValues': [
+        {'type': 'FieldValue', 'id': '100200', 'value': '12'},
+        {'type': 'FieldValue', 'id': '100201', 'value': '1565061000'}
+    ]
+}
+
+
+class RestRecordTest(unittest.TestCase):
+
+    def test_rest_contact_matches_bulk_record(self):
+        record = build_rest_record(REST_CONTACT, FIELDS, FIELD_NAMES, 'America/New_York')
+        self.assertEqual(record, BULK_RECORD)
+
+    def test_dates_use_the_site_time_zone(self):
+        self.assertEqual(format_rest_date('1565080155', 'UTC'), '2019-08-06 08:29:15.000')
+        self.assertIsNone(format_rest_date(''))
+
+    def test_window_dates_are_site_local(self):
+        # A bookmark from the bulk record filters from the contact's update
+        bookmark = pendulum.parse('2019-08-06 04:29:15')
+        self.assertEqual(site_timestamp(bookmark, 'America/New_York'),
+                         int(REST_CONTACT['updatedAt']))
+        self.assertEqual(site_timestamp(bookmark, 'UTC'), 1565065755)
+
+
+class ChangingContactsClient:
+    """
+    Lists contacts as the rest api does, from `updated_since` in updatedAt
+    order, applying one edit to the data after each request
+    """
+    page_size = 2
+
+    def __init__(self, contacts, edits):
+        """
+        Args:
+            contacts (dict): updatedAt by contact id
+            edits (list): updatedAt changes by contact id, one per request
+        """
+        self.contacts = dict(contacts)
+        self.edits = list(edits)
+        self.requests = []
+
+    def fetch_rest_contacts(self, stream, start_date, end_date, updated_since=None,
+                            page=1):
+        self.requests.append((updated_since, page))
+        listed = sorted(
+            (updated_at, contact_id) for contact_id, updated_at in self.contacts.items()
+            if updated_at >= (updated_since or 0)
+        )
+        keys = listed[(page - 1) * self.page_size:page * self.page_size]
+        records = [
+            {'contactid': contact_id,
+             'c_datemodified': '2019-08-01 00:%02d:00.000' % updated_at}
+            for updated_at, contact_id in keys
+        ]
+        if self.edits:
+            self.contacts.update(self.edits.pop(0))
+        return records, keys, len(keys) == self.page_size, len(listed)
+
+
+class RestExecutor(EloquaExecutor):
+    """
+    Executor reading rest windows into a list
+    """
+
+    def __init__(self, client, rest_max_rows=10):
+        self.config = {'rest_max_rows': rest_max_rows}
+        self.client = client
+        self.profiler = None
+        self.sink = None
+        self.planner = mock.Mock()
+        self.written = []
+
+    def write_records(self, stream, records, window=None):
+        self.written.extend(
+            (record['contactid'], record['c_datemodified'][14:16]) for record in records
+        )
+
+
+class FakeStream:
+    stream = 'contacts'
+    meta_fields = {
+        'key_properties': ['contactid'],
+        'replication_key': 'c_datemodified'
+    }
+
+
+class RestPagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start = pendulum.parse('2019-08-01 00:00:00')
+        self.end = pendulum.parse('2019-08-01 01:00:00')
+
+    def test_contacts_edited_between_pages_are_not_lost(self):
+        client = ChangingContactsClient(
+            {'a': 1, 'b': 2, 'c': 3, 'd': 4, 'e': 5},
+            # a read contact moves to the end of the listing, which would
+            # shift the later pages back by one
+            [{'a': 6}]
+        )
+        executor = RestExecutor(client)
+        latest = executor.sync_rest_window(FakeStream, self.start, self.end, None)
+
+        self.assertEqual(executor.written, [
+            ('a', '01'), ('b', '02'), ('c', '03'), ('d', '04'), ('e', '05'), ('a', '06')
+        ])
+        self.assertEqual(latest, '2019-08-01 00:06:00')
+        self.assertEqual([page for _, page in client.requests], [1] * 6)
+
+    def test_contacts_sharing_a_timestamp_are_paged(self):
+        client = ChangingContactsClient({'a': 1, 'b': 1, 'c': 1, 'd': 2}, [])
+        executor = RestExecutor(client)
+        executor.sync_rest_window(FakeStream, self.start, self.end, None)
+
+        self.assertEqual(sorted(executor.written), [
+            ('a', '01'), ('b', '01'), ('c', '01'), ('d', '02')
+        ])
+        self.assertEqual(client.requests, [(None, 1), (1, 1), (1, 2), (2, 1)])
+
+    def test_large_windows_fall_back_to_bulk(self):
+        client = ChangingContactsClient(dict((str(n), n) for n in range(30)), [])
+        executor = RestExecutor(client, rest_max_rows=10)
+
+        self.assertIs(executor.sync_rest_window(FakeStream, self.start, self.end, None), False)
+        self.assertEqual(executor.written, [])
+        executor.planner.record.assert_not_called()
+
+
+class FetchRestContactsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(EloquaClient, 'build_base_url',
+                                    return_value='https://site')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = EloquaClient({'sitename': 'site', 'username': 'user',
+                                    'password': 'secret', 'site_timezone': 'UTC'})
+        self.client.rest_contact_fields = mock.Mock(return_value={})
+        self.client.make_request = mock.Mock()
+
+    def test_paging_stops_at_the_window_end(self):
+        start = pendulum.parse('2019-08-06 00:00:00')
+        end = pendulum.parse('2019-08-07 00:00:00')
+        end_timestamp = site_timestamp(end, 'UTC')
+        self.client.make_request.return_value.json.return_value = {
+            'elements': [
+                {'id': '1', 'updatedAt': str(end_timestamp - 1)},
+                {'id': '2', 'updatedAt': str(end_timestamp)},
+                {'id': '3', 'updatedAt': str(end_timestamp + 1)}
+            ],
+            'total': 1
+        }
+        records, keys, has_more, total = self.client.fetch_rest_contacts(
+            FakeStream, start, end, 1565000000, page_size=3
+        )
+
+        self.assertEqual([record['contactid'] for record in records], ['1'])
+        self.assertEqual(keys, [(end_timestamp - 1, '1')])
+        self.assertFalse(has_more)
+        self.assertEqual(total, 1)
+        params = self.client.make_request.call_args[0][0]['params']
+        self.assertEqual(params['lastUpdatedAt'], 1565000000)
+        self.assertEqual(params['page'], 1)
+        self.assertEqual(params['search'], "updatedAt<'%s'" % end_timestamp)
+
+
+if __name__ == '__main__':
+    unittest.main()
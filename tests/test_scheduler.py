@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tap_eloqua.scheduler import ExportScheduler
+
+
+class FakeSiteClient:
+
+    def __init__(self, name, started, lock):
+        self.name = name
+        self.started = started
+        self.lock = lock
+
+    def request_bulk_export(self, stream, start_date, end_date, event,
+                            expected_rows=None):
+        with self.lock:
+            self.started.append(self.name)
+        time.sleep(0.01)
+        return '%s/syncs/%s' % (self.name, start_date)
+
+
+class ExportSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.started = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def scheduler(self, name, max_in_flight=1):
+        client = FakeSiteClient(name, self.started, self.lock)
+        return ExportScheduler(client, max_in_flight, self.pool)
+
+    def test_sites_take_turns_in_the_shared_pool(self):
+        first = self.scheduler('a')
+        second = self.scheduler('b')
+        exports = [first.submit(None, day, None, None) for day in range(4)]
+        exports += [second.submit(None, day, None, None) for day in range(4)]
+
+        self.assertEqual([export.result(5) for export in exports],
+                         ['a/syncs/%s' % day for day in range(4)] +
+                         ['b/syncs/%s' % day for day in range(4)])
+        # The second site's first export runs beside the first site's
+        # rather than behind its whole backlog
+        self.assertEqual(sorted(self.started[:2]), ['a', 'b'])
+
+    def test_shutdown_cancels_waiting_exports(self):
+        scheduler = self.scheduler('a')
+        exports = [scheduler.submit(None, day, None, None) for day in range(3)]
+        scheduler.shutdown()
+
+        self.assertEqual(exports[0].result(5), 'a/syncs/0')
+        self.assertTrue(all(export.cancelled() for export in exports[1:]))
+
+    def test_failed_export_lets_the_next_one_run(self):
+        scheduler = self.scheduler('a')
+        scheduler.client.request_bulk_export = self.failing_export(scheduler.client)
+        exports = [scheduler.submit(None, day, None, None) for day in range(2)]
+
+        with self.assertRaises(RuntimeError):
+            exports[0].result(5)
+        self.assertEqual(exports[1].result(5), 'a/syncs/1')
+
+    @staticmethod
+    def failing_export(client):
+        export = client.request_bulk_export
+
+        def request_bulk_export(stream, start_date, *args):
+            if start_date == 0:
+                raise RuntimeError('sync failed')
+            return export(stream, start_date, *args)
+        return request_bulk_export
+
+
+if __name__ == '__main__':
+    unittest.main()
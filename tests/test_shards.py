@@ -0,0 +1,135 @@
+import threading
+import unittest
+
+from tap_eloqua.shards import ShardMerger, ShardMismatchException, \
+    add_join_field, build_sharded_uri, parse_sharded_uri, split_export_body
+
+
+def group_rows(ids, field):
+    return [{'contactid': str(row_id), field: '%s-%s' % (field, row_id)} for row_id in ids]
+
+
+class ShardMergerTest(unittest.TestCase):
+
+    def test_groups_in_different_orders_merge_into_full_records(self):
+        merger = ShardMerger('contactid', 2)
+        first = [1, 2, 3, 4, 5, 6]
+        second = [6, 4, 2, 5, 3, 1]
+        records = []
+        for offset in range(0, 6, 2):
+            records.extend(merger.merge(offset, 2, [
+                group_rows(first[offset:offset + 2], 'c_emailaddress'),
+                group_rows(second[offset:offset + 2], 'c_firstname')
+            ], 6))
+
+        self.assertEqual(sorted(records, key=lambda record: int(record['contactid'])), [
+            {'contactid': str(row_id),
+             'c_emailaddress': 'c_emailaddress-%s' % row_id,
+             'c_firstname': 'c_firstname-%s' % row_id}
+            for row_id in range(1, 7)
+        ])
+
+    def test_partial_rows_are_carried_to_the_next_page(self):
+        merger = ShardMerger('contactid', 2)
+        page = merger.merge(0, 2, [
+            group_rows([1, 2], 'c_emailaddress'), group_rows([2, 3], 'c_firstname')
+        ], 4)
+        self.assertEqual([record['contactid'] for record in page], ['2'])
+
+        page = merger.merge(2, 2, [
+            group_rows([3, 4], 'c_emailaddress'), group_rows([1, 4], 'c_firstname')
+        ], 4)
+        self.assertEqual(sorted(record['contactid'] for record in page), ['1', '3', '4'])
+        for record in page:
+            self.assertEqual(set(record), {'contactid', 'c_emailaddress', 'c_firstname'})
+
+    def test_unmatched_rows_after_the_last_page_raise(self):
+        merger = ShardMerger('contactid', 2)
+        merger.merge(0, 2, [
+            group_rows([1, 2], 'c_emailaddress'), group_rows([1, 3], 'c_firstname')
+        ], 4)
+        with self.assertRaises(ShardMismatchException):
+            merger.merge(2, 2, [
+                group_rows([3, 4], 'c_emailaddress'), group_rows([5, 4], 'c_firstname')
+            ], 4)
+
+    def test_rows_without_the_join_field_raise(self):
+        merger = ShardMerger('contactid', 2)
+        with self.assertRaises(ShardMismatchException):
+            merger.merge(0, 2, [[{'c_emailaddress': 'a'}], []], 1)
+
+    def test_pages_fetched_out_of_order_are_merged_in_order(self):
+        merger = ShardMerger('contactid', 2)
+        merged = []
+        lock = threading.Lock()
+
+        def merge(offset):
+            records = merger.merge(offset, 1, [
+                group_rows([offset], 'c_emailaddress'), group_rows([offset], 'c_firstname')
+            ], 4)
+            with lock:
+                merged.append(records[0]['contactid'])
+
+        threads = [threading.Thread(target=merge, args=(offset,)) for offset in (3, 1, 2, 0)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(merged, ['0', '1', '2', '3'])
+
+    def test_failed_page_releases_waiting_pages(self):
+        merger = ShardMerger('contactid', 2)
+        errors = []
+
+        def merge():
+            try:
+                merger.merge(1, 1, [[], []], 4)
+            except RuntimeError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=merge)
+        thread.start()
+        merger.fail(RuntimeError('page failed'))
+        thread.join(5)
+        self.assertEqual([str(exc) for exc in errors], ['page failed'])
+
+
+class SplitExportBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.body = {
+            'name': 'Eloqua contacts stream',
+            'fields': dict(('field%s' % index, '{{Contact.Field(F%s)}}' % index)
+                           for index in range(10)),
+            'filter': "'{{Contact.Field(C_DateModified)}}'>='2019-01-01'"
+        }
+
+    def test_join_field_is_added_to_every_group(self):
+        body, join_field = add_join_field('contacts', self.body)
+        self.assertEqual(join_field, 'contactid')
+        self.assertNotIn('contactid', self.body['fields'])
+
+        bodies = split_export_body(body, 4, [join_field, 'field0', 'field0'])
+        self.assertEqual(len(bodies), 5)
+        for group in bodies:
+            self.assertEqual(list(group['fields'])[:2], ['contactid', 'field0'])
+            self.assertEqual(group['filter'], self.body['filter'])
+        exported = set()
+        for group in bodies:
+            exported.update(group['fields'])
+        self.assertEqual(exported, set(body['fields']))
+
+    def test_existing_id_field_is_reused(self):
+        self.body['fields']['contact_id'] = '{{Contact.Id}}'
+        body, join_field = add_join_field('contacts', self.body)
+        self.assertEqual(join_field, 'contact_id')
+        self.assertIs(body, self.body)
+
+    def test_sharded_uri_round_trip(self):
+        uri = build_sharded_uri('contactid', ['/syncs/1', '/syncs/2'])
+        self.assertEqual(parse_sharded_uri(uri), ('contactid', ['/syncs/1', '/syncs/2']))
+        self.assertIsNone(parse_sharded_uri('/syncs/1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
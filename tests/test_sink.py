@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tap_eloqua.sink import FileSink, JOURNAL_FILE, MANIFEST_FILE, NO_COMPRESSION, \
+    window_partition
+
+
+class FakeStream:
+    stream = 'contacts'
+    schema = {'properties': {'id': {'type': ['null', 'string']}}}
+
+
+WINDOW = {'start': '2019-08-01T00:00:00+00:00', 'end': '2019-08-02T00:00:00+00:00'}
+NEXT_WINDOW = {'start': '2019-08-02T00:00:00+00:00', 'end': '2019-08-03T00:00:00+00:00'}
+
+
+class FileSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build_sink(self):
+        return FileSink(self.directory, compression=NO_COMPRESSION, encoder='json')
+
+    def write_page(self, sink, offset, window=WINDOW):
+        records = [{'id': str(index)} for index in range(offset, offset + 3)]
+        return sink.write_page(FakeStream, window, offset, records,
+                               transform=lambda record: record)
+
+    def manifest_path(self, window=WINDOW):
+        return os.path.join(self.directory, 'contacts', window_partition(window),
+                            MANIFEST_FILE)
+
+    def read_manifest(self, window=WINDOW):
+        with open(self.manifest_path(window)) as manifest_file:
+            return json.load(manifest_file)['files']
+
+    def test_pages_are_journaled_until_close(self):
+        sink = self.build_sink()
+        self.write_page(sink, 0)
+        self.write_page(sink, 3)
+
+        self.assertFalse(os.path.exists(self.manifest_path()))
+        with open(os.path.join(self.directory, JOURNAL_FILE)) as journal_file:
+            self.assertEqual(len(journal_file.readlines()), 2)
+
+        sink.close()
+        files = self.read_manifest()
+        self.assertEqual(sorted(entry['offset'] for entry in files.values()), [0, 3])
+        self.assertEqual(sum(entry['rows'] for entry in files.values()), 6)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, JOURNAL_FILE)))
+
+    def test_interrupted_journal_is_replayed(self):
+        sink = self.build_sink()
+        self.write_page(sink, 0)
+        sink.close()
+        self.write_page(sink, 3)
+        sink.journal.write('["contacts/cut')
+        sink.journal.close()
+
+        resumed = self.build_sink()
+        self.assertEqual(sorted(entry['offset'] for entry in self.read_manifest().values()),
+                         [0, 3])
+        self.assertEqual(resumed.files, {})
+        self.assertFalse(os.path.exists(os.path.join(self.directory, JOURNAL_FILE)))
+
+    def test_later_runs_only_touch_their_windows(self):
+        sink = self.build_sink()
+        self.write_page(sink, 0)
+        sink.close()
+        first_manifest = os.path.getmtime(self.manifest_path())
+
+        later = self.build_sink()
+        self.assertEqual(later.files, {})
+        self.write_page(later, 0, NEXT_WINDOW)
+        self.assertEqual(len(later.files), 1)
+        later.close()
+
+        self.assertEqual(later.files, {})
+        self.assertEqual(os.path.getmtime(self.manifest_path()), first_manifest)
+        self.assertEqual(list(self.read_manifest()), ['0000000000.ndjson'])
+        self.assertEqual(list(self.read_manifest(NEXT_WINDOW)), ['0000000000.ndjson'])
+
+
+if __name__ == '__main__':
+    unittest.main()
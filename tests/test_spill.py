@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tap_eloqua.spill import SpillBuffer
+
+
+def build_pages(page_count, page_size):
+    return [
+        [{'id': str(page * page_size + index)} for index in range(page_size)]
+        for page in range(page_count)
+    ]
+
+
+class SpillBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spilled_pages_come_back_in_order(self):
+        pages = build_pages(20, 50)
+        buffer = SpillBuffer(self.directory, memory_records=50, chunk_records=7)
+
+        drained = []
+        for page in buffer.drain(iter(pages)):
+            drained.append(list(page))
+            # A slow writer, so later chunks are spilled
+            time.sleep(0.002)
+
+        self.assertEqual(drained, pages)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_unread_records_are_skipped(self):
+        pages = build_pages(6, 20)
+        buffer = SpillBuffer(self.directory, memory_records=5, chunk_records=3)
+
+        firsts = [next(page) for page in buffer.drain(iter(pages))]
+        self.assertEqual(firsts, [page[0] for page in pages])
+
+    def test_consumer_can_stop_early(self):
+        pages = build_pages(50, 20)
+        buffer = SpillBuffer(self.directory, memory_records=5, chunk_records=3)
+
+        drained = buffer.drain(iter(pages))
+        self.assertEqual(list(next(drained)), pages[0])
+        drained.close()
+        self.assertEqual(list(drained), [])
+
+    def test_download_error_is_raised_after_earlier_pages(self):
+        def pages():
+            yield [{'id': '0'}]
+            raise RuntimeError('download failed')
+
+        drained = []
+        with self.assertRaises(RuntimeError):
+            for page in SpillBuffer(self.directory).drain(pages()):
+                drained.append(list(page))
+        self.assertEqual(drained, [[{'id': '0'}]])
+
+
+if __name__ == '__main__':
+    unittest.main()
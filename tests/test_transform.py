@@ -0,0 +1,105 @@
+import io
+import json
+import unittest
+
+from unittest import mock
+
+from tap_eloqua.output import BufferedOutput
+from tap_eloqua.transform import StringRecordTransformer, selected_properties
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'c_emailaddress': {'type': ['null', 'string']},
+        'c_datemodified': {'type': ['null', 'string']},
+        'c_score': {'type': ['null', 'string']},
+        'c_secret': {'type': ['null', 'string']},
+        'c_legacy': {'type': ['null', 'string']}
+    }
+}
+
+METADATA = [
+    {'breadcrumb': [], 'metadata': {'selected': True}},
+    {'breadcrumb': ['properties', 'c_secret'], 'metadata': {'selected': False}},
+    {'breadcrumb': ['properties', 'c_legacy'], 'metadata': {'inclusion': 'unsupported'}}
+]
+
+
+class StringRecordTransformerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transformer = StringRecordTransformer('contacts', SCHEMA, METADATA)
+
+    def test_supports_only_nullable_string_schemas(self):
+        self.assertTrue(StringRecordTransformer.supports(SCHEMA))
+        self.assertFalse(StringRecordTransformer.supports({'properties': {}}))
+        self.assertFalse(StringRecordTransformer.supports({'properties': {
+            'c_score': {'type': ['null', 'integer']}
+        }}))
+        self.assertFalse(StringRecordTransformer.supports({'properties': {
+            'c_datemodified': {'type': ['null', 'string'], 'format': 'date-time'}
+        }}))
+
+    def test_transform_drops_deselected_and_unknown_keys(self):
+        record = {
+            'c_datemodified': '2019-08-06 04:29:15.440',
+            'c_secret': 'hidden',
+            'c_emailaddress': 'ann@example.com',
+            'c_legacy': 'old',
+            'c_unknown': 'extra',
+            'c_score': None
+        }
+        transformed = self.transformer.transform(record)
+        self.assertEqual(list(transformed.items()), [
+            ('c_datemodified', '2019-08-06 04:29:15.440'),
+            ('c_emailaddress', 'ann@example.com'),
+            ('c_score', None)
+        ])
+
+    def test_transform_converts_other_values_to_strings(self):
+        transformed = self.transformer.transform({'c_score': 12.5, 'c_emailaddress': True})
+        self.assertEqual(transformed, {'c_score': '12.5', 'c_emailaddress': 'True'})
+
+    def test_write_emits_record_messages(self):
+        records = [
+            {'c_emailaddress': 'ann@example.com', 'c_secret': 'hidden'},
+            {'c_emailaddress': 'bø@example.com', 'c_score': 3}
+        ]
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout):
+            count = self.transformer.write(records)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            [json.loads(line) for line in stdout.getvalue().splitlines()],
+            [{'type': 'RECORD', 'stream': 'contacts',
+              'record': {'c_emailaddress': 'ann@example.com'}},
+             {'type': 'RECORD', 'stream': 'contacts',
+              'record': {'c_emailaddress': 'bø@example.com', 'c_score': '3'}}]
+        )
+
+    def test_default_encoder_matches_singer_byte_for_byte(self):
+        record = {'c_emailaddress': 'bø@example.com', 'c_score': '3'}
+        transformer = StringRecordTransformer('contacts', SCHEMA, METADATA, BufferedOutput())
+        line = next(transformer.encode([record]))
+        # singer's format_message
+        self.assertEqual(line, json.dumps(
+            {'type': 'RECORD', 'stream': 'contacts', 'record': record}
+        ) + '\n')
+
+    def test_automatic_properties_are_kept_when_deselected(self):
+        metadata = [
+            {'breadcrumb': ['properties', 'c_datemodified'],
+             'metadata': {'inclusion': 'automatic', 'selected': False}},
+            {'breadcrumb': ['properties', 'c_emailaddress'],
+             'metadata': {'inclusion': 'automatic'}},
+            {'breadcrumb': ['properties', 'c_score'],
+             'metadata': {'inclusion': 'available', 'selected': False}}
+        ]
+        self.assertEqual(selected_properties(SCHEMA, metadata), frozenset([
+            'c_datemodified', 'c_emailaddress', 'c_secret', 'c_legacy'
+        ]))
+
+
+if __name__ == '__main__':
+    unittest.main()